@@ -0,0 +1,120 @@
+"""
+ASR 线程到事件循环的消息桥
+
+ASR 工作线程把转写结果放入线程安全队列，同一批次只唤醒一次事件循环；
+事件循环线程批量取出消息并依次交给处理函数（WebSocket 广播、触发机制等），
+使这些共享状态只在事件循环线程中修改。记录每条消息从入队到被处理的交接延迟。
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# 交接延迟的统计窗口（条）
+LATENCY_WINDOW = 512
+
+
+class AsrBridge:
+    """
+    线程安全的批量消息桥
+
+    Args:
+        name: 日志标签
+    """
+
+    def __init__(self, name: str = "ASR桥接"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._queue: Deque[Tuple[float, Dict]] = deque()
+        self._scheduled = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handlers: List[Callable[[Dict], None]] = []
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {"submitted": 0, "delivered": 0, "batches": 0, "max_batch": 0, "dropped": 0, "handler_errors": 0}
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """绑定事件循环（服务启动时调用）"""
+        self._loop = loop
+
+    def add_handler(self, handler: Callable[[Dict], None]):
+        """注册处理函数 handler(消息)，在事件循环线程中调用，不应阻塞"""
+        self._handlers.append(handler)
+
+    def submit(self, message: Dict) -> bool:
+        """
+        从任意线程提交一条消息
+
+        Returns:
+            是否已入队（事件循环未运行时丢弃）
+        """
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            with self._lock:
+                self._stats["dropped"] += 1
+            return False
+        with self._lock:
+            self._queue.append((time.perf_counter(), message))
+            self._stats["submitted"] += 1
+            if self._scheduled:
+                return True
+            self._scheduled = True
+        try:
+            loop.call_soon_threadsafe(self._drain)
+        except RuntimeError:
+            # 事件循环已关闭
+            with self._lock:
+                self._scheduled = False
+                self._stats["dropped"] += len(self._queue)
+                self._queue.clear()
+            return False
+        return True
+
+    def _drain(self):
+        """在事件循环线程中批量处理队列中的消息"""
+        with self._lock:
+            batch = list(self._queue)
+            self._queue.clear()
+            self._scheduled = False
+        if not batch:
+            return
+
+        now = time.perf_counter()
+        for enqueued_at, message in batch:
+            self._latencies.append(now - enqueued_at)
+            for handler in self._handlers:
+                try:
+                    handler(message)
+                except Exception as e:
+                    self._stats["handler_errors"] += 1
+                    logger.error(f"[{self.name}] 处理消息失败: {e}")
+
+        with self._lock:
+            self._stats["delivered"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = dict(self._stats)
+            stats["pending"] = len(self._queue)
+        stats["avg_batch"] = round(stats["delivered"] / stats["batches"], 2) if stats["batches"] else 0.0
+        if latencies:
+            stats["handoff_ms"] = {
+                "avg": round(sum(latencies) / len(latencies) * 1000, 3),
+                "p90": round(latencies[int(0.9 * (len(latencies) - 1))] * 1000, 3),
+                "max": round(latencies[-1] * 1000, 3)
+            }
+        else:
+            stats["handoff_ms"] = {"avg": 0.0, "p90": 0.0, "max": 0.0}
+        return stats
+
+
+# 全局 ASR 消息桥
+asr_bridge = AsrBridge()
@@ -1,36 +1,188 @@
-import json
-import os
+import bisect
+import copy
+import threading
 import uuid
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from chat_store import CHAT_DB_FILE, LEGACY_HISTORY_FILE, ChatStore, compress_messages, message_preview
 from logger_config import setup_logger
+from persistence import persistence
 
 logger = setup_logger(__name__)
 
-CHAT_HISTORY_FILE = "data/chat_history.json"
+# 旧版 JSON 历史文件，首次启动时迁移至 SQLite
+CHAT_HISTORY_FILE = LEGACY_HISTORY_FILE
+
+# 超过该天数未更新的聊天归档为压缩块（配置项 chat_archive_days，0 表示不归档）
+DEFAULT_ARCHIVE_DAYS = 30
+# 内存中最多缓存的聊天消息数（按最近访问淘汰已落盘的聊天）
+MAX_CACHED_CHATS = 32
 
 class ChatManager:
-    def __init__(self):
-        self.file_path = CHAT_HISTORY_FILE
-        # 确保 data 目录存在
-        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
-        self.data = self._load_data()
-
-    def _load_data(self):
-        if os.path.exists(self.file_path):
+    def __init__(self, db_path=CHAT_DB_FILE):
+        self.store = ChatStore(db_path, legacy_path=CHAT_HISTORY_FILE)
+        # 内存中的状态是权威数据：元数据常驻，消息在首次访问时从数据库加载；
+        # 修改只登记到后台持久化队列，由后台线程把差异写入数据库
+        self._lock = threading.Lock()
+        self.chats = {chat["id"]: chat for chat in self.store.list_chats()}
+        # 按 (updated_at, id) 升序维护的索引，列表分页无需每次排序
+        self._order = sorted((chat["updated_at"], chat_id) for chat_id, chat in self.chats.items())
+        self.current_chat_id = self.store.get_meta("current_chat_id")
+        # chat_id -> 消息列表，按最近访问排序
+        self._messages = OrderedDict()
+        # 已落盘的状态 (消息列表, 落盘时的长度)：后台线程据此计算需要写入的差异；
+        # 末尾追加时原地扩展同一列表，落盘长度之后的部分即待写入的消息
+        self._persisted = {}
+        self._persisted_ids = set(self.chats)
+        # 数据库中以归档块保存的聊天（由后台线程维护）
+        self._archived_on_disk = {chat_id for chat_id, chat in self.chats.items() if chat.get("archived")}
+        # 变更监听（如全文索引）：listener(chat_id, start, messages)，聊天删除时 messages 为 None；
+        # 归档只改变存储形式、不改变消息内容，不发出通知（检索与 prompt 缓存照常有效）
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, chat_id, start, messages):
+        for listener in self._listeners:
             try:
-                with open(self.file_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
+                listener(chat_id, start, messages)
             except Exception as e:
-                logger.error(f"加载聊天历史错误: {e}")
-                return {"current_chat_id": None, "chats": {}}
-        return {"current_chat_id": None, "chats": {}}
+                logger.error(f"聊天变更回调失败: {e}")
+
+    def _load_messages(self, chat_id):
+        """读取聊天消息（未缓存时从数据库或归档块加载）"""
+        with self._lock:
+            messages = self._messages.get(chat_id)
+            if messages is not None:
+                self._messages.move_to_end(chat_id)
+                return messages
+            # 持锁读取，避免与后台归档交错
+            if self.chats.get(chat_id, {}).get("archived"):
+                messages = self.store.load_archive(chat_id)
+            else:
+                messages = self.store.load_messages(chat_id)
+            self._messages[chat_id] = messages
+            self._persisted[chat_id] = (messages, len(messages))
+            self._evict_cached()
+        return messages
+
+    def _evict_cached(self):
+        """缓存超出上限时淘汰最久未访问、且已全部落盘的聊天（调用方持有锁）"""
+        excess = len(self._messages) - MAX_CACHED_CHATS
+        for chat_id in list(self._messages):
+            if excess <= 0:
+                break
+            if chat_id != self.current_chat_id and self._is_persisted(chat_id):
+                del self._messages[chat_id]
+                del self._persisted[chat_id]
+                excess -= 1
+
+    def _is_persisted(self, chat_id):
+        """缓存的消息是否已全部落盘（调用方持有锁）"""
+        messages = self._messages.get(chat_id)
+        persisted, length = self._persisted.get(chat_id, (None, 0))
+        return messages is not None and persisted is messages and length == len(messages)
+
+    def _schedule_sync(self, chat_id):
+        persistence.submit(f"chat:{chat_id}", lambda: self._sync_chat(chat_id))
+
+    def _schedule_current_sync(self):
+        persistence.submit("chat:current", self._sync_current)
+
+    def _sync_chat(self, chat_id):
+        """在后台线程中把聊天的最新状态写入数据库（只写入与已落盘消息不同的尾部）"""
+        with self._lock:
+            meta = dict(self.chats[chat_id]) if chat_id in self.chats else None
+            messages = self._messages.get(chat_id)
+            persisted, persisted_length = self._persisted.get(chat_id, ([], 0))
+            # 之后原地追加的消息留给下一次同步
+            length = len(messages) if messages is not None else 0
 
-    def _save_data(self):
-        try:
-            with open(self.file_path, "w", encoding="utf-8") as f:
-                json.dump(self.data, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"保存聊天历史错误: {e}")
+        if meta is None:
+            if chat_id in self._persisted_ids:
+                self.store.delete_chat(chat_id)
+                self._persisted_ids.discard(chat_id)
+                self._archived_on_disk.discard(chat_id)
+            with self._lock:
+                self._persisted.pop(chat_id, None)
+            return
+
+        if chat_id not in self._persisted_ids:
+            self.store.create_chat(meta)
+            self._persisted_ids.add(chat_id)
+        if messages is None:
+            return
+
+        # 已归档的聊天被修改后整体写回消息表（此时 persisted 为空），并删除归档块
+        unarchive = chat_id in self._archived_on_disk and not meta.get("archived")
+        limit = min(persisted_length, length)
+        if persisted is messages:
+            # 同一列表只会在末尾追加
+            prefix = limit
+        else:
+            prefix = 0
+            while prefix < limit and persisted[prefix] is messages[prefix]:
+                prefix += 1
+        if not unarchive and prefix == persisted_length == length:
+            with self._lock:
+                if self._messages.get(chat_id) is messages:
+                    self._persisted[chat_id] = (messages, length)
+            return
+        self.store.replace_tail(
+            chat_id, prefix, messages[prefix:length], meta["updated_at"], meta.get("preview", ""), unarchive=unarchive
+        )
+        self._archived_on_disk.discard(chat_id)
+        with self._lock:
+            self._persisted[chat_id] = (messages, length)
+
+    def _sync_current(self):
+        with self._lock:
+            current_chat_id = self.current_chat_id
+        self.store.set_meta("current_chat_id", current_chat_id)
+
+    def _save_messages(self, chat_id, messages):
+        """更新内存中的消息：与现有消息相同的前缀沿用原对象，只复制变化的尾部"""
+        stored = self._load_messages(chat_id)
+        prefix = 0
+        limit = min(len(stored), len(messages))
+        # 增量请求传回的历史沿用已保存的对象，先比较身份即可跳过逐字段比较
+        while prefix < limit and (stored[prefix] is messages[prefix] or stored[prefix] == messages[prefix]):
+            prefix += 1
+        # 保存副本，调用方之后修改传入的列表不会影响已保存的内容
+        updated = stored[:prefix] + copy.deepcopy(messages[prefix:])
+        with self._lock:
+            self._messages[chat_id] = updated
+            meta = self.chats[chat_id]
+            if meta.get("archived"):
+                # 修改归档聊天：恢复为普通聊天，后台整体写回消息表（监听方仍只需处理变化的尾部）
+                meta["archived"] = False
+                self._persisted[chat_id] = ([], 0)
+            self._reindex(chat_id, meta["updated_at"], datetime.now().isoformat())
+            meta["message_count"] = len(updated)
+            meta["preview"] = message_preview(updated)
+        self._schedule_sync(chat_id)
+        self._notify(chat_id, prefix, updated[prefix:])
+
+    def _reindex(self, chat_id, old_updated_at, new_updated_at):
+        """更新排序索引中的位置（调用方持有锁）"""
+        if old_updated_at is not None:
+            index = bisect.bisect_left(self._order, (old_updated_at, chat_id))
+            if index < len(self._order) and self._order[index] == (old_updated_at, chat_id):
+                del self._order[index]
+        if new_updated_at is not None:
+            bisect.insort(self._order, (new_updated_at, chat_id))
+            self.chats[chat_id]["updated_at"] = new_updated_at
+
+    def _chat_view(self, chat_id):
+        meta = self.chats[chat_id]
+        return {
+            "id": meta["id"],
+            "title": meta["title"],
+            "created_at": meta["created_at"],
+            "updated_at": meta["updated_at"],
+            "messages": list(self._load_messages(chat_id))
+        }
 
     def create_chat(self, title="新聊天"):
         chat_id = str(uuid.uuid4())
@@ -42,51 +194,230 @@ class ChatManager:
             "updated_at": now,
             "messages": []
         }
-        self.data["chats"][chat_id] = new_chat
-        self.data["current_chat_id"] = chat_id
-        self._save_data()
+        with self._lock:
+            self.chats[chat_id] = {k: v for k, v in new_chat.items() if k != "messages"}
+            self.chats[chat_id]["message_count"] = 0
+            self.chats[chat_id]["preview"] = ""
+            self._reindex(chat_id, None, now)
+            self._messages[chat_id] = []
+            self.current_chat_id = chat_id
+        self._schedule_sync(chat_id)
+        self._schedule_current_sync()
         return new_chat
 
     def get_chat(self, chat_id):
-        return self.data["chats"].get(chat_id)
+        if chat_id not in self.chats:
+            return None
+        return self._chat_view(chat_id)
+
+    def list_chat_index(self, limit=None, cursor=None):
+        """
+        聊天索引（不含消息），按更新时间倒序，支持游标分页
+
+        Args:
+            limit: 每页数量，None 表示全部
+            cursor: 上一页返回的 next_cursor
 
-    def get_all_chats(self):
-        # Return list of chats sorted by updated_at desc
-        chats = list(self.data["chats"].values())
-        chats.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-        return chats
+        Returns:
+            (索引条目列表, 下一页游标或 None)
+        """
+        with self._lock:
+            end = len(self._order)
+            if cursor:
+                updated_at, _, chat_id = cursor.rpartition("|")
+                end = bisect.bisect_left(self._order, (updated_at, chat_id))
+            start = 0 if limit is None else max(0, end - limit)
+            keys = self._order[start:end]
+            items = [
+                {
+                    "id": chat_id,
+                    "title": self.chats[chat_id]["title"],
+                    "created_at": self.chats[chat_id]["created_at"],
+                    "updated_at": updated_at,
+                    "message_count": self.chats[chat_id].get("message_count", 0),
+                    "preview": self.chats[chat_id].get("preview", ""),
+                    "archived": self.chats[chat_id].get("archived", False)
+                }
+                for updated_at, chat_id in reversed(keys)
+            ]
+        next_cursor = f"{keys[0][0]}|{keys[0][1]}" if keys and start > 0 else None
+        return items, next_cursor
+
+    def get_messages_page(self, chat_id, limit, before=None):
+        """
+        按位置倒序分页读取消息
+
+        Args:
+            limit: 返回的消息数量上限
+            before: 只返回位置小于该值的消息，None 表示从最新消息开始
+
+        Returns:
+            {"messages", "start", "total", "has_more"}；聊天不存在时返回 None
+        """
+        meta = self.chats.get(chat_id)
+        if meta is None:
+            return None
+        total = meta.get("message_count", 0)
+        end = total if before is None else max(0, min(before, total))
+        start = max(0, end - limit)
+        cached = self._messages.get(chat_id)
+        if cached is not None:
+            messages = cached[start:end]
+        elif meta.get("archived"):
+            # 归档聊天透明解压并缓存
+            messages = self._load_messages(chat_id)[start:end]
+        else:
+            # 未缓存的聊天没有待落盘的修改，直接读取数据库中的范围
+            messages = self.store.load_messages(chat_id, start, end)
+        return {"messages": messages, "start": start, "total": total, "has_more": start > 0}
+
+    def get_history_prefix(self, chat_id, end):
+        """前端只加载了部分历史时，取回位置 end 之前的已保存消息"""
+        if chat_id not in self.chats or end <= 0:
+            return []
+        return list(self._load_messages(chat_id)[:end])
+
+    def append_messages(self, chat_id, messages):
+        """
+        在聊天末尾追加消息：原地扩展缓存的消息列表，只复制新消息，不复制已有历史
+
+        Returns:
+            聊天不存在时返回 False
+        """
+        if chat_id not in self.chats:
+            return False
+        stored = self._load_messages(chat_id)
+        added = copy.deepcopy(messages)
+        with self._lock:
+            meta = self.chats.get(chat_id)
+            in_place = meta is not None and not meta.get("archived") and self._messages.get(chat_id) is stored
+            if in_place:
+                start = len(stored)
+                stored.extend(added)
+                self._reindex(chat_id, meta["updated_at"], datetime.now().isoformat())
+                meta["message_count"] = len(stored)
+                meta["preview"] = message_preview(stored)
+        if not in_place:
+            # 归档聊天（需整体写回）或加载后被并发替换：按完整列表保存
+            return self.update_chat_messages(chat_id, self._load_messages(chat_id) + added)
+        self._schedule_sync(chat_id)
+        self._notify(chat_id, start, added)
+        return True
+
+    def ensure_system_prompt(self, chat_id, content):
+        """确保聊天的第一条消息为给定的系统提示词；已一致时不做任何修改"""
+        if chat_id not in self.chats:
+            return False
+        messages = self._load_messages(chat_id)
+        system = {"role": "system", "content": content}
+        if messages and messages[0].get("role") == "system":
+            if messages[0].get("content") == content:
+                return True
+            return self.update_chat_messages(chat_id, [system] + messages[1:])
+        return self.update_chat_messages(chat_id, [system] + messages)
 
     def update_chat_messages(self, chat_id, messages):
-        if chat_id in self.data["chats"]:
-            self.data["chats"][chat_id]["messages"] = messages
-            self.data["chats"][chat_id]["updated_at"] = datetime.now().isoformat()
-            self._save_data()
+        if chat_id in self.chats:
+            self._save_messages(chat_id, messages)
             return True
         return False
 
     def delete_chat(self, chat_id):
-        if chat_id in self.data["chats"]:
-            del self.data["chats"][chat_id]
-            if self.data["current_chat_id"] == chat_id:
-                self.data["current_chat_id"] = None
-            self._save_data()
+        if chat_id in self.chats:
+            with self._lock:
+                self._reindex(chat_id, self.chats[chat_id]["updated_at"], None)
+                del self.chats[chat_id]
+                self._messages.pop(chat_id, None)
+                was_current = self.current_chat_id == chat_id
+                if was_current:
+                    self.current_chat_id = None
+            self._schedule_sync(chat_id)
+            if was_current:
+                self._schedule_current_sync()
+            self._notify(chat_id, 0, None)
             return True
         return False
 
     def clear_chat_messages(self, chat_id):
-        if chat_id in self.data["chats"]:
-            self.data["chats"][chat_id]["messages"] = []
-            self.data["chats"][chat_id]["updated_at"] = datetime.now().isoformat()
-            self._save_data()
+        if chat_id in self.chats:
+            self._save_messages(chat_id, [])
             return True
         return False
 
     def set_current_chat(self, chat_id):
-        if chat_id in self.data["chats"]:
-            self.data["current_chat_id"] = chat_id
-            self._save_data()
+        if chat_id in self.chats:
+            if self.current_chat_id != chat_id:
+                with self._lock:
+                    self.current_chat_id = chat_id
+                self._schedule_current_sync()
             return True
         return False
 
+    def close(self):
+        """关闭数据库连接（调用方应先等待后台持久化队列落盘）"""
+        self.store.close()
+
     def get_current_chat_id(self):
-        return self.data.get("current_chat_id")
+        return self.current_chat_id
+
+    def archive_cold_chats(self, days=DEFAULT_ARCHIVE_DAYS):
+        """
+        登记归档任务：超过 days 天未更新的聊天压缩为单个归档块，只保留索引条目
+
+        归档在后台持久化线程中执行；归档聊天被访问时透明解压，被修改时恢复为普通聊天。
+
+        Returns:
+            候选聊天数量
+        """
+        if not days or days <= 0:
+            return 0
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self._lock:
+            end = bisect.bisect_left(self._order, (cutoff, ""))
+            candidates = [
+                chat_id for _, chat_id in self._order[:end]
+                if not self.chats[chat_id].get("archived") and chat_id != self.current_chat_id
+            ]
+        if candidates:
+            persistence.submit("chat:archive", lambda: self._archive_chats(candidates, cutoff))
+        return len(candidates)
+
+    def _archive_chats(self, chat_ids, cutoff):
+        archived = []
+        for chat_id in chat_ids:
+            try:
+                if self._archive_chat(chat_id, cutoff):
+                    archived.append(chat_id)
+            except Exception as e:
+                logger.error(f"[聊天归档] 归档 {chat_id} 失败: {e}")
+        if archived:
+            logger.info(f"[聊天归档] 已归档 {len(archived)} 个聊天")
+
+    def _archive_chat(self, chat_id, cutoff):
+        """在后台线程中归档单个聊天；期间聊天被访问修改则放弃"""
+        with self._lock:
+            meta = self.chats.get(chat_id)
+            if meta is None or meta.get("archived") or chat_id not in self._persisted_ids:
+                return False
+            updated_at = meta["updated_at"]
+            cached = self._messages.get(chat_id)
+            if cached is not None and not self._is_persisted(chat_id):
+                # 有尚未落盘的修改
+                return False
+        if updated_at >= cutoff:
+            return False
+
+        # 压缩不持锁：未缓存时数据库中的消息即最新状态
+        messages = cached if cached is not None else self.store.load_messages(chat_id)
+        codec, blob = compress_messages(messages)
+
+        with self._lock:
+            meta = self.chats.get(chat_id)
+            if meta is None or meta["updated_at"] != updated_at or chat_id == self.current_chat_id:
+                return False
+            self.store.archive_chat(chat_id, codec, blob, datetime.now().isoformat())
+            meta["archived"] = True
+            self._archived_on_disk.add(chat_id)
+            self._messages.pop(chat_id, None)
+            self._persisted.pop(chat_id, None)
+        return True
@@ -0,0 +1,286 @@
+"""
+聊天记录存储引擎
+
+基于 SQLite (WAL 模式) 按消息逐行存储聊天记录：追加一条消息只写入该消息本身，
+每次修改在单个事务中完成，进程崩溃或断电不会留下写了一半的文件。
+首次启动时自动迁移旧的 data/chat_history.json。
+长期未更新的聊天可归档为单个压缩块（安装 zstandard 时使用 zstd，否则 gzip），
+只保留其索引条目。
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+CHAT_DB_FILE = "data/chat_history.db"
+LEGACY_HISTORY_FILE = "data/chat_history.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS chats (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    preview TEXT NOT NULL DEFAULT '',
+    archived INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (chat_id, seq)
+);
+CREATE TABLE IF NOT EXISTS archives (
+    chat_id TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    data BLOB NOT NULL,
+    archived_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chats_updated ON chats(updated_at DESC);
+"""
+
+
+PREVIEW_LENGTH = 60
+# 补全摘要时从末尾读取的消息数（系统消息只出现在开头）
+PREVIEW_SCAN_MESSAGES = 16
+
+
+def _dumps(message: Dict) -> str:
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+def message_preview(messages: List[Dict]) -> str:
+    """最后一条非系统消息的摘要，用于聊天列表"""
+    for message in reversed(messages):
+        if message.get("role") != "system":
+            content = str(message.get("content", "")).strip().replace("\n", " ")
+            return content[:PREVIEW_LENGTH]
+    return ""
+
+
+def compress_messages(messages: List[Dict]) -> Tuple[str, bytes]:
+    raw = json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if ZSTD_AVAILABLE:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(raw)
+    return "gzip", gzip.compress(raw, compresslevel=6)
+
+
+def decompress_messages(codec: str, blob: bytes) -> List[Dict]:
+    if codec == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("归档使用 zstd 压缩，但未安装 zstandard")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = gzip.decompress(blob)
+    return json.loads(raw.decode("utf-8"))
+
+
+class ChatStore:
+    """
+    聊天记录的 SQLite 存储（线程安全）
+
+    Args:
+        db_path: 数据库文件路径
+        legacy_path: 旧版 JSON 历史文件，数据库为空时自动导入
+    """
+
+    def __init__(self, db_path: str = CHAT_DB_FILE, legacy_path: Optional[str] = LEGACY_HISTORY_FILE):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 下 NORMAL 同步即可保证崩溃一致性，仅可能丢失最后一次提交
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._upgrade_schema()
+        if legacy_path:
+            self._migrate_legacy(legacy_path)
+
+    # ---- 事务 ----
+
+    def _write(self, statements):
+        """在单个事务中执行 [(sql, params), ...]"""
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ---- 迁移 ----
+
+    def _upgrade_schema(self):
+        columns = {row[1] for row in self._query("PRAGMA table_info(chats)")}
+        if "preview" not in columns:
+            self._write([("ALTER TABLE chats ADD COLUMN preview TEXT NOT NULL DEFAULT ''", ())])
+            self._backfill_previews()
+        if "archived" not in columns:
+            self._write([("ALTER TABLE chats ADD COLUMN archived INTEGER NOT NULL DEFAULT 0", ())])
+
+    def _backfill_previews(self):
+        """为升级前的聊天补全列表摘要（取最后一条非系统消息）"""
+        statements = []
+        for (chat_id,) in self._query("SELECT id FROM chats"):
+            rows = self._query(
+                "SELECT data FROM messages WHERE chat_id = ? ORDER BY seq DESC LIMIT ?", (chat_id, PREVIEW_SCAN_MESSAGES)
+            )
+            preview = message_preview([json.loads(r[0]) for r in reversed(rows)])
+            if preview:
+                statements.append(("UPDATE chats SET preview = ? WHERE id = ?", (preview, chat_id)))
+        if statements:
+            self._write(statements)
+            logger.info(f"[聊天存储] 已为 {len(statements)} 个聊天补全列表摘要")
+
+    def _migrate_legacy(self, legacy_path: str):
+        if not os.path.exists(legacy_path):
+            return
+        if self._query("SELECT value FROM meta WHERE key = 'migrated_from_json'"):
+            return
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+        except Exception as e:
+            logger.error(f"[聊天存储] 读取旧版聊天历史失败，跳过迁移: {e}")
+            return
+
+        statements = []
+        chats = legacy.get("chats", {})
+        for chat_id, chat in chats.items():
+            messages = chat.get("messages", [])
+            statements.append((
+                "INSERT OR REPLACE INTO chats (id, title, created_at, updated_at, message_count, preview) VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, chat.get("title", "新聊天"), chat.get("created_at", ""), chat.get("updated_at", ""),
+                 len(messages), message_preview(messages))
+            ))
+            statements.extend(
+                ("INSERT OR REPLACE INTO messages (chat_id, seq, data) VALUES (?, ?, ?)", (chat_id, seq, _dumps(msg)))
+                for seq, msg in enumerate(messages)
+            )
+        statements.append(("INSERT OR REPLACE INTO meta (key, value) VALUES ('current_chat_id', ?)", (legacy.get("current_chat_id"),)))
+        statements.append(("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)", (legacy_path,)))
+        self._write(statements)
+
+        # 保留旧文件作为备份，避免再次被读取
+        backup_path = legacy_path + ".migrated"
+        try:
+            os.replace(legacy_path, backup_path)
+        except OSError as e:
+            logger.warning(f"[聊天存储] 旧版聊天历史备份失败: {e}")
+        logger.info(f"[聊天存储] 已迁移 {len(chats)} 个聊天至 {self.db_path}（旧文件备份为 {backup_path}）")
+
+    # ---- 读取 ----
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def list_chats(self) -> List[Dict]:
+        """所有聊天的元数据（不含消息），按更新时间倒序"""
+        rows = self._query(
+            "SELECT id, title, created_at, updated_at, message_count, preview, archived FROM chats ORDER BY updated_at DESC"
+        )
+        return [
+            {"id": r[0], "title": r[1], "created_at": r[2], "updated_at": r[3], "message_count": r[4], "preview": r[5],
+             "archived": bool(r[6])}
+            for r in rows
+        ]
+
+    def load_messages(self, chat_id: str, start: int = 0, end: Optional[int] = None) -> List[Dict]:
+        """读取 [start, end) 范围内的消息"""
+        if end is None:
+            rows = self._query("SELECT data FROM messages WHERE chat_id = ? AND seq >= ? ORDER BY seq", (chat_id, start))
+        else:
+            rows = self._query(
+                "SELECT data FROM messages WHERE chat_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (chat_id, start, end)
+            )
+        return [json.loads(r[0]) for r in rows]
+
+    # ---- 写入 ----
+
+    def set_meta(self, key: str, value: Optional[str]):
+        self._write([("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))])
+
+    def create_chat(self, chat: Dict):
+        self._write([(
+            "INSERT OR IGNORE INTO chats (id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, 0)",
+            (chat["id"], chat["title"], chat["created_at"], chat["updated_at"])
+        )])
+
+    def replace_tail(
+        self, chat_id: str, start: int, messages: List[Dict], updated_at: str, preview: str = "", unarchive: bool = False
+    ):
+        """
+        从 start 位置起替换消息（追加时 start 等于原消息数，只写入新消息）
+
+        Args:
+            start: 保留的前缀长度
+            messages: start 之后的新消息
+            preview: 聊天列表中显示的最后一条消息摘要
+            unarchive: 已归档的聊天被修改，同一事务中删除归档块（此时 start 应为 0）
+        """
+        statements = [("DELETE FROM messages WHERE chat_id = ? AND seq >= ?", (chat_id, start))]
+        statements.extend(
+            ("INSERT INTO messages (chat_id, seq, data) VALUES (?, ?, ?)", (chat_id, start + offset, _dumps(msg)))
+            for offset, msg in enumerate(messages)
+        )
+        statements.append((
+            "UPDATE chats SET updated_at = ?, message_count = ?, preview = ? WHERE id = ?",
+            (updated_at, start + len(messages), preview, chat_id)
+        ))
+        if unarchive:
+            statements.append(("DELETE FROM archives WHERE chat_id = ?", (chat_id,)))
+            statements.append(("UPDATE chats SET archived = 0 WHERE id = ?", (chat_id,)))
+        self._write(statements)
+
+    def archive_chat(self, chat_id: str, codec: str, blob: bytes, archived_at: str):
+        """把聊天的全部消息替换为一个压缩块"""
+        self._write([
+            ("INSERT OR REPLACE INTO archives (chat_id, codec, data, archived_at) VALUES (?, ?, ?, ?)",
+             (chat_id, codec, blob, archived_at)),
+            ("DELETE FROM messages WHERE chat_id = ?", (chat_id,)),
+            ("UPDATE chats SET archived = 1 WHERE id = ?", (chat_id,))
+        ])
+
+    def load_archive(self, chat_id: str) -> List[Dict]:
+        rows = self._query("SELECT codec, data FROM archives WHERE chat_id = ?", (chat_id,))
+        if not rows:
+            return []
+        return decompress_messages(rows[0][0], rows[0][1])
+
+    def delete_chat(self, chat_id: str):
+        self._write([
+            ("DELETE FROM messages WHERE chat_id = ?", (chat_id,)),
+            ("DELETE FROM archives WHERE chat_id = ?", (chat_id,)),
+            ("DELETE FROM chats WHERE id = ?", (chat_id,))
+        ])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
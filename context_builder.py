@@ -0,0 +1,315 @@
+"""
+分析窗口上下文构建器
+
+按目标模型的 tokenizer（API 模型使用快速估算）计算 token，
+从最新消息向前打包到预算上限；更早的对话折叠进滚动摘要，
+摘要在分析结束后增量更新（不在触发的关键路径上），并在多次触发间复用。
+本次增量中超出预算、未进入打包窗口的消息以抽取式摘要立即并入本次分析的摘要，不会被跳过。
+"""
+
+import asyncio
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# 默认预算（token）
+DEFAULT_CONTEXT_TOKEN_BUDGET = 1500
+DEFAULT_SUMMARY_TOKEN_BUDGET = 300
+# 每条消息的格式化开销（XML 标签/角色标记）
+MESSAGE_OVERHEAD_TOKENS = 6
+# 折叠进摘要时单条消息保留的最大字符数
+SUMMARY_LINE_MAX_CHARS = 60
+
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+_LATIN_WORD_PATTERN = re.compile(r'[A-Za-z]+')
+_OTHER_TOKEN_PATTERN = re.compile(r'\d+|[^\sA-Za-z\d぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """快速估算 token 数：CJK 每字约 1 token，拉丁单词约 1.3 token，数字/标点各计 1"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    words = len(_LATIN_WORD_PATTERN.findall(text))
+    others = len(_OTHER_TOKEN_PATTERN.findall(text))
+    return cjk + int(words * 1.3 + 0.5) + others
+
+
+class TokenCounter:
+    """token 计数器：有 tokenizer 时精确计数，否则使用估算"""
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+        self._cache: Dict[str, int] = {}
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return estimate_tokens(text)
+        cached = self._cache.get(text)
+        if cached is not None:
+            return cached
+        try:
+            value = len(self.tokenizer.encode(text, add_special_tokens=False))
+        except Exception:
+            value = estimate_tokens(text)
+        if len(self._cache) > 8192:
+            self._cache.clear()
+        self._cache[text] = value
+        return value
+
+    def count_message(self, message: Dict) -> int:
+        content = message.get('content') or message.get('text') or ''
+        return self.count(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class ContextWindow:
+    """一次打包的结果"""
+    messages: List[Dict]
+    summary: str = ""
+    start_index: int = 0
+    end_index: int = 0
+    tokens: int = 0
+    skipped: int = 0
+    meta: Dict = field(default_factory=dict)
+
+    def with_summary(self) -> List[Dict]:
+        """返回带摘要伪消息的列表（摘要为空时原样返回）"""
+        if not self.summary:
+            return list(self.messages)
+        return [build_summary_message(self.summary), *self.messages]
+
+
+def build_summary_message(summary: str) -> Dict:
+    return {
+        'role': 'system',
+        'speaker': '早期对话摘要',
+        'content': summary,
+        'is_summary': True
+    }
+
+
+def _summary_line(message: Dict) -> str:
+    speaker = (message.get('speaker') or ('助手' if message.get('role') == 'assistant' else '用户')).split(' (')[0]
+    content = (message.get('content') or message.get('text') or '').strip().replace('\n', ' ')
+    if len(content) > SUMMARY_LINE_MAX_CHARS:
+        content = content[:SUMMARY_LINE_MAX_CHARS - 1] + "…"
+    return f"{speaker}: {content}" if content else ""
+
+
+class RollingSummary:
+    """
+    增量滚动摘要
+
+    covered_until 之前的消息已折叠进摘要。默认采用抽取式压缩（每条截断为一行，
+    超出预算时丢弃最早的行）；也可注入异步 summarizer(previous, new_messages) -> str。
+    """
+
+    def __init__(
+        self,
+        token_budget: int = DEFAULT_SUMMARY_TOKEN_BUDGET,
+        summarizer: Optional[Callable[[str, List[Dict]], Awaitable[str]]] = None
+    ):
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self.text = ""
+        self.covered_until = 0
+        self._lines: List[str] = []
+        self._lock = asyncio.Lock()
+
+    def reset(self):
+        self.text = ""
+        self.covered_until = 0
+        self._lines = []
+
+    async def extend(self, history: List[Dict], upto: int, counter: Optional[TokenCounter] = None):
+        """把 history[covered_until:upto] 折叠进摘要"""
+        async with self._lock:
+            if upto <= self.covered_until:
+                return
+            new_messages = history[self.covered_until:upto]
+            counter = counter or TokenCounter()
+            if self.summarizer:
+                try:
+                    self.text = (await self.summarizer(self.text, new_messages)).strip()
+                except Exception as exc:
+                    logger.error(f"[上下文] 摘要模型调用失败，改用抽取式摘要: {exc}")
+                    self._fold_extractive(new_messages, counter)
+            else:
+                self._fold_extractive(new_messages, counter)
+            self.covered_until = upto
+            logger.debug(f"[上下文] 摘要已更新至第 {upto} 条，约 {counter.count(self.text)} tokens")
+
+    def _fold_extractive(self, new_messages: List[Dict], counter: TokenCounter):
+        self._lines = self._fold_lines(self._lines, new_messages, counter)
+        self.text = "\n".join(self._lines)
+
+    def _fold_lines(self, lines: List[str], new_messages: List[Dict], counter: TokenCounter) -> List[str]:
+        lines = list(lines)
+        for message in new_messages:
+            line = _summary_line(message)
+            if line:
+                lines.append(line)
+        while lines and counter.count("\n".join(lines)) > self.token_budget:
+            lines.pop(0)
+        return lines
+
+    def preview(self, new_messages: List[Dict], counter: TokenCounter, include_current: bool = True) -> str:
+        """不修改摘要状态，返回把 new_messages 以抽取式折叠后的摘要文本（用于本次分析）"""
+        base = self.text.split("\n") if include_current and self.text else []
+        return "\n".join(self._fold_lines(base, new_messages, counter))
+
+
+class ContextBuilder:
+    """按 token 预算打包最新消息，并维护跨触发复用的滚动摘要"""
+
+    def __init__(
+        self,
+        token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+        summary_token_budget: int = DEFAULT_SUMMARY_TOKEN_BUDGET,
+        summarizer: Optional[Callable[[str, List[Dict]], Awaitable[str]]] = None
+    ):
+        self.token_budget = token_budget
+        self.summary = RollingSummary(summary_token_budget, summarizer)
+        self._pending_update: Optional[asyncio.Task] = None
+
+    def set_budgets(self, token_budget: Optional[int] = None, summary_token_budget: Optional[int] = None):
+        if token_budget:
+            self.token_budget = max(64, int(token_budget))
+        if summary_token_budget:
+            self.summary.token_budget = max(32, int(summary_token_budget))
+
+    def reset(self):
+        if self._pending_update and not self._pending_update.done():
+            self._pending_update.cancel()
+        self._pending_update = None
+        self.summary.reset()
+
+    def build(
+        self,
+        history: List[Dict],
+        start_index: int = 0,
+        max_messages: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        counter: Optional[TokenCounter] = None
+    ) -> ContextWindow:
+        """
+        从 history 末尾向前打包消息
+
+        Args:
+            history: 完整对话历史
+            start_index: 打包下界（增量分析时为上次分析之后的位置）
+            max_messages: 最多打包的消息条数
+            token_budget: 本次预算，默认使用构建器预算
+            counter: token 计数器（本地模型传入对应 tokenizer）
+
+        Returns:
+            ContextWindow，summary 覆盖打包窗口之前的对话（含本次超出预算的增量消息）
+        """
+        counter = counter or TokenCounter()
+        budget = token_budget or self.token_budget
+        end_index = len(history)
+        start_index = max(0, min(start_index, end_index))
+
+        # 摘要与打包窗口重叠（例如分析位置被重置）时不使用已有摘要，避免重复
+        summary_usable = self.summary.covered_until <= start_index
+        summary_text = self.summary.text if summary_usable else ""
+        first, used = self._pack(history, start_index, self._summary_cost(summary_text, counter), budget, max_messages, counter)
+
+        # 打包窗口之前尚未进入摘要的消息（本次超出预算的增量，以及尚未完成的后台摘要更新）立即折叠进本次摘要
+        fold_from = self.summary.covered_until if summary_usable else start_index
+        folded = 0
+        if first > fold_from:
+            # 为摘要预留预算后重新打包，折叠后的摘要不超过摘要预算
+            reserved = self.summary.token_budget + MESSAGE_OVERHEAD_TOKENS
+            first, used = self._pack(history, start_index, reserved, budget, max_messages, counter)
+            summary_text = self.summary.preview(history[fold_from:first], counter, include_current=summary_usable)
+            used += self._summary_cost(summary_text, counter) - reserved
+            folded = first - fold_from
+
+        window = ContextWindow(
+            messages=history[first:end_index],
+            summary=summary_text,
+            start_index=first,
+            end_index=end_index,
+            tokens=used,
+            skipped=first - start_index,
+            meta={'budget': budget, 'summary_covered_until': self.summary.covered_until, 'folded': folded}
+        )
+        logger.debug(
+            f"[上下文] 打包 {len(window.messages)} 条 [{first}-{end_index - 1}]，"
+            f"约 {used}/{budget} tokens，本次折叠 {folded} 条进摘要"
+        )
+        return window
+
+    @staticmethod
+    def _summary_cost(summary_text: str, counter: TokenCounter) -> int:
+        return counter.count(summary_text) + MESSAGE_OVERHEAD_TOKENS if summary_text else 0
+
+    @staticmethod
+    def _pack(
+        history: List[Dict],
+        start_index: int,
+        used: int,
+        budget: int,
+        max_messages: Optional[int],
+        counter: TokenCounter
+    ):
+        """从末尾向前打包，返回 (窗口起点, 已用 token)"""
+        end_index = len(history)
+        first = end_index
+        while first > start_index:
+            if max_messages and end_index - first >= max_messages:
+                break
+            cost = counter.count_message(history[first - 1])
+            # 至少保留最新一条消息，即使它单独超出预算
+            if used + cost > budget and first < end_index:
+                break
+            used += cost
+            first -= 1
+        return first, used
+
+    def schedule_summary_update(self, history: List[Dict], upto: int, counter: Optional[TokenCounter] = None):
+        """在事件循环中后台更新摘要（需在事件循环线程调用）"""
+        if upto <= self.summary.covered_until:
+            return
+        snapshot = list(history[:upto])
+
+        async def _update():
+            await self.summary.extend(snapshot, upto, counter)
+
+        self._pending_update = asyncio.get_running_loop().create_task(_update())
+
+
+def pack_recent(
+    messages: List[Dict],
+    token_budget: int,
+    counter: Optional[TokenCounter] = None
+) -> List[Dict]:
+    """
+    在已有消息列表中按预算保留最新消息（摘要伪消息始终保留在开头）
+
+    用于把分析窗口转交给回答模型时控制上下文长度。
+    """
+    counter = counter or TokenCounter()
+    summaries = [m for m in messages if m.get('is_summary')]
+    regular = [m for m in messages if not m.get('is_summary')]
+    used = sum(counter.count_message(m) for m in summaries)
+
+    kept: List[Dict] = []
+    for message in reversed(regular):
+        cost = counter.count_message(message)
+        if kept and used + cost > token_budget:
+            break
+        used += cost
+        kept.append(message)
+    kept.reverse()
+    return [*summaries, *kept]
@@ -7,28 +7,43 @@
 """
 
 import asyncio
+import contextlib
 import copy
 import json
 import re
+import threading
 import time
 from html import escape
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 from data.prompt import PromptTemplate
 from llm_client import LLMClient
+from llm_hedge import HedgedChatGroup
 from logger_config import setup_logger
+from persistence import persistence
 
 logger = setup_logger(__name__)
 
 # 尝试导入 transformers 和 torch
 try:
     import torch
-    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from transformers import (AutoModelForCausalLM, AutoTokenizer,
+                              StoppingCriteria, StoppingCriteriaList,
+                              TextIteratorStreamer)
     TRANSFORMERS_AVAILABLE = True
 except ImportError:
     TRANSFORMERS_AVAILABLE = False
     logger.warning("[智能Agent] 未安装 transformers/torch，本地模型功能不可用")
 
+# 本地模型推理精度：auto 根据设备自动选择（GPU→fp16，CPU→int8 动态量化）
+LOCAL_PRECISION_CHOICES = ("auto", "fp32", "bf16", "fp16", "int8")
+
+# API 模型配置文件（用于解析对冲端点）
+API_CONFIG_PATH = "api_config.json"
+
+# 阶段1判定结果格式，支持带引号或不带引号的 boolean 值 (e.g. "true", "false", true, false)
+VERDICT_PATTERN = re.compile(r'\{\s*"is"\s*:\s*["\']?(true|false)["\']?\s*\}', re.IGNORECASE)
+
 LEGACY_IDENTITY_MAP = {
     "思考": "tech_assistant",
     "快速": "concise_assistant",
@@ -86,8 +101,7 @@ def get_sub_agent_system(agent_config_path: str = "data/agent.json", role_id: Op
     """
     default_system = "作为专业求职助手，请简洁、直接地响应用户指令，无需过多寒暄。"
     try:
-        with open(agent_config_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = persistence.load_json(agent_config_path)
         
         # 1. 获取基础 Prompt (sub_agents.direct_chat.system)
         base_system = data.get('sub_agents', {}).get('direct_chat', {}).get('system', '')
@@ -122,6 +136,12 @@ def format_messages_compact(messages: List[Dict]) -> str:
         content = msg.get('content', '').strip()
         speaker = msg.get('speaker', '')
 
+        # 早期对话的滚动摘要
+        if msg.get('is_summary'):
+            if content:
+                xml_lines.append(f'  <summary>{content}</summary>')
+            continue
+
         if ' (' in speaker:
             speaker = speaker.split(' (')[0]
         elif '(' in speaker:
@@ -144,6 +164,26 @@ def format_messages_compact(messages: List[Dict]) -> str:
     return result
 
 
+def strip_think_content(text: str) -> str:
+    """去除 <think> 推理内容，未闭合的 <think> 之后的部分视为仍在推理"""
+    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    open_idx = text.find('<think>')
+    if open_idx != -1:
+        text = text[:open_idx]
+    return text
+
+
+if TRANSFORMERS_AVAILABLE:
+    class _StopEventCriteria(StoppingCriteria):
+        """外部事件置位后终止 generate，用于流式消费端提前退出"""
+
+        def __init__(self, stop_event: threading.Event):
+            self.stop_event = stop_event
+
+        def __call__(self, input_ids, scores, **kwargs) -> bool:
+            return self.stop_event.is_set()
+
+
 class BaseLLMAgent:
     """封装本地/云端模型加载与推理的基础Agent"""
 
@@ -155,6 +195,14 @@ class BaseLLMAgent:
         self.client = None
         self.local_model = None
         self.local_tokenizer = None
+        self.local_precision = None
+        self.local_device = None
+        self.runtime_stats = {
+            "generations": 0,
+            "last_tokens": 0,
+            "last_tokens_per_second": None,
+            "avg_tokens_per_second": None
+        }
         self._init_backend()
 
     def _init_backend(self):
@@ -164,6 +212,15 @@ class BaseLLMAgent:
                 base_url=self.config.get('base_url', ''),
                 model=self.config.get('model', '')
             )
+            # 配置了等价端点时，组成对冲组：首选端点超时未出首 token 则对冲到下一个
+            hedge_endpoints = self.config.get('hedge_endpoints') or []
+            if hedge_endpoints:
+                clients = [self.client] + [
+                    LLMClient(api_key=ep.get('api_key', ''), base_url=ep.get('base_url', ''), model=ep.get('model', ''))
+                    for ep in hedge_endpoints
+                ]
+                self.client = HedgedChatGroup(self.agent_label, clients)
+                logger.info(f"[{self.agent_label}] 已启用对冲请求: {self.client}")
             logger.info(f"[{self.agent_label}] API客户端已初始化")
         elif self.model_type == 'local':
             model_name = self.config.get('model_name', 'Qwen/Qwen2-0.5B-Instruct')
@@ -172,17 +229,55 @@ class BaseLLMAgent:
             else:
                 logger.error(f"[{self.agent_label}] 缺少本地推理依赖，无法加载 {model_name}")
 
+    def _resolve_local_precision(self) -> Tuple[str, str]:
+        """根据配置与当前设备确定 (precision, device)"""
+        requested = str(self.config.get('precision') or 'auto').strip().lower()
+        if requested not in LOCAL_PRECISION_CHOICES:
+            logger.warning(f"[{self.agent_label}] 未知精度 '{requested}'，改用 auto")
+            requested = 'auto'
+
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        if requested == 'auto':
+            return ('fp16' if device == 'cuda' else 'int8'), device
+        if requested == 'fp16' and device == 'cpu':
+            # CPU 上 fp16 矩阵乘法慢或不受支持
+            logger.warning(f"[{self.agent_label}] CPU 不适合 fp16 推理，改用 fp32")
+            return 'fp32', device
+        if requested == 'bf16' and device == 'cuda' and not torch.cuda.is_bf16_supported():
+            logger.warning(f"[{self.agent_label}] 当前 GPU 不支持 bf16，改用 fp16")
+            return 'fp16', device
+        if requested == 'int8':
+            # torch 动态量化只支持 CPU 后端
+            return 'int8', 'cpu'
+        return requested, device
+
     def _load_local_model(self, model_name: str) -> bool:
-        logger.info(f"[{self.agent_label}] 正在加载本地模型: {model_name}")
+        precision, device = self._resolve_local_precision()
+        logger.info(f"[{self.agent_label}] 正在加载本地模型: {model_name} (精度: {precision}, 设备: {device})")
         try:
             self.local_tokenizer = AutoTokenizer.from_pretrained(model_name)
+            load_dtype = {
+                'fp32': torch.float32,
+                'bf16': torch.bfloat16,
+                'fp16': torch.float16,
+                'int8': torch.float32
+            }[precision]
             self.local_model = AutoModelForCausalLM.from_pretrained(
                 model_name,
-                dtype=torch.float16,
-                device_map="auto"
+                dtype=load_dtype,
+                device_map="auto" if device == 'cuda' else None
             )
+            if precision == 'int8':
+                # 动态量化：Linear 权重 int8 存储，激活在推理时量化
+                self.local_model = torch.ao.quantization.quantize_dynamic(
+                    self.local_model,
+                    {torch.nn.Linear},
+                    dtype=torch.qint8
+                )
             self.local_model.eval()
-            logger.info(f"[{self.agent_label}] ✅ 本地模型加载成功: {model_name}")
+            self.local_precision = precision
+            self.local_device = device
+            logger.info(f"[{self.agent_label}] ✅ 本地模型加载成功: {model_name} ({precision}/{device})")
             return True
         except Exception as exc:
             logger.error(f"[{self.agent_label}] ❌ 本地模型加载失败: {exc}")
@@ -190,61 +285,166 @@ class BaseLLMAgent:
             self.local_tokenizer = None
             return False
 
+    def _record_generation(self, new_tokens: int, elapsed: float):
+        """记录本地生成吞吐，avg 为指数滑动平均"""
+        stats = self.runtime_stats
+        stats["generations"] += 1
+        stats["last_tokens"] = new_tokens
+        if elapsed <= 0 or new_tokens <= 0:
+            return
+        tokens_per_second = new_tokens / elapsed
+        stats["last_tokens_per_second"] = round(tokens_per_second, 2)
+        previous = stats["avg_tokens_per_second"]
+        stats["avg_tokens_per_second"] = round(
+            tokens_per_second if previous is None else previous * 0.7 + tokens_per_second * 0.3,
+            2
+        )
+
+    def get_runtime_status(self) -> Dict:
+        """供 /api/agent/status 展示的运行时信息"""
+        status = {
+            "model_type": self.model_type,
+            "model_name": self.config.get('model_name') or self.config.get('model'),
+            **self.runtime_stats
+        }
+        if self.model_type == 'local':
+            status["precision"] = self.local_precision
+            status["device"] = self.local_device
+            status["loaded"] = self.local_model is not None
+        return status
+
     def _get_local_generation_kwargs(self) -> Dict:
         defaults = {
             "max_new_tokens": 512,
             "do_sample": False,
         }
         params = {**defaults, **self.generation_params}
+        params.pop("enable_thinking", None)
         if self.local_tokenizer:
             params.setdefault("pad_token_id", self.local_tokenizer.eos_token_id)
             params.setdefault("eos_token_id", self.local_tokenizer.eos_token_id)
         return params
 
-    async def _run_chat(self, messages: List[Dict]) -> str:
+    def _build_local_inputs(self, messages: List[Dict]):
+        enable_thinking = self.generation_params.get("enable_thinking", False)
+        if self.config.get("enable_thinking"):
+            enable_thinking = True
+
+        text = self.local_tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True,
+            enable_thinking=enable_thinking
+        )
+        return self.local_tokenizer([text], return_tensors="pt").to(self.local_model.device)
+
+    async def _local_chat_stream(self, messages: List[Dict]) -> AsyncIterator[str]:
+        """后台线程执行 generate，通过 TextIteratorStreamer 逐段取回文本"""
+        if not (self.local_model and self.local_tokenizer):
+            raise RuntimeError(f"本地模型未加载 ({self.agent_label})")
+
+        inputs = self._build_local_inputs(messages)
+        streamer = TextIteratorStreamer(
+            self.local_tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True
+        )
+        stop_event = threading.Event()
+        generation_error: List[BaseException] = []
+        generate_kwargs = {
+            "input_ids": inputs.input_ids,
+            "attention_mask": inputs.attention_mask,
+            "streamer": streamer,
+            "stopping_criteria": StoppingCriteriaList([_StopEventCriteria(stop_event)]),
+            **self._get_local_generation_kwargs()
+        }
+
+        def _generate():
+            try:
+                started = time.perf_counter()
+                with torch.no_grad():
+                    output_ids = self.local_model.generate(**generate_kwargs)
+                self._record_generation(
+                    int(output_ids.shape[1] - inputs.input_ids.shape[1]),
+                    time.perf_counter() - started
+                )
+            except BaseException as exc:
+                generation_error.append(exc)
+                # generate 异常退出时不会结束 streamer，手动结束避免消费端永久阻塞
+                streamer.end()
+
+        worker = threading.Thread(target=_generate, name=f"{self.agent_label}-generate", daemon=True)
+        worker.start()
+
+        loop = asyncio.get_running_loop()
+        iterator = iter(streamer)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    yield chunk
+        finally:
+            # 消费端提前退出（早停/取消）时通知生成线程在下一个 token 处停止
+            stop_event.set()
+
+        if generation_error:
+            raise RuntimeError(f"本地模型生成失败 ({self.agent_label}): {generation_error[0]}")
+
+    async def chat_stream(self, messages: List[Dict]) -> AsyncIterator[str]:
+        """
+        流式获取模型响应，本地模型与 API 模型统一为异步迭代器接口
+
+        Args:
+            messages: OpenAI 格式的消息列表
+
+        Yields:
+            增量文本片段
+        """
         if self.model_type == 'api':
             if not self.client:
                 raise RuntimeError(f"API客户端未初始化 ({self.agent_label})")
-            response_text = ""
             async for chunk in self.client.chat_stream(messages):
-                response_text += chunk
+                yield chunk
         elif self.model_type == 'local':
-            if not (self.local_model and self.local_tokenizer):
-                raise RuntimeError(f"本地模型未加载 ({self.agent_label})")
-            
-            enable_thinking = self.generation_params.get("enable_thinking", False)
-            if self.config.get("enable_thinking"):
-                enable_thinking = True
-                
-            text = self.local_tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True,
-                enable_thinking=enable_thinking
-            )
-            inputs = self.local_tokenizer([text], return_tensors="pt").to(self.local_model.device)
-            with torch.no_grad():
-                outputs = self.local_model.generate(
-                    inputs.input_ids,
-                    attention_mask=inputs.attention_mask,
-                    **self._get_local_generation_kwargs()
-                )
-            response_text = self.local_tokenizer.decode(
-                outputs[0][inputs.input_ids.shape[1]:],
-                skip_special_tokens=True
-            ).strip()
+            async for chunk in self._local_chat_stream(messages):
+                yield chunk
         else:
             raise RuntimeError(f"未知的模型类型: {self.model_type}")
 
-        if self.model_type != 'api' and self.model_type != 'local':
-             # This check is just to ensure safety if logic flows here, though previous branch covers it.
-             # Actually the previous code structure was:
-             # if api: ...
-             # elif local: ...
-             # else: raise ...
-             # So I should just remove the extra else block I added.
-             pass
+    async def _run_chat(
+        self,
+        messages: List[Dict],
+        stop_when: Optional[Callable[[str], bool]] = None,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """
+        消费 chat_stream 拼接完整响应
 
+        Args:
+            messages: OpenAI 格式的消息列表
+            stop_when: 早停判定，传入当前累积文本，返回 True 时立即结束生成
+            on_delta: 每个增量片段的回调（可为协程函数）
+        """
+        response_text = ""
+        stopped_early = False
+        async with contextlib.aclosing(self.chat_stream(messages)) as stream:
+            async for chunk in stream:
+                response_text += chunk
+                if on_delta:
+                    result = on_delta(chunk)
+                    if asyncio.iscoroutine(result):
+                        await result
+                if stop_when and stop_when(response_text):
+                    stopped_early = True
+                    break
+
+        if self.model_type == 'local':
+            # 本地模型解码结果去除首尾空白（与逐段流式之前的 decode().strip() 一致）
+            response_text = response_text.strip()
+        if stopped_early:
+            logger.debug(f"[{self.agent_label}] 已解析到结果，提前结束生成 ({len(response_text)} 字符)")
         logger.debug(f"[{self.agent_label}] 模型完整响应内容:\n{'=' * 80}\n{response_text}\n{'=' * 80}")
         logger.debug(f"[{self.agent_label}] 响应长度: {len(response_text)} 字符")
         return response_text
@@ -275,8 +475,7 @@ class SmartAnalysisAgent(BaseLLMAgent):
     @staticmethod
     def validate_response(response: str) -> Tuple[bool, Optional[dict]]:
         try:
-            # 支持带引号或不带引号的 boolean 值 (e.g. "true", "false", true, false)
-            match = re.search(r'\{\s*"is"\s*:\s*["\']?(true|false)["\']?\s*\}', response, re.IGNORECASE)
+            match = VERDICT_PATTERN.search(response)
             if match:
                 is_true = match.group(1).lower() == 'true'
                 logger.info(f"[智能分析] 判定结果: {is_true}")
@@ -301,7 +500,11 @@ class SmartAnalysisAgent(BaseLLMAgent):
             else:
                 chat_messages = [{"role": "user", "content": prompt}]
             logger.debug(chat_messages)
-            response_text = await self._run_chat(chat_messages)
+            # 判定结果一旦出现即停止生成，本地/API 后端的早停逻辑一致
+            response_text = await self._run_chat(
+                chat_messages,
+                stop_when=lambda text: VERDICT_PATTERN.search(strip_think_content(text)) is not None
+            )
             
             # 去除 <think> 标签内容
             response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL)
@@ -474,7 +677,20 @@ class IntentRecognitionAgent(BaseLLMAgent):
             "</leader_analysis>"
         )
 
-    async def analyze(self, messages: List[Dict], speaker_name: str) -> Dict:
+    async def analyze(
+        self,
+        messages: List[Dict],
+        speaker_name: str,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> Dict:
+        """
+        意图识别
+
+        Args:
+            messages: 对话消息列表
+            speaker_name: 主人公姓名
+            on_delta: 流式增量回调，用于把意图总结逐段推送到前端
+        """
         prompt = self.build_prompt(messages, speaker_name)
         try:
             logger.debug(f"\n[DEBUG_INTENT] 🚀 正在执行意图识别 prompt...")
@@ -489,7 +705,11 @@ class IntentRecognitionAgent(BaseLLMAgent):
             else:
                 chat_messages = [{"role": "user", "content": prompt}]
 
-            response_text = await self._run_chat(chat_messages)
+            response_text = await self._run_chat(
+                chat_messages,
+                stop_when=lambda text: '</leader_analysis>' in strip_think_content(text).lower(),
+                on_delta=on_delta
+            )
             
             # 去除 <think> 标签内容
             response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL)
@@ -539,8 +759,7 @@ class ThinkTankAgent:
 
     def _safe_load_json(self, path: str) -> dict:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return persistence.load_json(path)
         except Exception as exc:
             logger.error(f"[智囊团] 加载 {path} 失败: {exc}")
             return {}
@@ -653,7 +872,9 @@ class AgentManager:
             'api_key': overrides.get('api_key', ''),
             'base_url': overrides.get('base_url', ''),
             'model': overrides.get('model', ''),
-            'generation_params': overrides.get('generation_params', {})
+            'precision': overrides.get('precision') or 'auto',
+            'generation_params': overrides.get('generation_params', {}),
+            'hedge_endpoints': []
         }
         
         # 将 enable_thinking 放入 generation_params
@@ -667,15 +888,47 @@ class AgentManager:
             runtime['base_url'] = model_config.get('base_url', runtime['base_url'])
             runtime['model'] = model_config.get('model', runtime['model'])
             runtime['generation_params'] = model_config.get('generation_params', runtime['generation_params'])
+            runtime['hedge_endpoints'] = self._resolve_hedge_endpoints(
+                overrides.get('hedge_models') or [],
+                exclude=model_config.get('name')
+            )
         return runtime
 
+    @staticmethod
+    def _resolve_hedge_endpoints(names: List[str], exclude: Optional[str] = None) -> List[Dict]:
+        """按配置名称解析对冲端点（保持顺序，跳过主模型与缺失项）"""
+        if not names:
+            return []
+        try:
+            configs = {c.get("name"): c for c in persistence.load_json(API_CONFIG_PATH).get("configs", [])}
+        except Exception as exc:
+            logger.error(f"[对冲] 读取API配置失败: {exc}")
+            return []
+        endpoints = []
+        for name in names:
+            if name == exclude:
+                continue
+            conf = configs.get(name)
+            if not conf or not conf.get("api_key") or not conf.get("base_url"):
+                logger.warning(f"[对冲] 未找到可用的端点配置: {name}")
+                continue
+            endpoints.append({
+                'name': name,
+                'api_key': conf['api_key'],
+                'base_url': conf['base_url'],
+                'model': conf.get('model', '')
+            })
+        return endpoints
+
     def load_agent(self, config: dict, model_config: dict) -> bool:
         try:
             model_name = model_config.get('model_name', config.get('model_name', 'Qwen/Qwen2-0.5B-Instruct'))
             overrides = {
                 'model_type': model_config.get('model_type', config.get('model_type', 'api')),
                 'model_name': model_name,
-                'enable_thinking': config.get('enable_thinking', False)
+                'enable_thinking': config.get('enable_thinking', False),
+                'precision': config.get('precision', 'auto'),
+                'hedge_models': config.get('hedge_models', [])
             }
             agent_config = self._build_llm_runtime_config(overrides, model_config, model_name)
             agent_config.update({
@@ -698,7 +951,9 @@ class AgentManager:
             overrides = {
                 'model_type': config.get('model_type', 'local'),
                 'model_name': fallback,
-                'enable_thinking': config.get('intent_enable_thinking', False)
+                'enable_thinking': config.get('intent_enable_thinking', False),
+                'precision': config.get('precision', 'auto'),
+                'hedge_models': config.get('hedge_models', [])
             }
             agent_config = self._build_llm_runtime_config(overrides, model_config, fallback)
             self.intent_agent = IntentRecognitionAgent(agent_config)
@@ -709,9 +964,52 @@ class AgentManager:
             self.intent_agent = None
             return False
 
+    def reload_local_precision(self, precision: str, intent: bool = False) -> int:
+        """
+        本地模型的推理精度变化时按新精度重新加载（API 模型与精度未变的模型不受影响）
+
+        Args:
+            precision: LOCAL_PRECISION_CHOICES 之一
+            intent: True 重新加载意图识别模型，否则重新加载分析模型
+
+        Returns:
+            重新加载的模型数
+        """
+        if intent:
+            targets = {None: self.intent_agent} if self.intent_agent else {}
+        else:
+            targets = dict(self.agents)
+        reloaded = 0
+        for name, agent in targets.items():
+            if agent.model_type != 'local' or agent.config.get('precision', 'auto') == precision:
+                continue
+            logger.info(f"[{agent.agent_label}] 推理精度改为 {precision}，重新加载本地模型")
+            new_agent = type(agent)({**agent.config, 'precision': precision})
+            if intent:
+                self.intent_agent = new_agent
+            else:
+                self.agents[name] = new_agent
+            reloaded += 1
+        return reloaded
+
     def _get_primary_agent(self) -> Optional[SmartAnalysisAgent]:
         return next(iter(self.agents.values()), None)
 
+    def get_context_tokenizer(self):
+        """返回主分析Agent的本地tokenizer（API模型返回None，使用估算）"""
+        primary = self._get_primary_agent()
+        if primary and primary.model_type == 'local':
+            return primary.local_tokenizer
+        return None
+
+    def get_runtime_status(self) -> Dict:
+        """汇总各Agent的精度、设备与吞吐 (tokens/s)"""
+        primary = self._get_primary_agent()
+        return {
+            'analysis': primary.get_runtime_status() if primary else None,
+            'intent': self.intent_agent.get_runtime_status() if self.intent_agent else None
+        }
+
     async def analyze_conversation(
         self,
         messages: List[Dict],
@@ -801,7 +1099,15 @@ class AgentManager:
                 else:
                     status_callback("intent_started", {"model": intent_model})
 
-            intent_result = await self.run_intent_recognition(messages, speaker_name)
+            on_delta = None
+            if status_callback:
+                async def on_delta(delta: str):
+                    if asyncio.iscoroutinefunction(status_callback):
+                        await status_callback("intent_delta", {"delta": delta})
+                    else:
+                        status_callback("intent_delta", {"delta": delta})
+
+            intent_result = await self.run_intent_recognition(messages, speaker_name, on_delta=on_delta)
 
             # 检查意图识别结果，如果未检测到技术问题，则终止后续流程
             if intent_result and intent_result.get('success'):
@@ -897,7 +1203,12 @@ class AgentManager:
         print(f"[智能分析] 使用的系统提示词模式: {distribution_result.get('system_prompt', '未设置')[:50]}...")
         return result
 
-    async def run_intent_recognition(self, messages: List[Dict], speaker_name: str) -> Dict:
+    async def run_intent_recognition(
+        self,
+        messages: List[Dict],
+        speaker_name: str,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> Dict:
         agent = self.intent_agent
         if not agent:
             primary = self._get_primary_agent()
@@ -908,7 +1219,7 @@ class AgentManager:
             else:
                 return {'success': False, 'error': '无可用的意图识别模型'}
 
-        return await agent.analyze(messages, speaker_name)
+        return await agent.analyze(messages, speaker_name, on_delta=on_delta)
 
     @staticmethod
     def _build_personalization_state(
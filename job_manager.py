@@ -3,6 +3,8 @@ import json
 import asyncio
 from typing import Optional, Dict
 from llm_client import LLMClient
+from llm_scheduler import PRIORITY_BACKGROUND, llm_priority
+from provider_health import provider_health
 from logger_config import setup_logger
 
 logger = setup_logger(__name__)
@@ -82,6 +84,8 @@ class JobManager:
         return self.current_task
 
     async def _process_generation(self, job_title: str, job_jd: str, config_data: Optional[Dict]):
+        # 岗位分析为后台任务，不与实时分析抢占并发
+        llm_priority.set(PRIORITY_BACKGROUND)
         try:
             self.update_status("processing", "正在生成岗位分析...")
             
@@ -208,6 +212,17 @@ class JobManager:
                      )
                  except Exception as e:
                      logger.error(f"[JobManager] Failed to create specific client: {e}")
+        elif model_type == "api" and model_name == "default" and config_data:
+             # Route "default" to the fastest healthy endpoint equivalent to current_config
+             current_name = config_data.get("current_config")
+             routed = provider_health.select_config(config_data, current_name)
+             if routed and routed.get("name") != current_name:
+                 client_to_use = LLMClient(
+                     api_key=routed.get("api_key"),
+                     base_url=routed.get("base_url"),
+                     model=routed.get("model")
+                 )
+                 logger.info(f"[JobManager] Default model routed to '{routed.get('name')}'")
         
         return client_to_use
 
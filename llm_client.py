@@ -1,43 +1,292 @@
 import os
 from openai import AsyncOpenAI
 import json
+import threading
+import time
 import traceback
 import asyncio
 import httpx
+import weakref
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from logger_config import setup_logger
+from context_builder import estimate_tokens
+from llm_scheduler import llm_scheduler
+from provider_health import provider_health
 
 logger = setup_logger(__name__)
 
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# chat_stream 以文本形式返回的错误与空响应警告的前缀（对冲等调用方据此判定请求失败）
+ERROR_CHUNK_PREFIXES = (
+    "请求错误:",
+    "错误: LLM 客户端未初始化",
+    "[警告] 连接建立成功，但流是空的",
+    "[警告] 未收到有效响应内容",
+)
+
+
+def is_error_response(text: Optional[str]) -> bool:
+    """chat_stream 的输出（首个分块或完整回答）是否表示请求失败：为空，或以错误/空响应警告开头"""
+    text = (text or "").lstrip()
+    return not text or text.startswith(ERROR_CHUNK_PREFIXES)
+
+
+def normalize_base_url(base_url: Optional[str]) -> str:
+    """规范化 Base URL：去除尾部斜杠并补全 /v1"""
+    if not base_url:
+        return ""
+    clean_url = base_url.strip().rstrip('/')
+    if not clean_url.endswith("/v1"):
+        return clean_url + "/v1"
+    return clean_url
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    # 创建自定义的 httpx 客户端，避免代理问题；长连接保活并限制连接数
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=LLMClientPool.MAX_CONNECTIONS,
+            max_keepalive_connections=LLMClientPool.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLMClientPool.KEEPALIVE_EXPIRY
+        ),
+        http2=HTTP2_AVAILABLE,
+        follow_redirects=True
+    )
+
+
+class TTFTStats:
+    """首 token 延迟 (TTFT) 统计，按冷/热连接分别记录，并保留按端点与模型的近期样本"""
+
+    MAX_SAMPLES = 200
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {"cold": deque(maxlen=self.MAX_SAMPLES), "warm": deque(maxlen=self.MAX_SAMPLES)}
+        # (端点, 模型) -> 近期样本；同一网关上的不同模型分别统计
+        self._by_endpoint: Dict[Tuple[str, str], deque] = {}
+
+    def record(self, endpoint: str, ttft: float, warm: bool, model: str = ""):
+        kind = "warm" if warm else "cold"
+        with self._lock:
+            self._samples[kind].append(ttft)
+            self._by_endpoint.setdefault((endpoint, model), deque(maxlen=self.MAX_SAMPLES)).append(ttft)
+        logger.debug(f"[系统] TTFT {ttft * 1000:.0f}ms ({'热' if warm else '冷'}连接) @ {model}@{endpoint}")
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def percentile(self, q: float, endpoint: Optional[str] = None, model: str = "") -> Optional[float]:
+        """返回 TTFT 分位数（秒）；指定端点时只统计该端点上的该模型"""
+        with self._lock:
+            if endpoint is not None:
+                values = list(self._by_endpoint.get((endpoint, model), ()))
+            else:
+                values = list(self._samples["cold"]) + list(self._samples["warm"])
+        return self._percentile(values, q)
+
+    def snapshot(self) -> Dict:
+        result = {}
+        with self._lock:
+            samples = {kind: list(values) for kind, values in self._samples.items()}
+        for kind, values in samples.items():
+            result[kind] = {
+                "count": len(values),
+                "p50_ms": round(self._percentile(values, 0.5) * 1000, 1) if values else None,
+                "p90_ms": round(self._percentile(values, 0.9) * 1000, 1) if values else None
+            }
+        return result
+
+
+# 全局 TTFT 统计
+ttft_stats = TTFTStats()
+
+
+class LLMClientPool:
+    """
+    进程级 LLM 客户端池
+
+    按 (base_url, api_key) 复用 AsyncOpenAI 及其底层 httpx 连接池，
+    避免每次请求重新进行 TCP/TLS 握手；超过容量时淘汰最久未使用的客户端。
+    被淘汰的客户端只移出映射而不关闭（长期持有它的 LLMClient 可能仍在使用），
+    无人引用后由垃圾回收释放，服务关闭时统一关闭。
+    """
+
+    MAX_CLIENTS = 16
+    MAX_CONNECTIONS = 32
+    MAX_KEEPALIVE_CONNECTIONS = 16
+    KEEPALIVE_EXPIRY = 90.0
+    # 最近一次活动在该时间窗口内的连接视为“热”连接
+    WARM_WINDOW = 60.0
+    # 会话期间保活探测间隔（秒），需小于 WARM_WINDOW
+    PROBE_INTERVAL = 45.0
+
+    def __init__(self):
+        self._clients: "OrderedDict[Tuple[str, str], AsyncOpenAI]" = OrderedDict()
+        # 最近一次网络活动（请求/预热）时间，用于区分冷/热连接
+        self._last_used: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self.created_count = 0
+        self.reused_count = 0
+        self.prewarm_count = 0
+        self.evicted_count = 0
+        # 已淘汰但可能仍被持有的客户端（弱引用）
+        self._retired: "weakref.WeakSet[AsyncOpenAI]" = weakref.WeakSet()
+        self._keepalive_task: Optional[asyncio.Task] = None
+
+    def get(self, api_key: str, base_url: str) -> AsyncOpenAI:
+        """获取（必要时创建）指定端点的共享客户端"""
+        key = (normalize_base_url(base_url), api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.reused_count += 1
+            else:
+                client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=key[0],
+                    http_client=_build_http_client()
+                )
+                self._clients[key] = client
+                self.created_count += 1
+                logger.info(f"[系统] LLM 客户端初始化成功: {key[0]} (HTTP/2={'开启' if HTTP2_AVAILABLE else '关闭'})")
+                while len(self._clients) > self.MAX_CLIENTS:
+                    old_key, old_client = self._clients.popitem(last=False)
+                    self._last_used.pop(old_key, None)
+                    self._retired.add(old_client)
+                    self.evicted_count += 1
+        return client
+
+    def is_warm(self, api_key: str, base_url: str) -> bool:
+        last_used = self._last_used.get((normalize_base_url(base_url), api_key))
+        return last_used is not None and time.time() - last_used < self.WARM_WINDOW
+
+    def touch(self, api_key: str, base_url: str):
+        key = (normalize_base_url(base_url), api_key)
+        with self._lock:
+            if key in self._clients:
+                self._last_used[key] = time.time()
+
+    async def prewarm(self, api_key: str, base_url: str) -> bool:
+        """通过一次轻量的 GET /models 请求完成 DNS/TCP/TLS 建连"""
+        if not (api_key and base_url):
+            return False
+        client = self.get(api_key, base_url)
+        try:
+            await client.with_options(timeout=10.0, max_retries=0).models.list()
+        except Exception as e:
+            # 部分中转不支持 /models，但只要收到 HTTP 响应连接即已建立
+            logger.debug(f"[系统] 预热请求返回异常 ({normalize_base_url(base_url)}): {e}")
+        self.touch(api_key, base_url)
+        self.prewarm_count += 1
+        return True
+
+    async def prewarm_many(self, targets: Iterable[Tuple[str, str]]):
+        """并发预热多个端点，targets 为 (api_key, base_url) 序列"""
+        unique = {(api_key, normalize_base_url(base_url)) for api_key, base_url in targets if api_key and base_url}
+        if not unique:
+            return
+        await asyncio.gather(*(self.prewarm(api_key, base_url) for api_key, base_url in unique), return_exceptions=True)
+        logger.info(f"[系统] 已预热 {len(unique)} 个 LLM 端点")
+
+    def start_keepalive(self, targets_provider: Callable[[], Iterable[Tuple[str, str]]]):
+        """会话期间周期性探测，保持连接处于热状态（需在事件循环中调用）"""
+        if self._keepalive_task and not self._keepalive_task.done():
+            return
+
+        async def _loop():
+            while True:
+                await asyncio.sleep(self.PROBE_INTERVAL)
+                try:
+                    targets = [
+                        (api_key, base_url) for api_key, base_url in targets_provider()
+                        if api_key and base_url and not self.is_warm(api_key, base_url)
+                    ]
+                    if targets:
+                        await self.prewarm_many(targets)
+                except Exception as e:
+                    logger.error(f"[系统] 连接保活探测失败: {e}")
+
+        self._keepalive_task = asyncio.get_running_loop().create_task(_loop())
+        logger.info("[系统] 连接保活探测已启动")
+
+    def stop_keepalive(self):
+        if self._keepalive_task and not self._keepalive_task.done():
+            self._keepalive_task.cancel()
+            logger.info("[系统] 连接保活探测已停止")
+        self._keepalive_task = None
+
+    async def close_all(self):
+        """关闭全部客户端（服务关闭时调用）"""
+        self.stop_keepalive()
+        with self._lock:
+            clients = list(self._clients.values()) + list(self._retired)
+            self._clients.clear()
+            self._last_used.clear()
+            self._retired = weakref.WeakSet()
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.error(f"[系统] 关闭 LLM 客户端失败: {e}")
+        if clients:
+            logger.info(f"[系统] 已关闭 {len(clients)} 个 LLM 客户端")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "created": self.created_count,
+                "reused": self.reused_count,
+                "prewarmed": self.prewarm_count,
+                "evicted": self.evicted_count,
+                "keepalive_active": bool(self._keepalive_task and not self._keepalive_task.done()),
+                "http2": HTTP2_AVAILABLE
+            }
+
+
+# 全局客户端池
+client_pool = LLMClientPool()
+
+
 class LLMClient:
-    def __init__(self, api_key, base_url, model):
+    def __init__(self, api_key, base_url, model, pooled: bool = True):
+        """
+        Args:
+            pooled: 是否使用全局客户端池；连接测试等一次性请求可传 False，用完调用 close()
+        """
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
+        self.pooled = pooled
         self.client = None
         self.init_client()
 
     def init_client(self):
         if self.api_key and self.base_url:
             try:
-                clean_url = self.base_url.strip().rstrip('/')
-                if not clean_url.endswith("/v1"):
-                    self.base_url = clean_url + "/v1"
+                self.base_url = normalize_base_url(self.base_url)
+                if self.pooled:
+                    self.client = client_pool.get(self.api_key, self.base_url)
                 else:
-                    self.base_url = clean_url
-                # 创建自定义的 httpx 客户端，避免代理问题
-                timeout = httpx.Timeout(60.0, connect=10.0)
-                http_client = httpx.AsyncClient(
-                    timeout=timeout,
-                    follow_redirects=True
-                )
-
-                # 创建 OpenAI 客户端，使用自定义的 http_client
-                self.client = AsyncOpenAI(
-                    api_key=self.api_key,
-                    base_url=self.base_url,
-                    http_client=http_client
-                )
-                logger.info(f"[系统] LLM 客户端初始化成功。")
+                    self.client = AsyncOpenAI(
+                        api_key=self.api_key,
+                        base_url=self.base_url,
+                        http_client=_build_http_client()
+                    )
             except Exception as e:
                 logger.error(f"[错误] 初始化 LLM 客户端失败: {e}")
                 logger.error(f"[错误类型] {type(e).__name__}")
@@ -48,80 +297,150 @@ class LLMClient:
             logger.error("[错误] LLM 客户端未初始化: 缺少 API Key 或 Base URL")
             self.client = None
 
+    def _resolve_client(self):
+        """池化客户端每次调用前从池中取回，持有的客户端被淘汰后自动换用池中的新客户端"""
+        if self.pooled and self.client is not None:
+            self.client = client_pool.get(self.api_key, self.base_url)
+        return self.client
+
     def update_config(self, api_key, base_url, model):
+        """更新配置；端点与密钥未变化时仅切换模型，复用现有连接"""
+        if (
+            self.client is not None
+            and api_key == self.api_key
+            and normalize_base_url(base_url) == self.base_url
+        ):
+            self.model = model
+            return
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
         self.init_client()
 
+    async def close(self):
+        """关闭非池化客户端（池化客户端由 client_pool.close_all 统一关闭）"""
+        if self.client is not None and not self.pooled:
+            await self.client.close()
+        self.client = None
+
+    # 调度器按“提示词 + 预估输出”计入 TPM
+    OUTPUT_TOKEN_ESTIMATE = 512
+
+    def _estimate_tokens(self, messages) -> int:
+        return sum(estimate_tokens(str(m.get("content") or "")) for m in messages) + self.OUTPUT_TOKEN_ESTIMATE
+
     async def chat_stream(self, messages, stream=True):
             """
             请求 LLM 响应 (Async - 支持流式和非流式)
             """
-            if not self.client:
+            if not self._resolve_client():
                 yield "错误: LLM 客户端未初始化，请检查配置。"
                 return
 
-            try:
-                logger.debug(f"[调试] 正在发送请求到模型: {self.model} (Stream={stream})...")
+            ttft = None
+            chars = 0
+            failed = False
+            response = None
+            # 经调度器排队：按端点限制并发与 TPM，并按当前上下文的优先级出队
+            async with llm_scheduler.slot(self.base_url, self.api_key, self._estimate_tokens(messages)):
+                # 计时从出队后开始，TTFT 不包含排队等待
+                warm = self.pooled and client_pool.is_warm(self.api_key, self.base_url)
+                # 熔断端点冷却结束后，实际发出的请求占用唯一的半开探测名额
+                probe = provider_health.try_acquire_probe(self.base_url, self.model)
+                start_time = time.perf_counter()
+                try:
+                    logger.debug(f"[调试] 正在发送请求到模型: {self.model} (Stream={stream})...")
                 
-                # 发起请求
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    stream=stream,
-                    # 某些中转商如果遇到不支持的参数会报错，这里保持最简参数
-                    temperature=0.7 
-                )
-                logger.debug("[调试] 请求连接建立成功...")
+                    # 发起请求
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        stream=stream,
+                        # 某些中转商如果遇到不支持的参数会报错，这里保持最简参数
+                        temperature=0.7 
+                    )
+                    logger.debug("[调试] 请求连接建立成功...")
                 
-                if stream:
-                    chunk_count = 0
-                    async for chunk in response:
-                        chunk_count += 1
+                    if stream:
+                        chunk_count = 0
+                        async for chunk in response:
+                            chunk_count += 1
                         
-                        # --- 🔍 深度调试：打印前3个包的原始数据，看看服务器到底回了什么 ---
-                        if chunk_count <= 3:
-                            logger.debug(f"[底层数据 Chunk {chunk_count}] {chunk.model_dump_json()}")
-                        # -----------------------------------------------------------
+                            # --- 🔍 深度调试：打印前3个包的原始数据，看看服务器到底回了什么 ---
+                            if chunk_count <= 3:
+                                logger.debug(f"[底层数据 Chunk {chunk_count}] {chunk.model_dump_json()}")
+                            # -----------------------------------------------------------
 
-                        if chunk.choices and len(chunk.choices) > 0:
-                            delta = chunk.choices[0].delta
+                            if chunk.choices and len(chunk.choices) > 0:
+                                delta = chunk.choices[0].delta
                             
-                            # 检查 delta 里到底有什么
-                            if chunk_count == 1 and not delta.content:
-                                logger.debug(f"[调试] 第一个包内容为空，Role: {getattr(delta, 'role', 'Unknown')}")
-
-                            if hasattr(delta, 'content') and delta.content is not None:
-                                content = delta.content
-                                if content: 
-                                    yield content
-                                else:
-                                    # 这是一个空字符串 ""，有些模型会发空字符串保活
-                                    pass 
+                                # 检查 delta 里到底有什么
+                                if chunk_count == 1 and not delta.content:
+                                    logger.debug(f"[调试] 第一个包内容为空，Role: {getattr(delta, 'role', 'Unknown')}")
+
+                                if hasattr(delta, 'content') and delta.content is not None:
+                                    content = delta.content
+                                    if content: 
+                                        if ttft is None:
+                                            ttft = time.perf_counter() - start_time
+                                            ttft_stats.record(self.base_url, ttft, warm, self.model)
+                                        chars += len(content)
+                                        yield content
+                                    else:
+                                        # 这是一个空字符串 ""，有些模型会发空字符串保活
+                                        pass 
                     
-                    if chunk_count == 0:
-                        yield "\n[警告] 连接建立成功，但流是空的 (Stream Empty)。\n可能原因：API Key额度不足、模型名称拼写错误 (尝试改为 gpt-3.5-turbo 或 deepseek-chat 测试)。"
+                        if chunk_count == 0:
+                            failed = True
+                            provider_health.record_failure(self.base_url, self.model, "空响应流")
+                            yield "\n[警告] 连接建立成功，但流是空的 (Stream Empty)。\n可能原因：API Key额度不足、模型名称拼写错误 (尝试改为 gpt-3.5-turbo 或 deepseek-chat 测试)。"
                     
-                    logger.debug(f"[调试] 流接收完毕，共收到 {chunk_count} 个数据包。")
-                else:
-                    # 非流式处理
-                    if response.choices and len(response.choices) > 0:
-                        content = response.choices[0].message.content
-                        yield content
+                        logger.debug(f"[调试] 流接收完毕，共收到 {chunk_count} 个数据包。")
                     else:
-                         yield "\n[警告] 未收到有效响应内容。"
+                        # 非流式处理
+                        if response.choices and len(response.choices) > 0:
+                            content = response.choices[0].message.content
+                            ttft = time.perf_counter() - start_time
+                            ttft_stats.record(self.base_url, ttft, warm, self.model)
+                            chars = len(content or "")
+                            yield content
+                        else:
+                             failed = True
+                             provider_health.record_failure(self.base_url, self.model, "未收到有效响应内容")
+                             yield "\n[警告] 未收到有效响应内容。"
 
-            except Exception as e:
-                logger.error(f"[严重错误] 请求过程中发生异常:")
-                logger.exception("请求异常详情:")
-                yield f"请求错误: {str(e)}"
+                except Exception as e:
+                    failed = True
+                    provider_health.record_failure(
+                        self.base_url, self.model, str(e),
+                        timeout="timeout" in type(e).__name__.lower()
+                    )
+                    logger.error(f"[严重错误] 请求过程中发生异常:")
+                    logger.exception("请求异常详情:")
+                    yield f"请求错误: {str(e)}"
+                finally:
+                    # 调用方取消或提前退出时关闭流式响应，释放底层 HTTP 连接
+                    if stream and response is not None and hasattr(response, "close"):
+                        try:
+                            await response.close()
+                        except Exception:
+                            pass
+                    if self.pooled:
+                        client_pool.touch(self.api_key, self.base_url)
+                    # 调用方提前结束（早停/对冲落败）时，只要已收到首 token 仍计为成功
+                    if not failed and ttft is not None:
+                        provider_health.record_success(
+                            self.base_url, self.model, ttft, time.perf_counter() - start_time, chars
+                        )
+                    elif probe and not failed:
+                        # 探测在收到首 token 前被取消，未得出结论，归还探测名额
+                        provider_health.release_probe(self.base_url, self.model)
 
     async def test_connection(self):
         """
         测试连接是否有效
         """
-        if not self.client:
+        if not self._resolve_client():
             return False, "客户端未初始化"
         
         try:
@@ -191,5 +510,7 @@ async def main():
     else:
         logger.error(f"[错误] 找不到文件 {CONFIG_FILE}，请确保它在同一目录下。")
 
+    await client_pool.close_all()
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
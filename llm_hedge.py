@@ -0,0 +1,212 @@
+"""
+对冲请求 (Hedged Requests)
+
+为延迟敏感的小请求（阶段1判定、意图识别）配置一组有序的等价端点：
+首选端点在自适应截止时间（该端点上该模型 TTFT 的 p90）内未产出首个 token 时，
+向下一个端点发出对冲请求；最先产出 token 的流胜出，其余请求被取消。
+"""
+
+import asyncio
+import contextlib
+import threading
+from typing import AsyncIterator, Dict, List, Optional
+
+from llm_client import LLMClient, is_error_response, ttft_stats
+from logger_config import setup_logger
+from provider_health import provider_health
+
+logger = setup_logger(__name__)
+
+# 自适应截止时间的取值范围（秒），无历史样本时使用默认值
+DEFAULT_HEDGE_DEADLINE = 2.0
+MIN_HEDGE_DEADLINE = 0.5
+MAX_HEDGE_DEADLINE = 8.0
+HEDGE_QUANTILE = 0.9
+
+
+class HedgeStats:
+    """按角色统计对冲率，按端点统计胜率"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._roles: Dict[str, Dict[str, int]] = {}
+        self._providers: Dict[str, Dict[str, int]] = {}
+
+    def _provider(self, label: str) -> Dict[str, int]:
+        return self._providers.setdefault(label, {"started": 0, "hedge_started": 0, "wins": 0, "errors": 0})
+
+    def record_request(self, role: str, hedged: bool):
+        with self._lock:
+            stats = self._roles.setdefault(role, {"requests": 0, "hedged": 0})
+            stats["requests"] += 1
+            if hedged:
+                stats["hedged"] += 1
+
+    def record_start(self, label: str, is_hedge: bool):
+        with self._lock:
+            stats = self._provider(label)
+            stats["started"] += 1
+            if is_hedge:
+                stats["hedge_started"] += 1
+
+    def record_win(self, label: str):
+        with self._lock:
+            self._provider(label)["wins"] += 1
+
+    def record_error(self, label: str):
+        with self._lock:
+            self._provider(label)["errors"] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            roles = {
+                role: {**stats, "hedge_rate": round(stats["hedged"] / stats["requests"], 3) if stats["requests"] else 0.0}
+                for role, stats in self._roles.items()
+            }
+            providers = {
+                label: {**stats, "win_rate": round(stats["wins"] / stats["started"], 3) if stats["started"] else 0.0}
+                for label, stats in self._providers.items()
+            }
+        return {"roles": roles, "providers": providers}
+
+
+# 全局对冲统计
+hedge_stats = HedgeStats()
+
+
+def provider_label(client: LLMClient) -> str:
+    return f"{client.model}@{client.base_url}"
+
+
+class HedgedChatGroup:
+    """
+    有序等价端点组，提供与 LLMClient 相同的 chat_stream 接口
+
+    Args:
+        role: 角色标签（如「智能分析」「意图识别」），用于统计
+        clients: 按优先级排列的 LLMClient 列表
+    """
+
+    def __init__(self, role: str, clients: List[LLMClient]):
+        if not clients:
+            raise ValueError("对冲组至少需要一个端点")
+        self.role = role
+        self.clients = clients
+
+    @property
+    def client(self):
+        return self.clients[0].client
+
+    @property
+    def model(self) -> str:
+        return self.clients[0].model
+
+    def hedge_deadline(self, client: LLMClient) -> float:
+        """以该端点上该模型 TTFT 的 p90 作为对冲截止时间"""
+        p90 = ttft_stats.percentile(HEDGE_QUANTILE, endpoint=client.base_url, model=client.model)
+        if p90 is None:
+            return DEFAULT_HEDGE_DEADLINE
+        return min(MAX_HEDGE_DEADLINE, max(MIN_HEDGE_DEADLINE, p90))
+
+    async def chat_stream(self, messages, stream=True) -> AsyncIterator[str]:
+        # 跳过已熔断的端点（全部熔断时仍按原顺序尝试）
+        clients = [c for c in self.clients if provider_health.allow(c.base_url, c.model)] or self.clients
+        if len(clients) == 1:
+            async for chunk in clients[0].chat_stream(messages, stream=stream):
+                yield chunk
+            return
+
+        attempts = []  # 进行中的请求: (client, generator, first_chunk_task)
+        finished = []  # 已失败的请求，结束时统一关闭
+        next_index = 0
+        winner = None
+        first_chunk: Optional[str] = None
+        last_error: Optional[str] = None
+
+        def launch() -> LLMClient:
+            nonlocal next_index
+            client = clients[next_index]
+            is_hedge = next_index > 0
+            next_index += 1
+            generator = client.chat_stream(messages, stream=stream)
+            task = asyncio.ensure_future(generator.__anext__())
+            attempts.append((client, generator, task))
+            hedge_stats.record_start(provider_label(client), is_hedge)
+            if is_hedge:
+                logger.info(f"[对冲] {self.role}: 对冲请求 → {provider_label(client)}")
+            return client
+
+        try:
+            current = launch()
+            while winner is None:
+                if not attempts:
+                    if next_index >= len(clients):
+                        break
+                    current = launch()
+                # 仍有后备端点时，等待当前端点的自适应截止时间
+                timeout = self.hedge_deadline(current) if next_index < len(clients) else None
+                done, _ = await asyncio.wait(
+                    [task for _, _, task in attempts],
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    current = launch()
+                    continue
+
+                failed = False
+                for attempt in list(attempts):
+                    client, generator, task = attempt
+                    if task not in done:
+                        continue
+                    try:
+                        chunk = task.result()
+                    except StopAsyncIteration:
+                        chunk = None
+                    except Exception as exc:
+                        chunk = f"请求错误: {exc}"
+                    # 错误文本与空响应警告都视为失败，由后备端点继续
+                    if is_error_response(chunk):
+                        hedge_stats.record_error(provider_label(client))
+                        last_error = chunk or last_error
+                        attempts.remove(attempt)
+                        finished.append(attempt)
+                        failed = True
+                        continue
+                    winner = (client, generator)
+                    first_chunk = chunk
+                    break
+
+                # 端点失败时不必等待截止时间，直接尝试下一个
+                if winner is None and failed and next_index < len(clients):
+                    current = launch()
+        finally:
+            hedged = next_index > 1
+            losers = [a for a in attempts if winner is None or a[1] is not winner[1]] + finished
+            for _, _, task in losers:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*(task for _, _, task in losers), return_exceptions=True)
+            for _, generator, _ in losers:
+                with contextlib.suppress(Exception):
+                    await generator.aclose()
+            hedge_stats.record_request(self.role, hedged)
+
+        if winner is None:
+            yield last_error or "请求错误: 所有对冲端点均未返回内容"
+            return
+
+        client, generator = winner
+        hedge_stats.record_win(provider_label(client))
+        if next_index > 1:
+            logger.info(f"[对冲] {self.role}: 胜出端点 {provider_label(client)}")
+        try:
+            yield first_chunk
+            async for chunk in generator:
+                yield chunk
+        finally:
+            with contextlib.suppress(Exception):
+                await generator.aclose()
+
+    def __repr__(self):
+        return f"HedgedChatGroup(角色='{self.role}', 端点={[provider_label(c) for c in self.clients]})"
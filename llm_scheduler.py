@@ -0,0 +1,241 @@
+"""
+LLM 调用调度器
+
+在 LLMClient 之前按端点（同一 base_url + api_key 的服务商账号）协调并发与
+每分钟 token 配额 (TPM)，并按优先级排队：
+    realtime（智能分析/意图识别/智囊团） > interactive（普通对话） > background（简历/岗位分析）
+后台任务不能占用为实时请求保留的最后并发槽位。各优先级的排队等待时间可供监控。
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional, Tuple
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+PRIORITY_REALTIME = "realtime"
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+PRIORITY_ORDER = {PRIORITY_REALTIME: 0, PRIORITY_INTERACTIVE: 1, PRIORITY_BACKGROUND: 2}
+
+DEFAULT_MAX_CONCURRENCY = 8
+# 为实时请求保留的并发槽位数（后台任务不可占用）
+REALTIME_RESERVED_SLOTS = 1
+
+# 当前协程上下文中的 LLM 调用优先级，随 asyncio 任务自动继承
+llm_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def priority_scope(priority: str):
+    """在代码块内设置 LLM 调用优先级"""
+    token = llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+def endpoint_id(base_url: str, api_key: str) -> Tuple[str, str]:
+    clean_url = (base_url or "").strip().rstrip('/')
+    if not clean_url.endswith("/v1"):
+        clean_url += "/v1"
+    return clean_url, api_key or ""
+
+
+class EndpointLimiter:
+    """单个端点的并发槽位 + TPM 令牌桶 + 优先级等待队列（仅在事件循环线程中使用）"""
+
+    def __init__(self, label: str, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, tpm_limit: Optional[int] = None):
+        self.label = label
+        self.max_concurrency = max(1, max_concurrency)
+        self.tpm_limit = tpm_limit if tpm_limit and tpm_limit > 0 else None
+        self.active = 0
+        self._tokens = float(self.tpm_limit or 0)
+        self._last_refill = time.monotonic()
+        self._waiters = []  # (priority_rank, seq, future, priority, tokens)
+        self._seq = itertools.count()
+        self._retry_handle: Optional[asyncio.TimerHandle] = None
+
+    def configure(self, max_concurrency: Optional[int], tpm_limit: Optional[int]):
+        if max_concurrency:
+            self.max_concurrency = max(1, int(max_concurrency))
+        new_tpm = int(tpm_limit) if tpm_limit else None
+        if new_tpm != self.tpm_limit:
+            self.tpm_limit = new_tpm if new_tpm and new_tpm > 0 else None
+            self._tokens = float(self.tpm_limit or 0)
+        self._dispatch()
+
+    def _refill(self):
+        if not self.tpm_limit:
+            return
+        now = time.monotonic()
+        self._tokens = min(float(self.tpm_limit), self._tokens + (now - self._last_refill) * self.tpm_limit / 60.0)
+        self._last_refill = now
+
+    def _slot_limit(self, priority: str) -> int:
+        if priority == PRIORITY_BACKGROUND and self.max_concurrency > REALTIME_RESERVED_SLOTS:
+            return self.max_concurrency - REALTIME_RESERVED_SLOTS
+        return self.max_concurrency
+
+    def _can_start(self, priority: str, tokens: int) -> Tuple[bool, float]:
+        """返回 (是否可立即开始, 令牌不足时需等待的秒数)"""
+        if self.active >= self._slot_limit(priority):
+            return False, 0.0
+        if not self.tpm_limit:
+            return True, 0.0
+        self._refill()
+        # 单次请求超过整个配额时按满桶放行，避免永久阻塞
+        needed = min(tokens, self.tpm_limit)
+        if self._tokens >= needed:
+            return True, 0.0
+        return False, (needed - self._tokens) * 60.0 / self.tpm_limit
+
+    def _take(self, tokens: int):
+        self.active += 1
+        if self.tpm_limit:
+            self._tokens -= min(tokens, self.tpm_limit)
+
+    async def acquire(self, priority: str, tokens: int):
+        ok, _ = self._can_start(priority, tokens)
+        if ok and not self._waiters:
+            self._take(tokens)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITY_ORDER.get(priority, 1), next(self._seq), future, priority, tokens))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配槽位但调用方被取消：归还槽位
+                self.release()
+            else:
+                self._waiters = [w for w in self._waiters if w[2] is not future]
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        self.active = max(0, self.active - 1)
+        self._dispatch()
+
+    def _dispatch(self):
+        """按优先级唤醒可以开始的等待者；队首因 TPM 不足时定时重试"""
+        while self._waiters:
+            rank, seq, future, priority, tokens = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            ok, wait_seconds = self._can_start(priority, tokens)
+            if not ok:
+                # 队首即最高优先级；其无法开始时后续等待者也不越过它，保证优先级顺序
+                if wait_seconds > 0:
+                    self._schedule_retry(wait_seconds)
+                return
+            heapq.heappop(self._waiters)
+            self._take(tokens)
+            future.set_result(None)
+
+    def _schedule_retry(self, delay: float):
+        if self._retry_handle and not self._retry_handle.cancelled():
+            self._retry_handle.cancel()
+        self._retry_handle = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def snapshot(self) -> Dict:
+        self._refill()
+        return {
+            "endpoint": self.label,
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queued": len(self._waiters),
+            "tpm_limit": self.tpm_limit,
+            "tokens_available": int(self._tokens) if self.tpm_limit else None
+        }
+
+
+class LLMScheduler:
+    """按端点的 LLM 调度器，并统计各优先级的排队等待时间"""
+
+    MAX_WAIT_SAMPLES = 200
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], EndpointLimiter] = {}
+        self._limits: Dict[Tuple[str, str], Tuple[Optional[int], Optional[int]]] = {}
+        self._lock = threading.Lock()
+        self._waits: Dict[str, deque] = {name: deque(maxlen=self.MAX_WAIT_SAMPLES) for name in PRIORITY_ORDER}
+        self._counts: Dict[str, int] = {name: 0 for name in PRIORITY_ORDER}
+
+    def configure(self, configs: Iterable[dict]):
+        """从 api_config.json 的 configs 读取 max_concurrency / tpm_limit"""
+        limits = {}
+        for conf in configs:
+            if not conf.get("base_url"):
+                continue
+            key = endpoint_id(conf["base_url"], conf.get("api_key", ""))
+            limits[key] = (conf.get("max_concurrency"), conf.get("tpm_limit"))
+        with self._lock:
+            self._limits = limits
+            for key, limiter in self._limiters.items():
+                max_concurrency, tpm_limit = limits.get(key, (None, None))
+                limiter.configure(max_concurrency or DEFAULT_MAX_CONCURRENCY, tpm_limit)
+
+    def _limiter(self, base_url: str, api_key: str) -> EndpointLimiter:
+        key = endpoint_id(base_url, api_key)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                max_concurrency, tpm_limit = self._limits.get(key, (None, None))
+                limiter = EndpointLimiter(key[0], max_concurrency or DEFAULT_MAX_CONCURRENCY, tpm_limit)
+                self._limiters[key] = limiter
+            return limiter
+
+    @contextlib.asynccontextmanager
+    async def slot(self, base_url: str, api_key: str, tokens: int, priority: Optional[str] = None):
+        """
+        获取端点的调用槽位，持有期间计入并发
+
+        Args:
+            tokens: 预估 token 数（提示词 + 输出），用于 TPM 配额
+            priority: 优先级，默认取当前上下文的 llm_priority
+        """
+        priority = priority or llm_priority.get()
+        if priority not in PRIORITY_ORDER:
+            priority = PRIORITY_INTERACTIVE
+        limiter = self._limiter(base_url, api_key)
+        start = time.perf_counter()
+        await limiter.acquire(priority, tokens)
+        waited = time.perf_counter() - start
+        self._waits[priority].append(waited)
+        self._counts[priority] += 1
+        if waited > 1.0:
+            logger.info(f"[调度] {priority} 请求在 {limiter.label} 排队 {waited:.1f}s")
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def snapshot(self) -> Dict:
+        classes = {}
+        for name, samples in self._waits.items():
+            values = sorted(samples)
+            classes[name] = {
+                "requests": self._counts[name],
+                "avg_wait_ms": round(sum(values) / len(values) * 1000, 1) if values else None,
+                "p90_wait_ms": round(values[min(len(values) - 1, int(0.9 * (len(values) - 1) + 0.5))] * 1000, 1) if values else None,
+                "max_wait_ms": round(values[-1] * 1000, 1) if values else None
+            }
+        with self._lock:
+            endpoints = [limiter.snapshot() for limiter in self._limiters.values()]
+        return {"classes": classes, "endpoints": endpoints}
+
+
+# 全局调度器
+llm_scheduler = LLMScheduler()
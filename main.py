@@ -152,13 +152,16 @@ class RealTimeASR_SV:
 
     def load_voiceprints(self):
         """加载 voiceprints 文件夹下的所有声纹嵌入数据"""
-        self.speakers = {}  # 存储 {name: {'embedding': array, 'path': str}}
+        # 先在局部字典中加载，完成后整体替换，识别线程不会看到加载了一半的声纹库
+        speakers = {}  # 存储 {name: {'embedding': array, 'path': str}}
         logger.info(f"正在扫描声纹库: {self.VOICEPRINT_DIR} ...")
         if not os.path.exists(self.VOICEPRINT_DIR):
+            self.speakers = speakers
             return
 
         wav_files = [f for f in os.listdir(self.VOICEPRINT_DIR) if f.lower().endswith('.wav')]
         if not wav_files:
+            self.speakers = speakers
             logger.warning("  [警告] 声纹库为空，所有人都将被识别为 '未知用户'")
             return
 
@@ -174,7 +177,7 @@ class RealTimeASR_SV:
             if os.path.exists(npy_path):
                 try:
                     embedding = np.load(npy_path)
-                    self.speakers[name] = {
+                    speakers[name] = {
                         'embedding': embedding,
                         'path': wav_path
                     }
@@ -189,7 +192,7 @@ class RealTimeASR_SV:
                 embedding = self.extract_embedding(wav_path)
                 if embedding is not None:
                     np.save(npy_path, embedding)
-                    self.speakers[name] = {
+                    speakers[name] = {
                         'embedding': embedding,
                         'path': wav_path
                     }
@@ -199,9 +202,21 @@ class RealTimeASR_SV:
             except Exception as e:
                 logger.error(f"  ❌ 处理失败 {name}: {e}")
 
+        self.speakers = speakers
         if not self.speakers:
             logger.warning("  [警告] 声纹库为空，所有人都将被识别为 '未知用户'")
 
+    def add_speaker(self, name, embedding, wav_path):
+        """把新注册的声纹插入运行中的声纹库（替换字典而非原地修改，识别线程可同时遍历）"""
+        self.speakers = {**self.speakers, name: {'embedding': embedding, 'path': wav_path}}
+        logger.info(f"已加入声纹库: {name}（共 {len(self.speakers)} 人）")
+
+    def remove_speaker(self, name):
+        """从运行中的声纹库移除说话人"""
+        if name in self.speakers:
+            self.speakers = {key: value for key, value in self.speakers.items() if key != name}
+            logger.info(f"已移出声纹库: {name}（共 {len(self.speakers)} 人）")
+
     def identify_speaker(self, audio_path):
         """将音频与声纹库比对 - 使用预计算的嵌入数据"""
         if not self.speakers:
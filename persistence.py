@@ -0,0 +1,223 @@
+"""
+后台持久化队列 (write-behind)
+
+请求处理中的配置、UI 状态、身份定义与聊天记录写入只登记为“写入意图”，
+由后台线程在短时间窗口后批量落盘：同一键在窗口内的多次写入合并为最后一次，
+JSON 文件以临时文件 + fsync + 原子替换写入，并按批次同步目录。
+读取方通过 load_json 可读到尚未落盘的最新内容（读己之写）。
+关闭服务时调用 flush() 等待所有写入完成。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# 合并窗口（秒）：首个写入意图到达后等待该时长再批量落盘
+DEFAULT_COALESCE_WINDOW = 0.2
+
+_MISSING = object()
+
+
+class _JsonWrite:
+    """待写入的 JSON 文件（提交时即序列化，调用方之后修改数据不影响快照）"""
+
+    __slots__ = ("path", "text")
+
+    def __init__(self, path: str, text: str):
+        self.path = path
+        self.text = text
+
+
+class PersistenceWorker:
+    """
+    后台持久化线程
+
+    Args:
+        coalesce_window: 合并窗口（秒）
+    """
+
+    def __init__(self, coalesce_window: float = DEFAULT_COALESCE_WINDOW):
+        self.coalesce_window = coalesce_window
+        self._cond = threading.Condition()
+        # key -> _JsonWrite 或可调用对象；保持首次提交的顺序，内容以最后一次为准
+        self._pending: "OrderedDict[str, Any]" = OrderedDict()
+        # 正在落盘的批次，写完之前仍供 load_json 读取
+        self._writing: Dict[str, Any] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"submitted": 0, "coalesced": 0, "written": 0, "batches": 0, "errors": 0}
+        self._last_batch_ms = 0.0
+
+    # ---- 提交 ----
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="persistence-writer", daemon=True)
+            self._thread.start()
+
+    def _enqueue(self, key: str, item: Any):
+        with self._cond:
+            self._stats["submitted"] += 1
+            if key in self._pending:
+                self._stats["coalesced"] += 1
+            self._pending[key] = item
+            self._ensure_started()
+            self._cond.notify_all()
+
+    def write_json(self, path: str, data: Any, indent: Optional[int] = 4, ensure_ascii: bool = False):
+        """登记一次 JSON 文件写入（以文件路径为键合并）"""
+        text = json.dumps(data, indent=indent, ensure_ascii=ensure_ascii)
+        self._enqueue(os.path.abspath(path), _JsonWrite(path, text))
+
+    def submit(self, key: str, operation: Callable[[], None]):
+        """
+        登记一次任意写操作（同一键只执行最后一次提交的操作）
+
+        操作在后台线程执行，应在执行时读取最新状态，使合并后的单次执行即可落盘全部变更。
+        """
+        self._enqueue(key, operation)
+
+    # ---- 读取 ----
+
+    def load_json(self, path: str, default: Any = _MISSING) -> Any:
+        """
+        读取 JSON 文件；有尚未落盘的写入时返回其内容
+
+        Args:
+            default: 文件不存在时的返回值；未提供时抛出 FileNotFoundError
+        """
+        key = os.path.abspath(path)
+        with self._cond:
+            item = self._pending.get(key) or self._writing.get(key)
+        if isinstance(item, _JsonWrite):
+            return json.loads(item.text)
+        if default is not _MISSING and not os.path.exists(path):
+            return default
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    # ---- 落盘 ----
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # 等待合并窗口，让短时间内的重复写入合并
+            time.sleep(self.coalesce_window)
+            with self._cond:
+                batch = list(self._pending.items())
+                self._pending.clear()
+                self._writing = dict(batch)
+            try:
+                self._write_batch(batch)
+            finally:
+                with self._cond:
+                    self._writing = {}
+                    self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        start = time.perf_counter()
+        json_writes = [(key, item) for key, item in batch if isinstance(item, _JsonWrite)]
+        operations = [(key, item) for key, item in batch if not isinstance(item, _JsonWrite)]
+        written = 0
+        errors = 0
+
+        # 先写入并 fsync 所有临时文件，再统一原子替换，最后每个目录只同步一次
+        replaced_dirs = set()
+        staged = []
+        for key, item in json_writes:
+            tmp_path = f"{item.path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(item.path) or ".", exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(item.text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                staged.append((tmp_path, item.path))
+            except Exception as e:
+                errors += 1
+                logger.error(f"[持久化] 写入 {item.path} 失败: {e}")
+        for tmp_path, path in staged:
+            try:
+                os.replace(tmp_path, path)
+                replaced_dirs.add(os.path.dirname(os.path.abspath(path)))
+                written += 1
+            except Exception as e:
+                errors += 1
+                logger.error(f"[持久化] 替换 {path} 失败: {e}")
+        for directory in replaced_dirs:
+            self._fsync_dir(directory)
+
+        for key, operation in operations:
+            try:
+                operation()
+                written += 1
+            except Exception as e:
+                errors += 1
+                logger.error(f"[持久化] 执行写操作 {key} 失败: {e}")
+
+        with self._cond:
+            self._stats["written"] += written
+            self._stats["errors"] += errors
+            self._stats["batches"] += 1
+            self._last_batch_ms = (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    def _fsync_dir(directory: str):
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        try:
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def flush(self, timeout: Optional[float] = 10.0) -> bool:
+        """
+        等待所有待写入内容落盘（关闭服务时调用）
+
+        Returns:
+            是否在超时前全部完成
+        """
+        with self._cond:
+            if self._pending and (self._thread is None or not self._thread.is_alive()):
+                # 后台线程不可用时在当前线程直接写入
+                batch = list(self._pending.items())
+                self._pending.clear()
+            else:
+                batch = None
+        if batch is not None:
+            self._write_batch(batch)
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    logger.warning(f"[持久化] 等待落盘超时，仍有 {len(self._pending) + len(self._writing)} 项未完成")
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                **self._stats,
+                "pending": len(self._pending) + len(self._writing),
+                "last_batch_ms": round(self._last_batch_ms, 1)
+            }
+
+
+# 全局持久化队列
+persistence = PersistenceWorker()
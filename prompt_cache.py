@@ -0,0 +1,100 @@
+"""
+按聊天缓存组装好的对话 prompt
+
+服务端持有每个聊天的权威消息列表，前端每轮只发送新增的用户消息。
+缓存保存 [系统提示词] + 聊天中的非系统消息：聊天末尾追加消息时经 ChatManager 的变更回调原地追加，
+其他修改（清空、截断、删除）使该聊天的缓存失效，下次请求时重新组装；
+系统提示词（身份、简历、岗位信息）每次请求重新生成并原地替换。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# 最多缓存的聊天数（按最近使用淘汰）
+DEFAULT_MAX_CHATS = 16
+
+
+class _Entry:
+    __slots__ = ("prompt", "length")
+
+    def __init__(self, prompt: List[Dict], length: int):
+        self.prompt = prompt
+        # 已纳入 prompt 的聊天消息数（含未放入 prompt 的系统消息）
+        self.length = length
+
+
+class PromptCache:
+    """
+    聊天 prompt 缓存（线程安全）
+
+    Args:
+        max_chats: 最多缓存的聊天数
+    """
+
+    def __init__(self, max_chats: int = DEFAULT_MAX_CHATS):
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "appended": 0, "invalidated": 0}
+
+    def get(
+        self,
+        chat_id: str,
+        system_content: str,
+        total: int,
+        history_loader: Callable[[], List[Dict]]
+    ) -> List[Dict]:
+        """
+        取得聊天当前的 prompt
+
+        Args:
+            system_content: 本次请求的系统提示词
+            total: 聊天当前的消息数，与缓存不一致时重新组装
+            history_loader: 读取聊天全部消息
+
+        Returns:
+            缓存中的 prompt 列表（调用方只可读取，需追加消息时应复制）
+        """
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None and entry.length == total:
+                self._entries.move_to_end(chat_id)
+                self._stats["hits"] += 1
+            else:
+                history = history_loader()
+                prompt = [{"role": "system", "content": system_content}]
+                prompt.extend(message for message in history if message.get("role") != "system")
+                entry = self._entries[chat_id] = _Entry(prompt, len(history))
+                self._stats["misses"] += 1
+                while len(self._entries) > self.max_chats:
+                    self._entries.popitem(last=False)
+            if entry.prompt[0]["content"] != system_content:
+                entry.prompt[0] = {"role": "system", "content": system_content}
+            return entry.prompt
+
+    def on_chat_changed(self, chat_id: str, start: int, messages: Optional[List[Dict]]):
+        """ChatManager 变更回调：末尾追加时原地扩展，其他修改使缓存失效"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                return
+            if messages is not None and start == entry.length:
+                entry.prompt.extend(message for message in messages if message.get("role") != "system")
+                entry.length += len(messages)
+                self._stats["appended"] += len(messages)
+            else:
+                del self._entries[chat_id]
+                self._stats["invalidated"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, "chats": len(self._entries)}
+
+
+# 全局 prompt 缓存
+prompt_cache = PromptCache()
@@ -0,0 +1,233 @@
+"""
+LLM 端点健康度与延迟感知路由
+
+根据真实流量为每个端点 (base_url, model) 维护 TTFT、吞吐、错误率、超时率的 EWMA，
+连续失败或错误率超标的端点由断路器熔断（closed → open → half_open）。
+allow() 只读，供路由与对冲筛选候选端点；冷却结束后的唯一一次探测由实际发出请求的调用方
+通过 try_acquire_probe() 领取，请求未产生结果（被取消、对冲落败）时 release_probe() 归还，
+探测超过 PROBE_TIMEOUT 未返回结果时视为丢失，可重新领取。
+“默认”模型选择可在等价端点（相同 route_group，未设置时为相同 model）中
+自动路由到最快的健康端点。
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+EWMA_ALPHA = 0.3
+# 熔断阈值
+FAILURE_THRESHOLD = 3          # 连续失败次数
+ERROR_RATE_THRESHOLD = 0.5     # 错误率 EWMA
+TTFT_THRESHOLD = 15.0          # TTFT EWMA（秒）
+MIN_SAMPLES = 5                # 按比率熔断前的最少样本数
+OPEN_COOLDOWN = 30.0           # 熔断后多久进入半开状态（秒）
+PROBE_TIMEOUT = 60.0           # 半开探测未返回结果时，多久后允许重新探测（秒）
+# 首选端点与最优端点的得分差距在该比例内时保持首选，避免来回切换
+STICKINESS = 1.2
+
+
+def endpoint_key(base_url: str, model: str) -> Tuple[str, str]:
+    clean_url = (base_url or "").strip().rstrip('/')
+    if clean_url.endswith("/v1"):
+        clean_url = clean_url[:-3]
+    return clean_url, model or ""
+
+
+def _ewma(previous: Optional[float], value: float) -> float:
+    if previous is None:
+        return value
+    return EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+
+
+@dataclass
+class EndpointHealth:
+    """单个端点的健康状态"""
+    samples: int = 0
+    ttft: Optional[float] = None
+    throughput: Optional[float] = None  # 字符/秒
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    consecutive_failures: int = 0
+    state: str = "closed"
+    opened_at: float = 0.0
+    probe_started: float = 0.0
+    last_error: str = ""
+    last_update: float = field(default_factory=time.time)
+
+    def score(self) -> float:
+        """路由得分（越低越好）：TTFT 叠加错误/超时惩罚，无样本时取中性值"""
+        ttft = self.ttft if self.ttft is not None else 2.0
+        return ttft * (1 + 2 * self.error_rate + 4 * self.timeout_rate)
+
+
+class ProviderHealthRegistry:
+    """端点健康度登记表（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[Tuple[str, str], EndpointHealth] = {}
+
+    def _get(self, key: Tuple[str, str]) -> EndpointHealth:
+        health = self._endpoints.get(key)
+        if health is None:
+            health = self._endpoints[key] = EndpointHealth()
+        return health
+
+    def record_success(self, base_url: str, model: str, ttft: Optional[float], duration: float, chars: int):
+        key = endpoint_key(base_url, model)
+        with self._lock:
+            health = self._get(key)
+            health.samples += 1
+            if ttft is not None:
+                health.ttft = _ewma(health.ttft, ttft)
+                stream_time = duration - ttft
+                if chars and stream_time > 0:
+                    health.throughput = _ewma(health.throughput, chars / stream_time)
+            health.error_rate = _ewma(health.error_rate, 0.0)
+            health.timeout_rate = _ewma(health.timeout_rate, 0.0)
+            health.consecutive_failures = 0
+            health.last_update = time.time()
+            if health.state != "closed":
+                logger.info(f"[路由] 端点恢复: {key[1]}@{key[0]}")
+                health.state = "closed"
+            elif health.ttft is not None and health.ttft > TTFT_THRESHOLD and health.samples >= MIN_SAMPLES:
+                self._trip(key, health, f"TTFT 过高 ({health.ttft:.1f}s)")
+
+    def record_failure(self, base_url: str, model: str, error: str = "", timeout: bool = False):
+        key = endpoint_key(base_url, model)
+        with self._lock:
+            health = self._get(key)
+            health.samples += 1
+            health.error_rate = _ewma(health.error_rate, 1.0)
+            health.timeout_rate = _ewma(health.timeout_rate, 1.0 if timeout else 0.0)
+            health.consecutive_failures += 1
+            health.last_error = error[:200]
+            health.last_update = time.time()
+            if health.state == "half_open":
+                self._trip(key, health, "半开探测失败")
+            elif health.state == "closed" and (
+                health.consecutive_failures >= FAILURE_THRESHOLD
+                or (health.samples >= MIN_SAMPLES and health.error_rate > ERROR_RATE_THRESHOLD)
+            ):
+                self._trip(key, health, f"连续失败 {health.consecutive_failures} 次，错误率 {health.error_rate:.0%}")
+
+    @staticmethod
+    def _trip(key: Tuple[str, str], health: EndpointHealth, reason: str):
+        health.state = "open"
+        health.opened_at = time.time()
+        logger.warning(f"[路由] 端点已熔断: {key[1]}@{key[0]} ({reason})")
+
+    @staticmethod
+    def _probe_available(health: EndpointHealth, now: float) -> bool:
+        if health.state == "open":
+            return now - health.opened_at >= OPEN_COOLDOWN
+        if health.state == "half_open":
+            return now - health.probe_started >= PROBE_TIMEOUT
+        return False
+
+    def allow(self, base_url: str, model: str) -> bool:
+        """断路器判定（只读）：closed，或冷却结束、探测名额空闲时可作为候选"""
+        with self._lock:
+            health = self._endpoints.get(endpoint_key(base_url, model))
+            if health is None or health.state == "closed":
+                return True
+            return self._probe_available(health, time.time())
+
+    def try_acquire_probe(self, base_url: str, model: str) -> bool:
+        """
+        实际发出请求前调用：端点可探测时转为 half_open 并占用唯一的探测名额
+
+        Returns:
+            本次请求是否为半开探测（closed 端点返回 False，无需探测）
+        """
+        key = endpoint_key(base_url, model)
+        with self._lock:
+            health = self._endpoints.get(key)
+            if health is None or health.state == "closed":
+                return False
+            now = time.time()
+            if not self._probe_available(health, now):
+                return False
+            health.state = "half_open"
+            health.probe_started = now
+            logger.info(f"[路由] 端点进入半开状态，发出探测请求: {key[1]}@{key[0]}")
+            return True
+
+    def release_probe(self, base_url: str, model: str):
+        """探测请求未产生结果（被取消或提前放弃）时归还名额，端点回到冷却已结束的 open 状态"""
+        key = endpoint_key(base_url, model)
+        with self._lock:
+            health = self._endpoints.get(key)
+            if health is not None and health.state == "half_open":
+                health.state = "open"
+                health.probe_started = 0.0
+
+    def score(self, base_url: str, model: str) -> float:
+        with self._lock:
+            health = self._endpoints.get(endpoint_key(base_url, model))
+            return health.score() if health else EndpointHealth().score()
+
+    def select_config(self, config_data: dict, preferred_name: Optional[str]) -> Optional[dict]:
+        """
+        在首选配置的等价端点中选择最快的健康端点
+
+        Args:
+            config_data: api_config.json 内容
+            preferred_name: 首选配置名称（通常为 current_config）
+
+        Returns:
+            选中的配置；auto_routing 关闭或无等价端点时返回首选配置
+        """
+        configs = config_data.get("configs", [])
+        preferred = next((c for c in configs if c.get("name") == preferred_name), None)
+        if not preferred or not config_data.get("auto_routing", True):
+            return preferred
+
+        group = preferred.get("route_group") or preferred.get("model")
+        candidates = [
+            c for c in configs
+            if c.get("api_key") and c.get("base_url")
+            and (c.get("route_group") or c.get("model")) == group
+        ]
+        if len(candidates) <= 1:
+            return preferred
+
+        healthy = [c for c in candidates if self.allow(c["base_url"], c.get("model", ""))]
+        if not healthy:
+            return preferred
+
+        best = min(healthy, key=lambda c: self.score(c["base_url"], c.get("model", "")))
+        if preferred in healthy:
+            preferred_score = self.score(preferred["base_url"], preferred.get("model", ""))
+            if preferred_score <= self.score(best["base_url"], best.get("model", "")) * STICKINESS:
+                return preferred
+        if best is not preferred:
+            logger.info(f"[路由] 默认模型 '{preferred_name}' 路由至更快的等价端点 '{best.get('name')}'")
+        return best
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {
+                    "base_url": key[0],
+                    "model": key[1],
+                    "state": health.state,
+                    "samples": health.samples,
+                    "ttft_ms": round(health.ttft * 1000, 1) if health.ttft is not None else None,
+                    "throughput_cps": round(health.throughput, 1) if health.throughput is not None else None,
+                    "error_rate": round(health.error_rate, 3),
+                    "timeout_rate": round(health.timeout_rate, 3),
+                    "consecutive_failures": health.consecutive_failures,
+                    "last_error": health.last_error
+                }
+                for key, health in self._endpoints.items()
+            ]
+
+
+# 全局端点健康度登记表
+provider_health = ProviderHealthRegistry()
@@ -4,6 +4,8 @@ import asyncio
 import PyPDF2
 from typing import Optional, Dict
 from llm_client import LLMClient
+from llm_scheduler import PRIORITY_BACKGROUND, llm_priority
+from provider_health import provider_health
 from logger_config import setup_logger
 
 logger = setup_logger(__name__)
@@ -93,6 +95,8 @@ class ResumeManager:
 
     async def process_resume_task(self, pdf_path: str, config_data: Optional[Dict] = None):
         """Background task to process resume."""
+        # 简历分析为后台任务，不与实时分析抢占并发
+        llm_priority.set(PRIORITY_BACKGROUND)
         try:
             # 1. Extract Text
             self.update_status("processing", "extracting", "正在识别 PDF 内容...")
@@ -236,6 +240,17 @@ class ResumeManager:
                     )
                 except Exception as e:
                     logger.error(f"[ResumeManager] 创建特定客户端失败: {e}")
+        elif model_type == "api" and model_name == "default" and config_data:
+            # 默认模型：路由到与 current_config 等价的最快健康端点
+            current_name = config_data.get("current_config")
+            routed = provider_health.select_config(config_data, current_name)
+            if routed and routed.get("name") != current_name:
+                client_to_use = LLMClient(
+                    api_key=routed.get("api_key"),
+                    base_url=routed.get("base_url"),
+                    model=routed.get("model")
+                )
+                logger.info(f"[ResumeManager] 默认模型已路由至 '{routed.get('name')}'")
         return client_to_use
 
     def save_Markdown(self, Markdown_content: str):
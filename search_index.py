@@ -0,0 +1,315 @@
+"""
+聊天记录与语音转写的全文检索
+
+增量维护的倒排索引：中文按相邻字二元组 (bigram) 切分，英文/数字按单词切分，
+BM25 排序并生成带 <mark> 高亮的摘要（只高亮分词得到的命中词位置）。聊天消息追加、清空、删除时只更新受影响的文档；
+删除的文档先记为墓碑，累积到一定比例后压缩倒排表并重新编号，回收已删除文档占用的条目。
+"""
+
+import heapq
+import html
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_LENGTH = 120
+# 墓碑超过该比例（且不少于最小数量）时压缩倒排表
+COMPACT_RATIO = 0.25
+COMPACT_MIN = 5000
+
+SOURCE_CHAT = "chat"
+SOURCE_ASR = "asr"
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9_+#.]*[a-z0-9+#]|[a-z0-9]|[㐀-鿿豈-﫿]+")
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+
+
+def _lower_same_length(text: str) -> str:
+    """逐字转小写；转换后长度变化的字符（如 'İ'）保持原样，使位置与原文一一对应"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def iter_tokens(text: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    分词并给出每个词在原文中的位置
+
+    中文连续字切分为二元组（单字保留原字），英文/数字按单词切分并转小写。
+
+    Yields:
+        (token, start, end)
+    """
+    for match in _TOKEN_RE.finditer(_lower_same_length(text)):
+        token, offset = match.group(), match.start()
+        if _CJK_RE.match(token) and len(token) > 1:
+            for i in range(len(token) - 1):
+                yield token[i:i + 2], offset + i, offset + i + 2
+        else:
+            yield token, offset, match.end()
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token, _, _ in iter_tokens(text)]
+
+
+def build_snippet(text: str, terms: List[str], length: int = SNIPPET_LENGTH) -> str:
+    """截取命中最多的片段，HTML 转义后用 <mark> 高亮命中词（与检索使用同一分词，只标记真正命中的词）"""
+    if not text:
+        return ""
+    wanted = set(terms)
+    spans = [(start, end) for token, start, end in iter_tokens(text) if token in wanted]
+    if not spans:
+        return html.escape(text[:length]) + ("…" if len(text) > length else "")
+
+    spans.sort()
+    # 选择覆盖命中最多的窗口
+    best_start, best_hits = spans[0][0], 0
+    right = 0
+    for left in range(len(spans)):
+        while right < len(spans) and spans[right][1] <= spans[left][0] + length:
+            right += 1
+        if right - left > best_hits:
+            best_start, best_hits = spans[left][0], right - left
+    window_start = max(0, min(best_start - length // 4, len(text) - length))
+    window_end = min(len(text), window_start + length)
+
+    # 合并窗口内重叠的命中区间（中文二元组相互重叠）
+    merged = []
+    for start, end in spans:
+        if end <= window_start or start >= window_end:
+            continue
+        start, end = max(start, window_start), min(end, window_end)
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    parts = ["…" if window_start > 0 else ""]
+    cursor = window_start
+    for start, end in merged:
+        parts.append(html.escape(text[cursor:start]))
+        parts.append(f"<mark>{html.escape(text[start:end])}</mark>")
+        cursor = end
+    parts.append(html.escape(text[cursor:window_end]))
+    parts.append("…" if window_end < len(text) else "")
+    return "".join(parts)
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(value).timestamp() if value else None
+    except ValueError:
+        return None
+
+
+class SearchIndex:
+    """
+    BM25 倒排索引（线程安全）
+
+    Args:
+        text_loader: 根据文档引用 (source, key, position) 读取原文，用于生成摘要
+    """
+
+    def __init__(self, text_loader: Optional[Callable[[str, str, int], Optional[Dict]]] = None):
+        self.text_loader = text_loader
+        self._lock = threading.RLock()
+        # term -> array: [doc_id, tf, doc_id, tf, ...]（doc_id 递增）
+        self._postings: Dict[str, array] = {}
+        # doc_id -> (source, key, position, ts)；已删除为 None
+        self._docs: List[Optional[Tuple[str, str, int, float]]] = []
+        self._lengths = array("I")
+        self._live_docs = 0
+        self._total_length = 0
+        self._tombstones = 0
+        # chat_id -> 按消息位置排列的 doc_id（未索引的消息为 -1）
+        self._chat_docs: Dict[str, List[int]] = {}
+        self.ready = False
+
+    # ---- 写入 ----
+
+    def _add(self, text: str, source: str, key: str, position: int, ts: float) -> int:
+        tokens = tokenize(text)
+        if not tokens:
+            return -1
+        doc_id = len(self._docs)
+        self._docs.append((source, key, position, ts))
+        self._lengths.append(len(tokens))
+        self._live_docs += 1
+        self._total_length += len(tokens)
+        for term, tf in Counter(tokens).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = array("I")
+            postings.append(doc_id)
+            postings.append(tf)
+        return doc_id
+
+    def _remove(self, doc_id: int):
+        if doc_id < 0 or self._docs[doc_id] is None:
+            return
+        self._docs[doc_id] = None
+        self._live_docs -= 1
+        self._total_length -= self._lengths[doc_id]
+        self._tombstones += 1
+
+    def update_chat(self, chat_id: str, start: int, messages: List[Dict], ts: Optional[float] = None):
+        """聊天从位置 start 起的消息被替换为 messages（追加时 start 为原消息数）"""
+        ts = ts or time.time()
+        with self._lock:
+            doc_ids = self._chat_docs.setdefault(chat_id, [])
+            if len(doc_ids) < start:
+                # 更早的消息尚未建立索引（启动时的后台构建会补齐）
+                doc_ids.extend([-1] * (start - len(doc_ids)))
+            for doc_id in doc_ids[start:]:
+                self._remove(doc_id)
+            del doc_ids[start:]
+            for offset, message in enumerate(messages):
+                doc_id = -1
+                # 系统提示词（含简历/岗位分析）不参与检索
+                if message.get("role") != "system":
+                    doc_id = self._add(str(message.get("content", "")), SOURCE_CHAT, chat_id, start + offset, ts)
+                doc_ids.append(doc_id)
+            self._maybe_compact()
+
+    def remove_chat(self, chat_id: str):
+        with self._lock:
+            for doc_id in self._chat_docs.pop(chat_id, []):
+                self._remove(doc_id)
+            self._maybe_compact()
+
+    def add_transcript(self, name: str, offset: int, record: Dict):
+        with self._lock:
+            self._add(record.get("text", ""), SOURCE_ASR, name, offset, record.get("ts") or time.time())
+
+    def _maybe_compact(self):
+        if self._tombstones < COMPACT_MIN or self._tombstones < COMPACT_RATIO * len(self._docs):
+            return
+        start = time.perf_counter()
+        # 存活文档按原顺序重新编号，倒排表中的 doc_id 保持递增
+        remap = array("i", [-1]) * len(self._docs)
+        docs = []
+        lengths = array("I")
+        for doc_id, doc in enumerate(self._docs):
+            if doc is not None:
+                remap[doc_id] = len(docs)
+                docs.append(doc)
+                lengths.append(self._lengths[doc_id])
+        for term in list(self._postings):
+            old = self._postings[term]
+            new = array("I")
+            for i in range(0, len(old), 2):
+                doc_id = remap[old[i]]
+                if doc_id >= 0:
+                    new.append(doc_id)
+                    new.append(old[i + 1])
+            if new:
+                self._postings[term] = new
+            else:
+                del self._postings[term]
+        for doc_ids in self._chat_docs.values():
+            doc_ids[:] = [remap[doc_id] if doc_id >= 0 else -1 for doc_id in doc_ids]
+        self._docs = docs
+        self._lengths = lengths
+        logger.info(f"[检索] 已压缩倒排表，回收 {self._tombstones} 个已删除文档，耗时 {time.perf_counter() - start:.2f}s")
+        self._tombstones = 0
+
+    # ---- 查询 ----
+
+    def search(self, query: str, limit: int = 20, source: Optional[str] = None) -> List[Dict]:
+        """
+        BM25 检索
+
+        Args:
+            query: 查询文本
+            limit: 返回条数
+            source: 仅检索 "chat" 或 "asr"
+
+        Returns:
+            按得分排序的结果（含高亮摘要）
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            if not self._live_docs:
+                return []
+            avgdl = self._total_length / self._live_docs
+            scores: Dict[int, float] = {}
+            docs = self._docs
+            lengths = self._lengths
+            base = BM25_K1 * (1 - BM25_B)
+            per_length = BM25_K1 * BM25_B / avgdl
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings) // 2
+                idf = math.log(1 + (self._live_docs - df + 0.5) / (df + 0.5))
+                weight = idf * (BM25_K1 + 1)
+                get = scores.get
+                for doc_id, tf in zip(postings[0::2], postings[1::2]):
+                    doc = docs[doc_id]
+                    if doc is None or (source and doc[0] != source):
+                        continue
+                    scores[doc_id] = get(doc_id, 0.0) + weight * tf / (tf + base + per_length * lengths[doc_id])
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            hits = [(self._docs[doc_id], score) for doc_id, score in top]
+
+        results = []
+        for (doc_source, key, position, ts), score in hits:
+            record = self.text_loader(doc_source, key, position) if self.text_loader else None
+            record = record or {}
+            results.append({
+                "source": doc_source,
+                "key": key,
+                "position": position,
+                "score": round(score, 4),
+                "timestamp": ts,
+                "snippet": build_snippet(str(record.pop("text", "")), terms),
+                **record
+            })
+        return results
+
+    def bootstrap(self, chat_manager, transcript_log):
+        """
+        启动时在后台线程中为已有聊天与转写记录建立索引
+
+        每个聊天在持有索引锁时读取并写入，与同时发生的增量更新保持一致。
+        已归档的聊天同样建立索引（读取时透明解压），命中后生成摘要时再按位置解压读取原文。
+        """
+        start = time.perf_counter()
+        for chat_id in list(chat_manager.chats):
+            with self._lock:
+                meta = chat_manager.chats.get(chat_id)
+                if meta is None:
+                    continue
+                page = chat_manager.get_messages_page(chat_id, meta.get("message_count", 0))
+                if page is not None:
+                    self.update_chat(chat_id, 0, page["messages"], _parse_timestamp(meta.get("updated_at")))
+        for name, offset, record in transcript_log.iter_all():
+            self.add_transcript(name, offset, record)
+        self.ready = True
+        stats = self.stats()
+        logger.info(f"[检索] 索引构建完成: {stats['documents']} 条文档，{stats['terms']} 个词项，耗时 {time.perf_counter() - start:.1f}s")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "documents": self._live_docs,
+                "terms": len(self._postings),
+                "tombstones": self._tombstones
+            }
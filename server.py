@@ -1,17 +1,20 @@
 import argparse
 import asyncio
 import base64
+import contextlib
 import json
 import logging
 import os
 import re
 import threading
 import time
+import uuid
 import wave
+from collections import Counter
 
-from fastapi import (Body, FastAPI, File, HTTPException, UploadFile, WebSocket,
-                     WebSocketDisconnect)
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import (Body, FastAPI, File, HTTPException, Request, UploadFile,
+                     WebSocket, WebSocketDisconnect)
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 
 # --- Logger Setup ---
@@ -56,13 +59,30 @@ except Exception as e:
         "traceback": tb,
     }
 
-from chat_manager import ChatManager
+from asr_bridge import asr_bridge
+from chat_manager import DEFAULT_ARCHIVE_DAYS, ChatManager
+from context_builder import pack_recent
 from job_manager import JobManager
-from llm_client import LLMClient
+from llm_client import LLMClient, client_pool, is_error_response, ttft_stats
+from llm_hedge import hedge_stats
+from llm_scheduler import (PRIORITY_INTERACTIVE, PRIORITY_REALTIME,
+                           llm_priority, llm_scheduler)
+from persistence import persistence
+from prompt_cache import prompt_cache
+from provider_health import provider_health
 from resume_manager import ResumeManager
+from search_index import SOURCE_ASR, SOURCE_CHAT, SearchIndex
+from static_assets import static_assets
+from transcript_log import transcript_log
+from voiceprint_catalog import etag_matches, voiceprint_catalog
+from voiceprint_jobs import EnrollmentError, voiceprint_enrollment
+from ws_codec import JSON_CODEC, codec_stats, encode_json, negotiate_codec
+from ws_fanout import DEFAULT_SEND_TIMEOUT, SLOW_CONSUMER_CLOSE_CODE, FanoutManager, ReplayRing
+from stream_coalescer import (DEFAULT_FLUSH_BYTES, DEFAULT_FLUSH_INTERVAL_MS,
+                              StreamCoalescer, coalesce_stats)
 
 try:
-    from intelligent_agent import agent_manager, format_intent_analysis
+    from intelligent_agent import LOCAL_PRECISION_CHOICES, agent_manager, format_intent_analysis
     from trigger_manager import trigger_manager
     AGENT_AVAILABLE = True
 except Exception as e:
@@ -73,6 +93,7 @@ except Exception as e:
     agent_manager = None
     format_intent_analysis = None
     trigger_manager = None
+    LOCAL_PRECISION_CHOICES = ()
     _AGENT_IMPORT_ERROR_INFO = {
         "exc": e,
         "traceback": tb,
@@ -211,15 +232,15 @@ def select_identity_role(tags: list[str], lookup: dict[str, dict]) -> tuple[str
 
 def load_think_tank_roles() -> list[dict]:
     with THINK_TANK_ROLE_LOCK:
-        if not os.path.exists(AGENT_ROLE_FILE):
+        try:
+            # 包含尚未落盘的最新身份定义
+            data = persistence.load_json(AGENT_ROLE_FILE)
+        except FileNotFoundError:
             # 无文件时返回缓存（若有）以避免空角色导致身份缺失
             if THINK_TANK_ROLE_CACHE:
                 logger.warning("[智囊团] 身份文件缺失，使用缓存角色定义")
                 return list(THINK_TANK_ROLE_CACHE)
             return []
-        try:
-            with open(AGENT_ROLE_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
         except Exception as exc:
             logger.error(f"[智囊团] 加载身份失败: {exc}")
             if THINK_TANK_ROLE_CACHE:
@@ -253,7 +274,6 @@ def load_think_tank_roles() -> list[dict]:
 
 def save_think_tank_roles(roles: list[dict]):
     with THINK_TANK_ROLE_LOCK:
-        os.makedirs(os.path.dirname(AGENT_ROLE_FILE), exist_ok=True)
         sanitized_roles = []
         for role in roles:
             sanitized = sanitize_role_definition(role)
@@ -261,13 +281,10 @@ def save_think_tank_roles(roles: list[dict]):
                 sanitized_roles.append(sanitized)
         payload = {"think_tank_roles": sanitized_roles}
 
-        # 原子写避免半写被读取
-        tmp_path = f"{AGENT_ROLE_FILE}.tmp"
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, AGENT_ROLE_FILE)
+        # 由后台持久化队列原子写入，避免半写被读取
+        persistence.write_json(AGENT_ROLE_FILE, payload, indent=2)
 
-        # 写成功后刷新缓存
+        # 刷新缓存
         THINK_TANK_ROLE_CACHE.clear()
         THINK_TANK_ROLE_CACHE.extend(sanitized_roles)
 
@@ -283,34 +300,29 @@ def normalize_config_tags(config: dict) -> dict:
     return config
 
 def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            configs = data.get("configs", [])
-            data["configs"] = [normalize_config_tags(dict(config)) for config in configs]
-            return data
+    # 包含尚未落盘的最新配置
+    data = persistence.load_json(CONFIG_FILE, default=None)
+    if data is not None:
+        configs = data.get("configs", [])
+        data["configs"] = [normalize_config_tags(dict(config)) for config in configs]
+        return data
     return {"configs": [], "current_config": ""}
 
 def save_config(config):
     configs = config.get("configs", [])
     config["configs"] = [normalize_config_tags(dict(conf)) for conf in configs]
-    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-        json.dump(config, f, indent=4, ensure_ascii=False)
+    persistence.write_json(CONFIG_FILE, config, indent=4)
 
 def load_ui_state():
-    if os.path.exists(UI_STATE_FILE):
-        try:
-            with open(UI_STATE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading UI state: {e}")
+    try:
+        return persistence.load_json(UI_STATE_FILE, default={})
+    except Exception as e:
+        logger.error(f"Error loading UI state: {e}")
     return {}
 
 def save_ui_state(state):
-    os.makedirs(os.path.dirname(UI_STATE_FILE), exist_ok=True)
     try:
-        with open(UI_STATE_FILE, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2)
+        persistence.write_json(UI_STATE_FILE, state, indent=2, ensure_ascii=True)
     except Exception as e:
         logger.error(f"Error saving UI state: {e}")
 
@@ -329,9 +341,58 @@ else:
     # Initialize with empty values if no config found
     llm_client = LLMClient(api_key="", base_url="", model="")
 
+# 按端点的并发与 TPM 限制
+llm_scheduler.configure(config_data.get("configs", []))
+
 # Initialize Chat Manager
 chat_manager = ChatManager()
 
+
+def load_search_text(source: str, key: str, position: int) -> dict | None:
+    """读取检索结果的原文及展示信息"""
+    if source == SOURCE_CHAT:
+        meta = chat_manager.chats.get(key)
+        page = chat_manager.get_messages_page(key, 1, before=position + 1) if meta else None
+        if not page or not page["messages"]:
+            return None
+        message = page["messages"][0]
+        return {"text": message.get("content", ""), "chat_id": key, "chat_title": meta["title"], "role": message.get("role")}
+    record = transcript_log.read(key, position)
+    if not record:
+        return None
+    return {"text": record.get("text", ""), "speaker": record.get("speaker", ""), "time": record.get("time", "")}
+
+
+def on_chat_changed(chat_id: str, start: int, messages: list | None):
+    if messages is None:
+        search_index.remove_chat(chat_id)
+    else:
+        search_index.update_chat(chat_id, start, messages)
+
+
+# 聊天记录与语音转写的全文索引：增量更新，已有数据在启动后由后台线程建立
+search_index = SearchIndex(text_loader=load_search_text)
+chat_manager.add_listener(on_chat_changed)
+chat_manager.add_listener(prompt_cache.on_chat_changed)
+transcript_log.add_listener(search_index.add_transcript)
+
+# 冷聊天归档检查间隔（秒）
+CHAT_ARCHIVE_INTERVAL = 3600
+chat_archive_task = None
+
+
+async def chat_archive_loop():
+    """定期把长期未更新的聊天归档为压缩块（chat_archive_days，0 表示不归档）"""
+    while True:
+        try:
+            days = load_config().get("chat_archive_days", DEFAULT_ARCHIVE_DAYS)
+            count = chat_manager.archive_cold_chats(days)
+            if count:
+                logger.info(f"[聊天归档] 已登记 {count} 个超过 {days} 天未更新的聊天")
+        except Exception as e:
+            logger.error(f"[聊天归档] 检查失败: {e}")
+        await asyncio.sleep(CHAT_ARCHIVE_INTERVAL)
+
 # Initialize Resume Manager
 resume_manager = ResumeManager(llm_client=llm_client)
 # Initialize Resume Manager
@@ -358,49 +419,71 @@ def update_job_context_cache():
 # Load initial job context
 update_job_context_cache()
 
+def collect_prewarm_targets(config_data: dict | None = None) -> list[tuple[str, str]]:
+    """收集需要预热的 LLM 端点：当前模型、智囊团成员以及智能分析/意图识别的 API 模型"""
+    config_data = config_data or load_config()
+    configs = {c.get("name"): c for c in config_data.get("configs", [])}
+    agent_config = config_data.get("agent_config", {})
+
+    names = {config_data.get("current_config")}
+    names.update(config_data.get("multi_llm_active_names", []))
+    if agent_config.get("enabled") and agent_config.get("model_type", "api") == "api":
+        names.add(agent_config.get("model_name"))
+        names.update(agent_config.get("hedge_models", []))
+    if agent_config.get("intent_recognition_enabled") and agent_config.get("intent_model_type", "local") == "api":
+        names.add(agent_config.get("intent_model_name"))
+        names.update(agent_config.get("intent_hedge_models", []))
+
+    targets = []
+    for name in names:
+        conf = configs.get(name)
+        if conf and conf.get("api_key") and conf.get("base_url"):
+            targets.append((conf["api_key"], conf["base_url"]))
+    return targets
+
+def schedule_llm_prewarm(config_data: dict | None = None):
+    """后台预热 LLM 连接（需在事件循环中调用）"""
+    targets = collect_prewarm_targets(config_data)
+    if targets:
+        asyncio.get_running_loop().create_task(client_pool.prewarm_many(targets))
+
 # Load initial resume config
 _initial_config = load_config()
 if "resume_config" in _initial_config:
     resume_manager.update_config(_initial_config["resume_config"])
 
 # --- Connection Manager for ASR ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+# ASR 面板 (/ws) 广播：每个客户端独立排队发送，ASR 状态消息在队列中合并
+ASR_STATUS_COALESCE_KEY = "asr_status"
+manager = FanoutManager(name="ASR广播")
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# ASR Instance
+asr_system = None
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+# We need a reference to the main event loop to schedule tasks from the ASR thread
+main_event_loop = None
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                logger.error(f"Error sending message: {e}")
 
-manager = ConnectionManager()
+def broadcast_asr_message(message: dict):
+    """ASR 消息桥处理函数：推送到 ASR 面板（事件循环线程）"""
+    manager.publish(message, coalesce_key=ASR_STATUS_COALESCE_KEY if "asr_status" in message else None)
 
-# ASR Instance
-asr_system = None
 
-def asr_callback(message):
-    """Callback function to be called by ASR system when a message is ready"""
-    logger.debug(f"Callback received: {message}")
+def publish_voiceprint_job(job: dict):
+    """声纹注册进度回调（工作线程）：交给事件循环广播，同一任务的进度在发送队列中合并"""
+    loop = main_event_loop
+    if loop is None or loop.is_closed():
+        return
     try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-             asyncio.run_coroutine_threadsafe(manager.broadcast(message), loop)
-        else:
-             pass
+        loop.call_soon_threadsafe(manager.publish, {"voiceprint_job": job}, f"voiceprint_job:{job['id']}")
     except RuntimeError:
+        # 事件循环已关闭
         pass
 
-# We need a reference to the main event loop to schedule tasks from the ASR thread
-main_event_loop = None
+
+def feed_trigger_manager(message: dict):
+    """ASR 消息桥处理函数：更新智能分析触发状态（事件循环线程）"""
+    trigger_manager.add_message(message)
 
 
 def build_asr_status_payload(message: str | None = None):
@@ -425,7 +508,7 @@ def build_asr_status_payload(message: str | None = None):
 
 
 async def broadcast_asr_status(message: str | None = None):
-    await manager.broadcast(build_asr_status_payload(message))
+    await manager.broadcast(build_asr_status_payload(message), coalesce_key=ASR_STATUS_COALESCE_KEY)
 
 # --- 智能分析回调处理 ---
 async def agent_analysis_callback(result, messages, speaker_name):
@@ -496,8 +579,9 @@ async def agent_analysis_callback(result, messages, speaker_name):
                     current_chat_id = new_chat['id']
                     logger.info(f"[智能分析] ✅ 创建新聊天: {current_chat_id}")
 
-                # 准备消息上下文（最近的 10 条消息）
-                recent_messages = messages[-10:] if len(messages) > 10 else messages
+                # 准备消息上下文：按 token 预算保留最新消息，早期对话以摘要形式保留
+                answer_budget = load_config().get("agent_config", {}).get("answer_context_token_budget", 3000)
+                recent_messages = pack_recent(messages, answer_budget)
                 logger.info(f"[智能分析] 准备发送 {len(recent_messages)} 条消息给AI")
 
                 # 获取分发配置
@@ -613,49 +697,247 @@ async def agent_analysis_callback(result, messages, speaker_name):
         traceback.print_exc()
 
 # --- LLM 连接管理器 ---
+# /ws/llm 断线后会话的保留时长（秒，配置项 ws_resume_grace_seconds），期间重连可续传；
+# 默认 0：断开即取消全部上游请求，只有显式配置宽限期时才为续传保留会话（期间生成继续并计费）
+DEFAULT_LLM_RESUME_GRACE = 0.0
+LLM_REPLAY_SIZE = 4096
+
+
+class LLMSession:
+    """
+    /ws/llm 连接会话
+
+    每个聊天最多一个进行中的生成任务：新的 agent_triggered 会抢占同一聊天的旧回答，
+    普通消息则排在旧任务之后。
+    会话发出的每条消息带递增序号 seq 并记录在重放环中。默认连接断开即取消会话的全部任务、中止上游请求；
+    配置了续传宽限期时会话保留该时长，生成继续进行（只记录不发送），客户端携带 session 与最后收到的序号
+    重连即可补发缺失的消息，超过宽限期仍未重连才取消。
+    单条消息发送超过 send_timeout 秒（客户端停止读取）时断开该连接，按断线处理，
+    避免停滞的标签页占住发送锁，也不拖慢对其他会话的广播。
+    """
+
+    # 因发送超时断开的连接数（全部会话累计）
+    slow_disconnects = 0
+
+    def __init__(self, websocket: WebSocket, codec=JSON_CODEC, send_timeout: float = DEFAULT_SEND_TIMEOUT):
+        self.session_id = uuid.uuid4().hex
+        self.websocket: WebSocket | None = websocket
+        # 线路编码（JSON 文本或 MessagePack），随重连的新连接更新
+        self.codec = codec
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.ring = ReplayRing(LLM_REPLAY_SIZE)
+        # 保证序号顺序与发送顺序一致，重连补发期间的新消息排在补发之后
+        self._send_lock = asyncio.Lock()
+        self.send_timeout = send_timeout
+        self._expire_handle: asyncio.TimerHandle | None = None
+
+    # ---- 发送 ----
+
+    async def send_text(self, text: str):
+        """发送已序列化的 JSON 对象：分配序号并记录，连接断开期间只记录"""
+        async with self._send_lock:
+            _, text = self.ring.append(text)
+            websocket = self.websocket
+            if websocket is None:
+                return
+            try:
+                await asyncio.wait_for(self.codec.send(websocket, text), self.send_timeout)
+            except asyncio.TimeoutError:
+                # 消息已在重放环中，客户端重连后补发
+                LLMSession.slow_disconnects += 1
+                logger.warning(f"[LLM会话] 会话 {self.session_id[:8]} 发送超过 {self.send_timeout:g}s 未完成，断开连接等待重连")
+                if self.websocket is websocket:
+                    self.websocket = None
+                asyncio.create_task(self._close_quietly(websocket))
+            except Exception as e:
+                logger.info(f"[LLM会话] 发送失败，等待客户端重连: {e}")
+                if self.websocket is websocket:
+                    self.websocket = None
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def send_json(self, payload: dict):
+        await self.send_text(encode_json(payload))
+
+    # ---- 连接 ----
+
+    async def attach(self, websocket: WebSocket, since: int, codec=JSON_CODEC):
+        """客户端重连：补发序号大于 since 的消息后改用新连接发送"""
+        async with self._send_lock:
+            self.codec = codec
+            if self._expire_handle is not None:
+                self._expire_handle.cancel()
+                self._expire_handle = None
+            complete, texts = self.ring.since(since)
+            # 补发同样受发送超时限制，超时抛出后由调用方按断线处理
+            await asyncio.wait_for(websocket.send_text(encode_json({
+                "type": "session",
+                "session_id": self.session_id,
+                "resumed": True,
+                "since": since,
+                "latest": self.ring.last_seq,
+                "complete": complete
+            })), self.send_timeout)
+            for text in texts:
+                await asyncio.wait_for(codec.send(websocket, text), self.send_timeout)
+            self.websocket = websocket
+        logger.info(f"[LLM会话] 会话 {self.session_id[:8]} 已续传，补发 {len(texts)} 条{'' if complete else '（部分消息已淘汰）'}")
+
+    def detach(self, websocket: WebSocket, grace: float, on_expire):
+        """连接断开：宽限期后仍未重连则调用 on_expire(会话)"""
+        if self.websocket is websocket:
+            self.websocket = None
+        if self.websocket is None and self._expire_handle is None:
+            self._expire_handle = asyncio.get_running_loop().call_later(
+                grace, lambda: asyncio.create_task(on_expire(self))
+            )
+
+    # ---- 任务 ----
+
+    def submit(self, chat_id: str | None, factory, preempt: bool = False):
+        key = chat_id or "__default__"
+        previous = self.tasks.get(key)
+        if previous and not previous.done() and preempt:
+            previous.cancel()
+            logger.info(f"[LLM会话] 新的触发抢占聊天 {key} 的进行中回答")
+        self.tasks[key] = asyncio.create_task(self._run(key, previous, factory))
+
+    async def _run(self, key: str, previous: asyncio.Task | None, factory):
+        try:
+            if previous and not previous.done():
+                # 等待旧任务结束（被抢占时等待其完成清理与保存）
+                await asyncio.gather(previous, return_exceptions=True)
+            await factory()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"[LLM会话] 处理请求失败: {e}")
+        finally:
+            if self.tasks.get(key) is asyncio.current_task():
+                del self.tasks[key]
+
+    async def close(self):
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+            self._expire_handle = None
+        pending = [task for task in self.tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.info(f"[LLM会话] 会话结束，已取消 {len(pending)} 个进行中的生成")
+        self.tasks.clear()
+
+
 class LLMConnectionManager:
+    """/ws/llm 会话注册表：广播发送到所有会话（断线会话记录在其重放环中）"""
+
     def __init__(self):
-        self.active_connections: list[WebSocket] = []
+        self.sessions: dict[str, LLMSession] = {}
 
-    async def connect(self, websocket: WebSocket):
+    @property
+    def active_connections(self) -> list[WebSocket]:
+        return [session.websocket for session in self.sessions.values() if session.websocket is not None]
+
+    async def connect(self, websocket: WebSocket, notice: str | None = None):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"[LLM连接] 新连接加入，当前活跃连接数: {len(self.active_connections)}")
+        if notice is not None:
+            await websocket.send_text(notice)
+        logger.info(f"[LLM连接] 新连接加入，当前活跃连接数: {len(self.active_connections) + 1}")
 
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logger.info(f"[LLM连接] 连接断开，当前活跃连接数: {len(self.active_connections)}")
-        else:
-            logger.warning(f"[LLM连接] 尝试断开不存在的连接")
+    def register(self, session: LLMSession):
+        self.sessions[session.session_id] = session
 
-    async def broadcast(self, message: dict):
-        logger.info(f"[LLM广播] 开始广播到 {len(self.active_connections)} 个连接")
-        logger.debug(f"[LLM广播] 消息类型: {message.get('type', 'unknown')}")
-        logger.debug(f"[LLM广播] 消息内容: {str(message)[:100]}{'...' if len(str(message)) > 100 else ''}")
+    def get(self, session_id: str | None) -> LLMSession | None:
+        return self.sessions.get(session_id) if session_id else None
 
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-                logger.debug(f"[LLM广播] ✅ 成功发送到连接")
-            except Exception as e:
-                logger.error(f"[LLM广播] ❌ 广播失败: {e}")
-                disconnected.append(connection)
+    async def release(self, session: LLMSession, websocket: WebSocket, grace: float):
+        """连接断开：宽限期为 0 时立即结束会话，否则等待重连"""
+        session.detach(websocket, max(0.0, grace), self.close_session)
+        if grace <= 0 and session.websocket is None:
+            await self.close_session(session)
+        logger.info(f"[LLM连接] 连接断开，当前活跃连接数: {len(self.active_connections)}")
 
-        # 移除断开的连接
-        for conn in disconnected:
-            if conn in self.active_connections:
-                self.active_connections.remove(conn)
+    async def close_session(self, session: LLMSession):
+        if self.sessions.get(session.session_id) is session:
+            del self.sessions[session.session_id]
+        await session.close()
 
-        logger.info(f"[LLM广播] 广播完成，剩余 {len(self.active_connections)} 个活跃连接")
+    async def broadcast(self, message: dict):
+        logger.info("[LLM广播] 开始广播到 %d 个会话", len(self.sessions))
+        # 只序列化一次，各会话只插入自己的序号
+        text = encode_json(message)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[LLM广播] 消息类型: {message.get('type', 'unknown')}")
+            logger.debug(f"[LLM广播] 消息内容: {text[:100]}{'...' if len(text) > 100 else ''}")
+        # 并发发送：各会话的发送互不等待，停滞的会话最多拖延自身 send_timeout 秒
+        await asyncio.gather(*(session.send_text(text) for session in list(self.sessions.values())))
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "connected": len(self.active_connections),
+            "replay_entries": sum(session.ring.stats()["entries"] for session in self.sessions.values()),
+            "slow_disconnects": LLMSession.slow_disconnects,
+            "encodings": dict(Counter(
+                session.codec.name for session in self.sessions.values() if session.websocket is not None
+            ))
+        }
 
 llm_manager = LLMConnectionManager()
 
 
 # --- 智囊团请求处理函数 ---
-async def handle_multi_llm_request(websocket: WebSocket, messages: list, chat_id: str):
-    """处理智囊团请求"""
+# 智囊团完成模式：all 等待全部完成；first_k 完成 k 个后取消其余；deadline 在 T 秒时截止
+THINK_TANK_COMPLETION_MODES = ("all", "first_k", "deadline")
+PARTIAL_ANSWER_MARKER = "\n\n_[部分回答：生成被提前结束]_"
+
+
+def resolve_think_tank_completion(config_data: dict, override: dict | None = None) -> dict:
+    """合并配置与单次请求覆盖的智囊团完成策略"""
+    completion = {"mode": "all", "k": 1, "deadline": 15.0}
+    completion.update(config_data.get("think_tank_completion") or {})
+    completion.update({k: v for k, v in (override or {}).items() if v is not None})
+    if completion["mode"] not in THINK_TANK_COMPLETION_MODES:
+        logger.warning(f"[智囊团] 未知完成模式 '{completion['mode']}'，改用 all")
+        completion["mode"] = "all"
+    try:
+        completion["k"] = max(1, int(completion["k"]))
+        completion["deadline"] = max(1.0, float(completion["deadline"]))
+    except (TypeError, ValueError):
+        completion["k"], completion["deadline"] = 1, 15.0
+    return completion
+
+
+async def send_json_quietly(websocket: "WebSocket | LLMSession", payload: dict):
+    """发送消息，连接已断开时静默忽略"""
+    try:
+        await websocket.send_json(payload)
+    except Exception:
+        pass
+
+
+def create_stream_coalescer(websocket: "WebSocket | LLMSession", config_data: dict, **frame_fields) -> StreamCoalescer:
+    """按配置 (stream_flush_interval_ms / stream_flush_bytes) 创建流式增量合并器"""
+    return StreamCoalescer(
+        websocket.send_text,
+        {"type": "chunk", **frame_fields},
+        interval_ms=config_data.get("stream_flush_interval_ms", DEFAULT_FLUSH_INTERVAL_MS),
+        max_bytes=config_data.get("stream_flush_bytes", DEFAULT_FLUSH_BYTES)
+    )
+
+
+async def handle_multi_llm_request(websocket: LLMSession, messages: list, chat_id: str, completion: dict | None = None):
+    """处理智囊团请求
+
+    Args:
+        completion: 单次请求的完成策略覆盖，如 {"mode": "first_k", "k": 2} 或 {"mode": "deadline", "deadline": 8}
+    """
     config_data = load_config()
     active_names = config_data.get("multi_llm_active_names", [])
     configs = config_data.get("configs", [])
@@ -673,6 +955,10 @@ async def handle_multi_llm_request(websocket: WebSocket, messages: list, chat_id
         await websocket.send_json({"type": "error", "content": "请先设置目标岗位，完成岗位分析。助手对话框右上角→设置目标岗位"})
         return
 
+    completion = resolve_think_tank_completion(config_data, completion)
+    # 已流式输出的内容，用于在取消/截止时保留部分回答
+    partial_texts: dict[str, str] = {}
+
     # Prepare tasks
     async def stream_one(conf):
         name = conf["name"]
@@ -680,7 +966,8 @@ async def handle_multi_llm_request(websocket: WebSocket, messages: list, chat_id
             client = LLMClient(conf["api_key"], conf["base_url"], conf["model"])
 
             # Handle separate system prompt
-            current_messages = [m.copy() for m in messages]
+            # 只有系统消息会被原地修改，其余消息直接共享
+            current_messages = [m.copy() if m.get("role") == "system" else m for m in messages]
             config_prompt = conf.get("system_prompt", "").strip()
 
             # Check identity tags and resolve active role
@@ -738,38 +1025,127 @@ async def handle_multi_llm_request(websocket: WebSocket, messages: list, chat_id
             logger.debug(f"\n{'='*80}\n")
 
             full_resp = ""
-            async for chunk in client.chat_stream(current_messages):
-                await websocket.send_json({
-                    "type": "chunk",
-                    "model": name,
-                    "content": chunk
-                })
-                full_resp += chunk
+            coalescer = create_stream_coalescer(websocket, config_data, model=name)
+            try:
+                # aclosing 保证任务被取消时流被关闭，连同底层 HTTP 响应
+                async with contextlib.aclosing(client.chat_stream(current_messages)) as stream:
+                    async for chunk in stream:
+                        await coalescer.push(chunk)
+                        full_resp += chunk
+                        partial_texts[name] = full_resp
+            finally:
+                # 被取消时也发出已缓冲的内容，与保存的部分回答保持一致
+                await coalescer.aclose()
 
             await websocket.send_json({"type": "done_one", "model": name})
-            return name, full_resp
+            # 错误文本、空响应警告与空回答都不计入 first_k / deadline 的成功数
+            return name, full_resp, not is_error_response(full_resp)
         except Exception as e:
             err_msg = f"Error: {str(e)}"
             await websocket.send_json({"type": "error", "content": f"[{name}] {err_msg}"})
-            return name, f"[Error] {err_msg}"
+            return name, f"[Error] {err_msg}", False
 
     # Run all concurrently
-    tasks = [stream_one(c) for c in active_configs]
-    results = await asyncio.gather(*tasks)
+    mode = completion["mode"]
+    tasks = {asyncio.create_task(stream_one(c)): c["name"] for c in active_configs}
+    results: dict[str, tuple[str, bool]] = {}  # name -> (text, partial)
+
+    def collect(done_tasks):
+        succeeded = 0
+        for task in done_tasks:
+            if task.cancelled():
+                continue
+            name, text, ok = task.result()
+            results[name] = (text, False)
+            succeeded += int(ok)
+        return succeeded
 
-    await websocket.send_json({"type": "done_all"})
+    pending = set(tasks)
+    interrupted = False
+    try:
+        if mode == "deadline":
+            done, pending = await asyncio.wait(pending, timeout=completion["deadline"])
+            collect(done)
+        elif mode == "first_k":
+            target = min(completion["k"], len(tasks))
+            succeeded = 0
+            while pending and succeeded < target:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded += collect(done)
+        else:
+            done, pending = await asyncio.wait(pending)
+            collect(done)
+    except asyncio.CancelledError:
+        # 会话被抢占或连接断开：取消全部模型，保留已输出的部分回答
+        interrupted = True
+        collect([task for task in tasks if task.done()])
+        pending = {task for task in tasks if not task.done()}
+
+    # 取消未完成的模型；已输出的内容作为部分回答保留
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in pending:
+            name = tasks[task]
+            if not task.cancelled():
+                # 取消前恰好已完成
+                collect([task])
+                continue
+            text = partial_texts.get(name, "")
+            if text:
+                results[name] = (text, True)
+            await send_json_quietly(websocket, {"type": "done_one", "model": name, "partial": True, "marker": PARTIAL_ANSWER_MARKER if text else ""})
+        logger.info(f"[智囊团] 完成模式 {'中断' if interrupted else mode}: 已取消 {len(pending)} 个未完成的模型")
+
+    await send_json_quietly(websocket, {
+        "type": "done_all",
+        "completion_mode": mode,
+        "cancelled": interrupted,
+        "partial_models": [name for name, (_, partial) in results.items() if partial]
+    })
 
     # Save to history
     if chat_id:
-        # Append all responses
-        for name, text in results:
-            messages.append({"role": "assistant", "content": f"**{name}**:\n{text}"})
+        # Append responses in config order; partial answers carry a marker
+        for conf in active_configs:
+            name = conf["name"]
+            if name not in results:
+                continue
+            text, partial = results[name]
+            entry = {"role": "assistant", "content": f"**{name}**:\n{text}{PARTIAL_ANSWER_MARKER if partial else ''}"}
+            if partial:
+                entry["partial"] = True
+            messages.append(entry)
         chat_manager.update_chat_messages(chat_id, messages)
 
+    if interrupted:
+        raise asyncio.CancelledError()
+
 @app.on_event("startup")
 async def startup_event():
-    global asr_system, main_event_loop
+    global asr_system, main_event_loop, chat_archive_task
     main_event_loop = asyncio.get_running_loop()
+    chat_archive_task = asyncio.create_task(chat_archive_loop())
+
+    # ASR 线程的转写结果经消息桥批量交给事件循环，广播与触发机制只在事件循环线程中执行
+    asr_bridge.start(main_event_loop)
+    asr_bridge.add_handler(broadcast_asr_message)
+    voiceprint_enrollment.add_listener(publish_voiceprint_job)
+    if AGENT_AVAILABLE:
+        asr_bridge.add_handler(feed_trigger_manager)
+
+    # 静态资源读入内存并预压缩，index.html 改为引用带指纹的地址（开发时可关闭以直接读取磁盘文件）
+    if load_config().get("static_asset_cache", True):
+        try:
+            await asyncio.to_thread(static_assets.load)
+        except Exception as e:
+            logger.error(f"[静态资源] 缓存失败，改为直接读取文件: {e}")
+
+    # 后台为已有聊天记录与转写记录建立全文索引
+    threading.Thread(
+        target=search_index.bootstrap, args=(chat_manager, transcript_log), name="search-index", daemon=True
+    ).start()
 
     # Initialize ASR system only if not skipped
     if not args.no and ASR_AVAILABLE:
@@ -777,16 +1153,10 @@ async def startup_event():
         asr_system_initialized = False
 
         def thread_safe_callback(message):
-            # Send to WebSocket clients
-            if main_event_loop and main_event_loop.is_running():
-                asyncio.run_coroutine_threadsafe(manager.broadcast(message), main_event_loop)
-
-            # Send to trigger manager
-            if AGENT_AVAILABLE:
-                try:
-                    trigger_manager.add_message(message)
-                except Exception as e:
-                    logger.error(f"[触发机制] 处理消息失败: {e}")
+            # 持久化转写结果（同时写入全文索引），文件写入留在 ASR 线程
+            transcript_log.append(message)
+            # 广播与触发机制交给事件循环线程批量处理
+            asr_bridge.submit(message)
 
         try:
             asr_system = RealTimeASR_SV(on_message_callback=thread_safe_callback)
@@ -868,6 +1238,10 @@ async def startup_event():
             min_characters = agent_config.get("min_characters", 10)
             silence_threshold = agent_config.get("silence_threshold", 2)
             trigger_manager.set_thresholds(min_characters, silence_threshold)
+            trigger_manager.set_context_budgets(
+                agent_config.get("context_token_budget"),
+                agent_config.get("summary_token_budget")
+            )
             logger.info(f"[成功] 触发参数已加载: {min_characters}字, {silence_threshold}秒")
 
             # 加载主人公配置
@@ -892,23 +1266,64 @@ async def startup_event():
     except Exception as e:
         logger.error(f"[错误] 无法打开浏览器: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 先停止归档检查，之后不再登记新的归档任务（已登记的随下面的 flush 完成）
+    if chat_archive_task is not None:
+        chat_archive_task.cancel()
+        await asyncio.gather(chat_archive_task, return_exceptions=True)
+    # 关闭连接池中的 LLM 客户端，释放长连接
+    await client_pool.close_all()
+    voiceprint_enrollment.shutdown()
+    # 等待后台持久化队列中的配置与聊天记录全部落盘，再关闭聊天数据库
+    if await asyncio.to_thread(persistence.flush):
+        chat_manager.close()
+    else:
+        logger.warning("[持久化] 关闭时仍有未完成的写入，保留聊天数据库连接")
+
 @app.get("/")
-async def get():
+async def get(request: Request):
+    if static_assets.loaded:
+        return static_assets.index_response(request)
     with open("static/index.html", "r", encoding="utf-8") as f:
         return HTMLResponse(content=f.read())
 
+@app.get("/assets/{version}/{path:path}")
+async def get_asset(version: str, path: str, request: Request):
+    """带指纹的静态资源（内存缓存、预压缩、immutable 长期缓存）"""
+    response = static_assets.asset_response(version, path, request) if static_assets.loaded else None
+    if response is None:
+        raise HTTPException(status_code=404, detail="资源不存在")
+    return response
+
+def parse_since(value: str | None) -> int | None:
+    """解析重连时的 since 参数（最后收到的序号）"""
+    try:
+        return max(0, int(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    # ?encoding=msgpack 时高频消息以二进制帧发送
+    codec, notice = negotiate_codec(websocket)
+    await manager.connect(websocket, codec, notice)
 
-    # 立即发送 ASR 系统状态给前端
-    await websocket.send_json(build_asr_status_payload())
+    # 立即发送 ASR 系统状态给前端（经由该客户端的发送队列，与广播保持顺序）
+    manager.send(websocket, build_asr_status_payload(), coalesce_key=ASR_STATUS_COALESCE_KEY)
+    # 重连时携带最后收到的序号，补发断线期间的转写与分析状态
+    since = parse_since(websocket.query_params.get("since"))
+    if since is not None:
+        manager.resume(websocket, since)
 
     try:
         while True:
             # Keep the connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 @app.post("/api/asr/start")
@@ -917,6 +1332,9 @@ async def start_asr_listening():
         raise HTTPException(status_code=503, detail="ASR 系统未初始化")
 
     asr_system.start_listening()
+    # 开始监听即预热 LLM 连接，并在会话期间保活
+    schedule_llm_prewarm()
+    client_pool.start_keepalive(collect_prewarm_targets)
     await broadcast_asr_status("实时语音转写已启用")
     return {"status": "success", "listening": asr_system.is_listening()}
 
@@ -927,11 +1345,31 @@ async def stop_asr_listening():
         raise HTTPException(status_code=503, detail="ASR 系统未初始化")
 
     asr_system.stop_listening()
+    client_pool.stop_keepalive()
     await broadcast_asr_status("实时语音转写已暂停")
     return {"status": "success", "listening": asr_system.is_listening()}
 
 # --- LLM Endpoints ---
 
+@app.get("/api/llm/stats")
+async def get_llm_stats():
+    """LLM 连接池、首 token 延迟 (冷/热连接)、对冲、端点健康度、调度排队、流式帧与 prompt 缓存统计"""
+    return {
+        "pool": client_pool.stats(),
+        "ttft": ttft_stats.snapshot(),
+        "hedge": hedge_stats.snapshot(),
+        "providers": provider_health.snapshot(),
+        "scheduler": llm_scheduler.snapshot(),
+        "stream": coalesce_stats.snapshot(),
+        "persistence": persistence.stats(),
+        "fanout": manager.stats(),
+        "asr_bridge": asr_bridge.stats(),
+        "llm_sessions": llm_manager.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "ws_codec": codec_stats(),
+        "static_assets": static_assets.stats()
+    }
+
 @app.get("/api/ui_state")
 async def get_ui_state():
     """获取前端 UI 状态"""
@@ -1040,22 +1478,26 @@ async def update_config(data: dict = Body(...)):
     Update configuration. 
     Expected data: { "configs": [...], "current_config": "Name" }
     """
+    global llm_client
     save_config(data)
+    llm_scheduler.configure(data.get("configs", []))
     
     # Reload LLM Client if current config changed
     new_current_name = data.get("current_config")
     new_config = next((c for c in data.get("configs", []) if c["name"] == new_current_name), None)
     
     if new_config:
-        llm_client.update_config(
+        # 简历/岗位分析换用新的客户端对象（连接取自 client_pool），进行中的后台任务继续使用原客户端
+        llm_client = LLMClient(
             api_key=new_config.get("api_key"),
             base_url=new_config.get("base_url"),
             model=new_config.get("model")
         )
-        # Update ResumeManager's LLM client as well
         resume_manager.set_llm_client(llm_client)
-        # Update JobManager's LLM client too
         job_manager.set_llm_client(llm_client)
+
+    # 新配置生效后预热相关端点的连接
+    schedule_llm_prewarm(data)
     
     return {"status": "success", "message": "配置已更新"}
 
@@ -1071,17 +1513,26 @@ async def test_connection_endpoint(data: dict = Body(...)):
     if not all([api_key, base_url, model]):
         return {"success": False, "message": "缺少必需字段"}
         
-    client = LLMClient(api_key=api_key, base_url=base_url, model=model)
-    success, message = await client.test_connection()
+    # 一次性测试不放入全局连接池，避免错误配置残留
+    client = LLMClient(api_key=api_key, base_url=base_url, model=model, pooled=False)
+    try:
+        success, message = await client.test_connection()
+    finally:
+        await client.close()
     return {"success": success, "message": message}
 
 # --- Chat Management Endpoints ---
 
 @app.get("/api/chats")
-async def get_chats():
+async def get_chats(limit: int | None = None, cursor: str | None = None):
+    """聊天索引（不含消息）：id、标题、更新时间、消息数与最后一条消息摘要，可按游标分页"""
+    if limit is not None and limit <= 0:
+        raise HTTPException(status_code=400, detail="limit 必须为正整数")
+    chats, next_cursor = chat_manager.list_chat_index(limit=limit, cursor=cursor)
     return {
         "current_chat_id": chat_manager.get_current_chat_id(),
-        "chats": chat_manager.get_all_chats()
+        "chats": chats,
+        "next_cursor": next_cursor
     }
 
 @app.post("/api/chats")
@@ -1091,11 +1542,28 @@ async def create_chat(data: dict = Body(...)):
     return new_chat
 
 @app.get("/api/chats/{chat_id}")
-async def get_chat(chat_id: str):
-    chat = chat_manager.get_chat(chat_id)
-    if not chat:
+async def get_chat(chat_id: str, limit: int | None = None, before: int | None = None):
+    """
+    获取聊天详情；指定 limit 时只返回位置在 before 之前的最近 limit 条消息，
+    并附带 start（首条消息位置）、total 与 has_more 用于继续向前翻页
+    """
+    if limit is None:
+        chat = chat_manager.get_chat(chat_id)
+        if not chat:
+            raise HTTPException(status_code=404, detail="未找到聊天")
+        return chat
+
+    page = chat_manager.get_messages_page(chat_id, max(0, limit), before)
+    if page is None:
         raise HTTPException(status_code=404, detail="未找到聊天")
-    return chat
+    meta = chat_manager.chats[chat_id]
+    return {
+        "id": chat_id,
+        "title": meta["title"],
+        "created_at": meta["created_at"],
+        "updated_at": meta["updated_at"],
+        **page
+    }
 
 @app.delete("/api/chats/{chat_id}")
 async def delete_chat(chat_id: str):
@@ -1111,6 +1579,21 @@ async def clear_chat(chat_id: str):
         raise HTTPException(status_code=404, detail="未找到聊天")
     return {"status": "success"}
 
+@app.get("/api/search")
+async def search_history(q: str, limit: int = 20, source: str | None = None):
+    """全文检索聊天记录与语音转写（BM25 排序，摘要中命中词以 <mark> 高亮）"""
+    if source not in (None, SOURCE_CHAT, SOURCE_ASR):
+        raise HTTPException(status_code=400, detail="source 只能为 chat 或 asr")
+    limit = max(1, min(limit, 100))
+    start = time.perf_counter()
+    results = await asyncio.to_thread(search_index.search, q, limit, source)
+    return {
+        "query": q,
+        "results": results,
+        "took_ms": round((time.perf_counter() - start) * 1000, 1),
+        "index": search_index.stats()
+    }
+
 # --- Intelligent Agent Endpoints ---
 
 @app.get("/api/agent/status")
@@ -1130,6 +1613,7 @@ async def get_agent_status():
         "enabled": agent_manager.enabled,
         "auto_trigger": agent_manager.auto_trigger,
         "status": trigger_manager.get_status(),
+        "runtime": agent_manager.get_runtime_status(),
         "config": agent_config,
         "model_local": config_data.get("model_local", ["Qwen3-0.6B"])
     }
@@ -1178,10 +1662,23 @@ async def update_agent_config(data: dict = Body(...)):
     if not AGENT_AVAILABLE:
         raise HTTPException(status_code=503, detail="智能 Agent 模块不可用")
     print(f"DEBUG: Received update_agent_config data: {data}")
-    
+
+    # 本地模型推理精度：未知取值直接拒绝，不写入配置
+    precision_updates = {}
+    for precision_key in ("precision", "intent_precision"):
+        if precision_key in data:
+            value = str(data[precision_key] or "auto").strip().lower()
+            if value not in LOCAL_PRECISION_CHOICES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{precision_key} 必须是 {', '.join(LOCAL_PRECISION_CHOICES)} 之一"
+                )
+            precision_updates[precision_key] = value
+
     # Update config file
     config_data = load_config()
     agent_config = config_data.get("agent_config", {})
+    previous_precision = {key: agent_config.get(key, "auto") for key in precision_updates}
     
     # Only update fields that are present in data
     if "min_characters" in data:
@@ -1207,6 +1704,23 @@ async def update_agent_config(data: dict = Body(...)):
     if "intent_model_type" in data:
         agent_config["intent_model_type"] = data["intent_model_type"]
 
+    # 本地模型推理精度 (auto/fp32/bf16/fp16/int8)
+    agent_config.update(precision_updates)
+
+    # 对冲端点：按优先级排列的等价 API 配置名称
+    for hedge_key in ("hedge_models", "intent_hedge_models"):
+        if hedge_key in data:
+            value = data[hedge_key] or []
+            agent_config[hedge_key] = [name for name in value if isinstance(name, str) and name]
+
+    # 上下文 token 预算：分析窗口 / 滚动摘要 / 回答模型
+    for budget_key in ("context_token_budget", "summary_token_budget", "answer_context_token_budget"):
+        if budget_key in data:
+            try:
+                agent_config[budget_key] = max(32, int(data[budget_key]))
+            except (TypeError, ValueError):
+                logger.warning(f"[配置] 忽略非法的 {budget_key}: {data[budget_key]}")
+
     if "intent_manual_history_limit" in data:
         try:
             limit_value = int(data["intent_manual_history_limit"])
@@ -1220,6 +1734,10 @@ async def update_agent_config(data: dict = Body(...)):
     silence_thresh = agent_config.get("silence_threshold", 2)
     
     trigger_manager.set_thresholds(min_chars, silence_thresh)
+    trigger_manager.set_context_budgets(
+        agent_config.get("context_token_budget"),
+        agent_config.get("summary_token_budget")
+    )
     
     config_data["agent_config"] = agent_config
     save_config(config_data)
@@ -1235,6 +1753,13 @@ async def update_agent_config(data: dict = Body(...)):
             model_config['model_type'] = 'api'
             agent_manager.load_agent(agent_config, model_config)
 
+    # 精度变化时重新加载已加载的本地模型（加载耗时，放到线程中进行）
+    for precision_key, intent in (("precision", False), ("intent_precision", True)):
+        if precision_key in precision_updates and precision_updates[precision_key] != previous_precision[precision_key]:
+            await asyncio.to_thread(agent_manager.reload_local_precision, precision_updates[precision_key], intent)
+
+    schedule_llm_prewarm(config_data)
+
     return {"status": "success", "config": agent_config}
 
 @app.post("/api/agent/analyze")
@@ -1242,6 +1767,7 @@ async def manual_analyze(data: dict = Body(...)):
     """手动触发智能分析或意图识别"""
     if not AGENT_AVAILABLE:
         raise HTTPException(status_code=503, detail="智能 Agent 模块不可用")
+    llm_priority.set(PRIORITY_REALTIME)
 
     messages = data.get("messages", [])
     speaker_name = data.get("speaker_name", "用户")
@@ -1273,7 +1799,15 @@ async def manual_analyze(data: dict = Body(...)):
         agent_manager.configure_intent_agent(
             {
                 "model_type": model_type,
-                "model_name": model_name
+                "model_name": model_name,
+                "precision": intent_cfg.get(
+                    "precision",
+                    config_data.get("agent_config", {}).get("intent_precision", "auto")
+                ),
+                "hedge_models": intent_cfg.get(
+                    "hedge_models",
+                    config_data.get("agent_config", {}).get("intent_hedge_models", [])
+                )
             },
             model_config
         )
@@ -1396,49 +1930,23 @@ async def trigger_multi_llm(data: dict = Body(...)):
 # --- 声纹管理 API ---
 
 @app.get("/api/voiceprints")
-async def get_voiceprints():
-    """获取声纹库列表"""
+async def get_voiceprints(request: Request):
+    """获取声纹库列表（内存缓存，支持 ETag / If-None-Match）"""
     # 即使ASR系统未初始化，也能查看声纹列表
     voiceprint_dir = asr_system.VOICEPRINT_DIR if asr_system else "voiceprints"
 
-    if not os.path.exists(voiceprint_dir):
-        return {"voiceprints": []}
-
-    voiceprints = []
-    for filename in os.listdir(voiceprint_dir):
-        if filename.lower().endswith('.wav'):
-            name = os.path.splitext(filename)[0]
-            wav_path = os.path.join(voiceprint_dir, filename)
-            npy_path = os.path.join(voiceprint_dir, f"{name}.npy")
+    # 目录有变化时才重新扫描（在线程中进行，只读取新增或变化的音频时长）
+    if voiceprint_catalog.is_stale(voiceprint_dir):
+        await asyncio.to_thread(voiceprint_catalog.refresh, voiceprint_dir)
+    etag, body = voiceprint_catalog.snapshot()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
-            # 获取文件大小
-            wav_size = os.path.getsize(wav_path)
-            has_embedding = os.path.exists(npy_path)
-            embedding_size = os.path.getsize(npy_path) if has_embedding else 0
-
-            # 获取音频时长（简单估算）
-            try:
-                import soundfile as sf
-                info = sf.info(wav_path)
-                duration = round(info.duration, 2)
-            except:
-                duration = None
-
-            voiceprints.append({
-                "name": name,
-                "wav_file": filename,
-                "wav_size": wav_size,
-                "has_embedding": has_embedding,
-                "embedding_size": embedding_size,
-                "duration": duration,
-                "created_time": os.path.getctime(wav_path)
-            })
-
-    return {"voiceprints": voiceprints}
-
-@app.post("/api/voiceprints")
+@app.post("/api/voiceprints", status_code=202)
 async def create_voiceprint(data: dict = Body(...)):
-    """录制并保存新的声纹"""
+    """登记声纹注册任务：解码、校验与嵌入计算在后台线程中进行，进度经 /ws 推送"""
     name = data.get("name", "").strip()
     audio_data = data.get("audio_data", "")
 
@@ -1448,100 +1956,30 @@ async def create_voiceprint(data: dict = Body(...)):
     if not audio_data:
         raise HTTPException(status_code=400, detail="缺少音频数据")
 
-    # 检查姓名是否已存在
     voiceprint_dir = asr_system.VOICEPRINT_DIR if asr_system else "voiceprints"
-    wav_path = os.path.join(voiceprint_dir, f"{name}.wav")
-    npy_path = os.path.join(voiceprint_dir, f"{name}.npy")
-
-    if os.path.exists(wav_path):
-        raise HTTPException(status_code=400, detail=f"说话人 '{name}' 已存在")
-
     try:
-        # 解码 base64 音频数据
-        # 前端发送的格式: "data:audio/wav;base64,<base64_data>"
-        if ',' in audio_data:
-            header, audio_base64 = audio_data.split(',', 1)
-        else:
-            audio_base64 = audio_data
-
-        audio_bytes = base64.b64decode(audio_base64)
-
-        # 保存为临时 WAV 文件
-        temp_path = os.path.join(voiceprint_dir, f"temp_{name}.wav")
-        with open(temp_path, 'wb') as f:
-            f.write(audio_bytes)
-
-        # 检查音频时长
-        duration = None
-        try:
-            import soundfile as sf
-            info = sf.info(temp_path)
-            duration = info.duration
+        job = voiceprint_enrollment.submit(name, audio_data, voiceprint_dir, asr_system)
+    except EnrollmentError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-            if duration < 10:
-                os.remove(temp_path)
-                raise HTTPException(status_code=400, detail=f"录制时长太短 ({duration:.1f}秒)，至少需要 10 秒")
+    return {
+        "status": "accepted",
+        "message": f"声纹注册任务已提交: {name}",
+        "job_id": job["id"],
+        "job": job
+    }
 
-            if duration > 40:
-                os.remove(temp_path)
-                raise HTTPException(status_code=400, detail=f"录制时长太长 ({duration:.1f}秒)，最多 40 秒")
-        except Exception as e:
-            os.remove(temp_path)
-            raise HTTPException(status_code=400, detail=f"音频验证失败: {str(e)}")
-
-        # 如果 ASR 系统已初始化，使用完整流程
-        if asr_system:
-            # 转换并保存为标准格式
-            asr_system.check_and_convert_audio(temp_path)
-            # 重命名为最终文件名
-            os.rename(temp_path, wav_path)
-
-            # 计算并保存嵌入
-            print(f"正在为 {name} 计算声纹嵌入...")
-            embedding = asr_system.extract_embedding(wav_path)
-            if embedding is not None:
-                import numpy as np
-                np.save(npy_path, embedding)
-                print(f"✅ 声纹嵌入已保存: {name}")
-
-                # 重新加载声纹库
-                asr_system.load_voiceprints()
-
-                return {
-                    "status": "success",
-                    "message": f"声纹已保存: {name}",
-                    "name": name,
-                    "duration": duration,
-                    "embedding_saved": True
-                }
-            else:
-                os.remove(wav_path)
-                if os.path.exists(npy_path):
-                    os.remove(npy_path)
-                raise HTTPException(status_code=500, detail="声纹嵌入计算失败")
-        else:
-            # ASR 系统未初始化，只保存 WAV 文件
-            # 后续 main.py 启动时会自动转换
-            os.rename(temp_path, wav_path)
-            print(f"⚠️  ASR 系统未初始化，已保存 WAV 文件: {name}")
-            print(f"💡 提示：使用正常模式启动服务器时会自动计算声纹嵌入")
-
-            return {
-                "status": "success",
-                "message": f"声纹已保存: {name}（仅音频文件，嵌入将在下次正常启动时计算）",
-                "name": name,
-                "duration": duration,
-                "embedding_saved": False
-            }
+@app.get("/api/voiceprints/jobs")
+async def list_voiceprint_jobs():
+    """进行中与最近结束的声纹注册任务"""
+    return {"jobs": voiceprint_enrollment.list_jobs()}
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        # 清理临时文件
-        temp_path = os.path.join(voiceprint_dir, f"temp_{name}.wav")
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        raise HTTPException(status_code=500, detail=f"保存失败: {str(e)}")
+@app.get("/api/voiceprints/jobs/{job_id}")
+async def get_voiceprint_job(job_id: str):
+    job = voiceprint_enrollment.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="未找到声纹注册任务")
+    return job
 
 @app.delete("/api/voiceprints/{name}")
 async def delete_voiceprint(name: str):
@@ -1570,9 +2008,10 @@ async def delete_voiceprint(name: str):
     if not deleted_files:
         raise HTTPException(status_code=404, detail=f"未找到说话人 '{name}' 的声纹")
 
-    # 只有在ASR系统初始化时才重新加载声纹库
+    voiceprint_catalog.refresh_entry(voiceprint_dir, name)
+    # 只有在ASR系统初始化时才更新运行中的声纹库
     if asr_system:
-        asr_system.load_voiceprints()
+        asr_system.remove_speaker(name)
 
     return {
         "status": "success",
@@ -1591,7 +2030,8 @@ async def rebuild_voiceprints():
         }
 
     try:
-        asr_system.load_voiceprints()
+        # 扫描目录并计算缺失的嵌入，在线程中进行以免阻塞事件循环
+        await asyncio.to_thread(asr_system.load_voiceprints)
         return {
             "status": "success",
             "message": "声纹嵌入重新计算完成",
@@ -1798,189 +2238,173 @@ def inject_resume_to_messages(messages: list[dict]):
             
     messages.insert(0, {"role": "system", "content": prompt})
 
-@app.websocket("/ws/llm")
-async def llm_websocket(websocket: WebSocket):
-    await llm_manager.connect(websocket)
-    current_data = load_config()
-    curr_name = current_data.get("current_config")
-    curr_conf = next((c for c in current_data.get("configs", []) if c["name"] == curr_name), None)
+def build_default_system_prompt() -> str:
+    """默认系统提示词：子代理提示词 + 简历 + 岗位信息（与完整消息请求组装的一致）"""
+    from intelligent_agent import get_sub_agent_system
+    scratch = [{"role": "system", "content": get_sub_agent_system(agent_config_path=AGENT_ROLE_FILE)}]
+    inject_resume_to_messages(scratch)
+    inject_job_analysis_to_messages(scratch)
+    return scratch[0]["content"]
+
+def resolve_single_system_prompt(curr_conf: dict | None, default_prompt: str) -> str:
+    """单模型系统提示词：身份标签优先，其次配置的 System Prompt，都没有时使用默认提示词"""
+    config_prompt = (curr_conf.get("system_prompt", "") if curr_conf else "").strip()
+    tags = curr_conf.get("tags", []) if curr_conf else []
+    if tags:
+        from intelligent_agent import get_sub_agent_system
+        target_prompt = get_sub_agent_system(agent_config_path=AGENT_ROLE_FILE, role_id=normalize_identity_identifier(tags[0]))
+    elif config_prompt:
+        target_prompt = config_prompt
+    else:
+        return default_prompt
+    scratch = [{"role": "system", "content": target_prompt}]
+    inject_job_analysis_to_messages(scratch)
+    inject_resume_to_messages(scratch)
+    return scratch[0]["content"]
 
-    if curr_conf:
-        llm_client.update_config(
-            api_key=curr_conf.get("api_key"),
-            base_url=curr_conf.get("base_url"),
-            model=curr_conf.get("model")
-        )
-        job_manager.set_llm_client(llm_client)
-    
-    # Store initial config to detect changes
-    last_config_signature = None
+def build_chat_client(config_data: dict, curr_conf: dict | None) -> LLMClient | None:
+    """
+    单模型对话的 LLM 客户端：每个请求单独创建（底层连接取自 client_pool），
+    在当前配置的等价端点中路由到最快的健康端点；不修改全局客户端，简历/岗位分析各自路由
+    """
+    if not curr_conf:
+        return None
+    route_conf = provider_health.select_config(config_data, curr_conf.get("name")) or curr_conf
+    return LLMClient(
+        api_key=route_conf.get("api_key"),
+        base_url=route_conf.get("base_url"),
+        model=route_conf.get("model")
+    )
 
-    try:
-        while True:
-            data = await websocket.receive_json()
+async def stream_single_llm_answer(
+    websocket: LLMSession,
+    client: LLMClient | None,
+    prompt_messages: list,
+    messages: list | None,
+    chat_id: str | None
+):
+    """
+    单模型流式回答并保存；被抢占或连接断开时关闭上游流，已输出内容按部分回答保存
 
-            # Reload config for every request to ensure freshness
-            current_data = load_config()
-            curr_name = current_data.get("current_config")
-            curr_conf = next((c for c in current_data.get("configs", []) if c["name"] == curr_name), None)
-            
-            # Update LLM Client if config changed
-            if curr_conf:
-                # Create a signature to check if we really need to update LLM client (avoid overhead if possible, though update_config is cheap)
-                # But simple update is fine.
-                llm_client.update_config(
-                    api_key=curr_conf.get("api_key"),
-                    base_url=curr_conf.get("base_url"),
-                    model=curr_conf.get("model")
-                )
-                resume_manager.set_llm_client(llm_client)
-                job_manager.set_llm_client(llm_client)
-
-            # 处理智能分析触发消息
-            if data.get("type") == "agent_triggered":
-                logger.info(f"[智能分析] ✅ WebSocket 收到触发消息")
-                messages = data.get("messages", [])
-                chat_id = data.get("chat_id")
-                is_multi_llm = data.get("is_multi_llm", False)
-                intent_recognition = data.get("intent_recognition", False)
-
-                logger.info(f"[智能分析] 📋 消息详情:")
-                logger.info(f"  - 分发模式: {'智囊团' if is_multi_llm else '单模型'}")
-                logger.info(f"  - 意图识别: {'开启' if intent_recognition else '关闭'}")
-                logger.info(f"  - 消息数量: {len(messages)}")
-                logger.info(f"  - 聊天ID: {chat_id}")
-                logger.debug(f"[智能分析] 📝 消息内容预览:")
-                for i, msg in enumerate(messages):
-                    logger.debug(f"  [{i}] {msg.get('role', 'unknown')}: {str(msg.get('content', ''))[:50]}{'...' if len(str(msg.get('content', ''))) > 50 else ''}")
-
-                # 根据模式处理
-                if is_multi_llm:
-                    # 处理智囊团模式
-                    await handle_multi_llm_request(websocket, messages, chat_id)
-                else:
-                    # 处理单模型模式
-                    # 修复：处理当前配置的 System Prompt
-                    current_messages = [m.copy() for m in messages]
-                    if not curr_conf:
-                        logger.warning("[智能分析] 当前配置为空，无法应用系统提示或身份标签")
-                    config_prompt = (curr_conf.get("system_prompt", "") if curr_conf else "").strip()
-
-                    # 检查是否选择了身份标签
-                    raw_tags = curr_conf.get("tags", []) if curr_conf else []
-                    normalized_tags = [normalize_identity_identifier(tag) for tag in raw_tags if tag]
-                    roles = load_think_tank_roles()
-                    role_lookup = build_identity_lookup(roles)
-                    active_tag, active_role, disabled_candidates = select_identity_role(normalized_tags, role_lookup)
-                    identity_applied = False
-                    if normalized_tags and not active_role:
-                        if disabled_candidates:
-                            logger.warning(f"[智能分析] 标签 {normalized_tags} 被禁用，跳过身份 Prompt")
-                        else:
-                            logger.warning(f"[智能分析] 标签 {normalized_tags} 未找到可用身份 Prompt，角色数={len(role_lookup)}")
-
-                    # 应用 System Prompt
-                    if active_role:
-                        tag_prompt = active_role["prompt"]
-                        identity_applied = True
-                        logger.info(f"[智能分析] 应用身份标签 Prompt: {active_role['name']}")
-                        sys_idx = next((i for i, m in enumerate(current_messages) if m["role"] == "system"), -1)
-                        if sys_idx != -1:
-                            current_messages[sys_idx]["content"] = tag_prompt
-                        else:
-                            current_messages.insert(0, {"role": "system", "content": tag_prompt})
-                    elif config_prompt:
-                        sys_idx = next((i for i, m in enumerate(current_messages) if m["role"] == "system"), -1)
-                        if sys_idx != -1:
-                            current_messages[sys_idx]["content"] = config_prompt
-                        else:
-                            current_messages.insert(0, {"role": "system", "content": config_prompt})
-                    elif normalized_tags:
-                        if disabled_candidates:
-                            logger.info(f"[智能分析] 身份已停用，跳过 Prompt: {', '.join(disabled_candidates)}")
-                        else:
-                            logger.warning(f"[智能分析] 未找到标签 '{normalized_tags[0]}' 的 Prompt 定义")
-
-                    # Check if job analysis exists locally
-                    if not os.path.exists(job_manager.job_analysis_path):
-                        error_msg = "请先设置目标岗位，完成岗位分析。助手对话框右上角→设置目标岗位"
-                        await websocket.send_json({"type": "done", "full_text": error_msg})
-                        if chat_id:
-                            messages.append({"role": "assistant", "content": error_msg})
-                            chat_manager.update_chat_messages(chat_id, messages)
-                        continue
-
-                    inject_job_analysis_to_messages(current_messages)
-
-                    # [调试] 显示实际发送给模型的完整 prompt
-                    # [调试] 显示实际发送给模型的完整 prompt
-                    logger.debug(f"\n{'='*80}")
-                    logger.debug(f"[调试] [智能分析] 正在发送请求到模型: {curr_conf.get('model', 'Unknown')} (Stream=True)")
-                    logger.debug(f"{'='*80}")
-                    logger.debug(f"[调试] [智能分析] 当前配置: {curr_conf.get('name', 'Unknown')}")
-                    logger.debug(f"[调试] [智能分析] 使用 System Prompt: {config_prompt if (config_prompt and not identity_applied) else '否'}")
-                    if normalized_tags:
-                        if identity_applied and active_role:
-                            logger.debug(f"[调试] [智能分析] 身份标签: {normalized_tags} → 激活: {active_role['name']} ({active_tag})")
-                        elif disabled_candidates:
-                            logger.debug(f"[调试] [智能分析] 身份标签: {normalized_tags} (停用: {', '.join(disabled_candidates)})")
-                        else:
-                            logger.debug(f"[调试] [智能分析] 身份标签: {normalized_tags} (未找到可用身份)")
-                    logger.debug(f"[调试] [智能分析] 消息总数: {len(current_messages)}")
-                    logger.debug(f"{'-'*80}")
-                    logger.debug("[调试] [智能分析] 完整 Prompt 内容:")
-                    logger.debug(f"{'-'*80}")
-                    for i, msg in enumerate(current_messages):
-                        role = msg.get('role', 'unknown')
-                        content = msg.get('content', '')
-                        logger.debug(f"\n[消息 {i+1}] 角色: {role}")
-                        logger.debug(f"[消息 {i+1}] 内容: {content}")
-                    logger.debug(f"\n{'='*80}\n")
+    Args:
+        messages: 与回答一起保存的完整消息列表；为 None 时回答直接追加到聊天末尾（增量请求）
+    """
+    if client is None or not client.client:
+        await websocket.send_json({"type": "error", "content": "LLM 客户端未初始化。请检查设置。"})
+        return
 
-                    # 直接使用当前配置的模型
-                    response_text = ""
-                    try:
-                        async for chunk in llm_client.chat_stream(current_messages):
-                            await websocket.send_json({"type": "chunk", "content": chunk})
-                            response_text += chunk
+    def save_answer(answer: dict):
+        if not chat_id:
+            return
+        if messages is None:
+            chat_manager.append_messages(chat_id, [answer])
+        else:
+            messages.append(answer)
+            chat_manager.update_chat_messages(chat_id, messages)
 
-                        await websocket.send_json({"type": "done", "full_text": response_text})
+    response_text = ""
+    coalescer = create_stream_coalescer(websocket, load_config())
+    try:
+        try:
+            async with contextlib.aclosing(client.chat_stream(prompt_messages)) as stream:
+                async for chunk in stream:
+                    await coalescer.push(chunk)
+                    response_text += chunk
+        finally:
+            # 发出缓冲中的剩余内容（done 之前）
+            await coalescer.aclose()
+    except asyncio.CancelledError:
+        if response_text:
+            partial_text = response_text + PARTIAL_ANSWER_MARKER
+            await send_json_quietly(websocket, {"type": "done", "full_text": partial_text, "cancelled": True})
+            save_answer({"role": "assistant", "content": partial_text, "partial": True})
+        logger.info(f"[LLM会话] 已中止单模型回答 (已输出 {len(response_text)} 字符)")
+        raise
 
-                        # 保存到聊天历史
-                        if chat_id:
-                            messages.append({"role": "assistant", "content": response_text})
-                            chat_manager.update_chat_messages(chat_id, messages)
+    await websocket.send_json({"type": "done", "full_text": response_text})
 
-                    except Exception as e:
-                        logger.error(f"单模型流式响应错误: {e}")
-                        await websocket.send_json({"type": "error", "content": f"流式响应错误: {str(e)}"})
+    # Save to chat history if chat_id is provided
+    save_answer({"role": "assistant", "content": response_text})
 
-                continue
 
-            # data format: { "messages": [...], "chat_id": "...", "is_multi_llm": bool }
-            messages = data.get("messages", [])
-            chat_id = data.get("chat_id")
-            is_multi_llm = data.get("is_multi_llm", False)
+async def process_llm_message(websocket: LLMSession, data: dict):
+    """处理 /ws/llm 的单条请求（在会话任务中运行，可被取消）"""
+    # 智能分析触发的回答与智囊团属于实时请求，普通对话为交互请求（会话任务有独立上下文）
+    realtime = data.get("type") == "agent_triggered" or data.get("is_multi_llm", False)
+    llm_priority.set(PRIORITY_REALTIME if realtime else PRIORITY_INTERACTIVE)
+    # Reload config for every request to ensure freshness
+    current_data = load_config()
+    curr_name = current_data.get("current_config")
+    curr_conf = next((c for c in current_data.get("configs", []) if c["name"] == curr_name), None)
 
-            # 获取动态 system prompt
-            config_data = load_config()
-            agent_config = config_data.get("agent_config", {})
-            intent_enabled = agent_config.get("intent_recognition_enabled", False)
-            
-            from intelligent_agent import get_sub_agent_system
-            system_prompt = get_sub_agent_system(
-                agent_config_path=AGENT_ROLE_FILE
-            )
-            
-            # Add system prompt if not present or update existing one
-            if not messages or messages[0].get("role") != "system":
-                 messages.insert(0, {"role": "system", "content": system_prompt})
-            else:
-                 messages[0]["content"] = system_prompt
+    # 单模型对话：本次请求独立的客户端，在等价端点中路由到最快的健康端点（提示词与标签仍取自当前配置）
+    chat_client = build_chat_client(current_data, curr_conf)
+
+    # 处理智能分析触发消息
+    if data.get("type") == "agent_triggered":
+        logger.info(f"[智能分析] ✅ WebSocket 收到触发消息")
+        messages = data.get("messages", [])
+        chat_id = data.get("chat_id")
+        is_multi_llm = data.get("is_multi_llm", False)
+        intent_recognition = data.get("intent_recognition", False)
+
+        logger.info(f"[智能分析] 📋 消息详情:")
+        logger.info(f"  - 分发模式: {'智囊团' if is_multi_llm else '单模型'}")
+        logger.info(f"  - 意图识别: {'开启' if intent_recognition else '关闭'}")
+        logger.info(f"  - 消息数量: {len(messages)}")
+        logger.info(f"  - 聊天ID: {chat_id}")
+        logger.debug(f"[智能分析] 📝 消息内容预览:")
+        for i, msg in enumerate(messages):
+            logger.debug(f"  [{i}] {msg.get('role', 'unknown')}: {str(msg.get('content', ''))[:50]}{'...' if len(str(msg.get('content', ''))) > 50 else ''}")
+
+        # 根据模式处理
+        if is_multi_llm:
+            # 处理智囊团模式
+            await handle_multi_llm_request(websocket, messages, chat_id, data.get("completion"))
+        else:
+            # 处理单模型模式
+            # 修复：处理当前配置的 System Prompt
+            # 只有系统消息会被原地修改，其余消息直接共享
+            current_messages = [m.copy() if m.get("role") == "system" else m for m in messages]
+            if not curr_conf:
+                logger.warning("[智能分析] 当前配置为空，无法应用系统提示或身份标签")
+            config_prompt = (curr_conf.get("system_prompt", "") if curr_conf else "").strip()
+
+            # 检查是否选择了身份标签
+            raw_tags = curr_conf.get("tags", []) if curr_conf else []
+            normalized_tags = [normalize_identity_identifier(tag) for tag in raw_tags if tag]
+            roles = load_think_tank_roles()
+            role_lookup = build_identity_lookup(roles)
+            active_tag, active_role, disabled_candidates = select_identity_role(normalized_tags, role_lookup)
+            identity_applied = False
+            if normalized_tags and not active_role:
+                if disabled_candidates:
+                    logger.warning(f"[智能分析] 标签 {normalized_tags} 被禁用，跳过身份 Prompt")
+                else:
+                    logger.warning(f"[智能分析] 标签 {normalized_tags} 未找到可用身份 Prompt，角色数={len(role_lookup)}")
+
+            # 应用 System Prompt
+            if active_role:
+                tag_prompt = active_role["prompt"]
+                identity_applied = True
+                logger.info(f"[智能分析] 应用身份标签 Prompt: {active_role['name']}")
+                sys_idx = next((i for i, m in enumerate(current_messages) if m["role"] == "system"), -1)
+                if sys_idx != -1:
+                    current_messages[sys_idx]["content"] = tag_prompt
+                else:
+                    current_messages.insert(0, {"role": "system", "content": tag_prompt})
+            elif config_prompt:
+                sys_idx = next((i for i, m in enumerate(current_messages) if m["role"] == "system"), -1)
+                if sys_idx != -1:
+                    current_messages[sys_idx]["content"] = config_prompt
+                else:
+                    current_messages.insert(0, {"role": "system", "content": config_prompt})
+            elif normalized_tags:
+                if disabled_candidates:
+                    logger.info(f"[智能分析] 身份已停用，跳过 Prompt: {', '.join(disabled_candidates)}")
+                else:
+                    logger.warning(f"[智能分析] 未找到标签 '{normalized_tags[0]}' 的 Prompt 定义")
 
-            # Inject Resume if enabled
-            inject_resume_to_messages(messages)
-            
             # Check if job analysis exists locally
             if not os.path.exists(job_manager.job_analysis_path):
                 error_msg = "请先设置目标岗位，完成岗位分析。助手对话框右上角→设置目标岗位"
@@ -1988,106 +2412,267 @@ async def llm_websocket(websocket: WebSocket):
                 if chat_id:
                     messages.append({"role": "assistant", "content": error_msg})
                     chat_manager.update_chat_messages(chat_id, messages)
-                continue
+                return
 
-            # Inject Job Analysis Context (Always if available)
-            inject_job_analysis_to_messages(messages)
+            inject_job_analysis_to_messages(current_messages)
 
-            if is_multi_llm:
-                await handle_multi_llm_request(websocket, messages, chat_id)
-                continue
-            else:
-                # --- Single LLM Mode (Original Logic) ---
-                response_text = ""
-                try:
-                    # Check if client is ready
-                    if not llm_client.client:
-                         await websocket.send_json({"type": "error", "content": "LLM 客户端未初始化。请检查设置。"})
-                         continue
-
-                    # 修复：处理当前配置的 System Prompt 和 身份标签
-                    current_messages = [m.copy() for m in messages]
-                    config_prompt = (curr_conf.get("system_prompt", "") if curr_conf else "").strip()
-                    tags = curr_conf.get("tags", []) if curr_conf else []
-                    has_tags = bool(tags)
-                    
-                    target_system_prompt = None
-                    
-                    if tags:
-                        # 1. 优先使用身份标签 (即使是无效标签，也优先于 config_prompt，回退到默认)
-                        # 这里简单取第一个标签作为角色ID
-                        first_tag = tags[0]
-                        normalized_tag = normalize_identity_identifier(first_tag)
-                        target_system_prompt = get_sub_agent_system(
-                             agent_config_path=AGENT_ROLE_FILE,
-                             role_id=normalized_tag
-                        )
-                        logger.info(f"[AgentAPI] 检测到身份标签: {tags} -> 使用角色: {normalized_tag}")
-                    elif config_prompt:
-                         # 2. 其次使用配置定义的 system prompt
-                         target_system_prompt = config_prompt
-                         logger.info(f"[AgentAPI] 使用配置定义的 System Prompt")
-
-                    # 应用目标 System Prompt (如果有)
-                    # 如果 target_system_prompt 为 None，则保持 messages 中的默认 Prompt (已在 loop 开始时插入)
-                    if target_system_prompt:
-                        sys_idx = next((i for i, m in enumerate(current_messages) if m["role"] == "system"), -1)
-                        if sys_idx != -1:
-                            current_messages[sys_idx]["content"] = target_system_prompt
-                        else:
-                            current_messages.insert(0, {"role": "system", "content": target_system_prompt})
-
-                    # Ensure Job Analysis and Resume Context is present (in case it was overwritten)
-                    inject_job_analysis_to_messages(current_messages)
-                    inject_resume_to_messages(current_messages)
-
-                    # [调试] 显示实际发送给模型的完整 prompt
-                    # [调试] 显示实际发送给模型的完整 prompt
-                    logger.debug(f"\n{'='*80}")
-                    logger.debug(f"[调试] 正在发送请求到模型: {curr_conf.get('model', 'Unknown')} (Stream=True)")
-                    logger.debug(f"{'='*80}")
-                    logger.debug(f"[调试] 当前配置: {curr_conf.get('name', 'Unknown')}")
-                    logger.debug(f"[调试] 使用 System Prompt: {config_prompt if (config_prompt and not has_tags) else '否'}")
-                    if has_tags:
-                        logger.debug(f"[调试] 身份标签: {tags} (System Prompt 被禁用)")
-                    logger.debug(f"[调试] 消息总数: {len(current_messages)}")
-                    logger.debug(f"{'-'*80}")
-                    logger.debug("[调试] 完整 Prompt 内容:")
-                    logger.debug(f"{'-'*80}")
-                    for i, msg in enumerate(current_messages):
-                        role = msg.get('role', 'unknown')
-                        content = msg.get('content', '')
-                        logger.debug(f"\n[消息 {i+1}] 角色: {role}")
-                        logger.debug(f"[消息 {i+1}] 内容: {content}")
-                    logger.debug(f"\n{'='*80}\n")
+            # [调试] 显示实际发送给模型的完整 prompt
+            # [调试] 显示实际发送给模型的完整 prompt
+            logger.debug(f"\n{'='*80}")
+            logger.debug(f"[调试] [智能分析] 正在发送请求到模型: {curr_conf.get('model', 'Unknown')} (Stream=True)")
+            logger.debug(f"{'='*80}")
+            logger.debug(f"[调试] [智能分析] 当前配置: {curr_conf.get('name', 'Unknown')}")
+            logger.debug(f"[调试] [智能分析] 使用 System Prompt: {config_prompt if (config_prompt and not identity_applied) else '否'}")
+            if normalized_tags:
+                if identity_applied and active_role:
+                    logger.debug(f"[调试] [智能分析] 身份标签: {normalized_tags} → 激活: {active_role['name']} ({active_tag})")
+                elif disabled_candidates:
+                    logger.debug(f"[调试] [智能分析] 身份标签: {normalized_tags} (停用: {', '.join(disabled_candidates)})")
+                else:
+                    logger.debug(f"[调试] [智能分析] 身份标签: {normalized_tags} (未找到可用身份)")
+            logger.debug(f"[调试] [智能分析] 消息总数: {len(current_messages)}")
+            logger.debug(f"{'-'*80}")
+            logger.debug("[调试] [智能分析] 完整 Prompt 内容:")
+            logger.debug(f"{'-'*80}")
+            for i, msg in enumerate(current_messages):
+                role = msg.get('role', 'unknown')
+                content = msg.get('content', '')
+                logger.debug(f"\n[消息 {i+1}] 角色: {role}")
+                logger.debug(f"[消息 {i+1}] 内容: {content}")
+            logger.debug(f"\n{'='*80}\n")
+
+            # 直接使用当前配置的模型
+            try:
+                await stream_single_llm_answer(websocket, chat_client, current_messages, messages, chat_id)
+            except Exception as e:
+                logger.error(f"单模型流式响应错误: {e}")
+                await websocket.send_json({"type": "error", "content": f"流式响应错误: {str(e)}"})
 
-                    async for chunk in llm_client.chat_stream(current_messages):
-                        await websocket.send_json({"type": "chunk", "content": chunk})
-                        response_text += chunk
+        return
 
-                    await websocket.send_json({"type": "done", "full_text": response_text})
+    # 增量请求：前端只发送新增的消息，历史以服务端保存的聊天为准
+    if data.get("append") is not None and data.get("chat_id"):
+        await process_llm_append(websocket, data, curr_conf, chat_client)
+        return
 
-                    # Save to chat history if chat_id is provided
-                    if chat_id:
-                        messages.append({"role": "assistant", "content": response_text})
-                        chat_manager.update_chat_messages(chat_id, messages)
+    # data format: { "messages": [...], "chat_id": "...", "is_multi_llm": bool, "history_start": int }
+    messages = data.get("messages", [])
+    chat_id = data.get("chat_id")
+    is_multi_llm = data.get("is_multi_llm", False)
 
-                except Exception as e:
-                    logger.exception(f"LLM 流式响应错误: {e}")
-                    try:
-                        await websocket.send_json({"type": "error", "content": f"流式响应错误: {str(e)}"})
-                    except Exception as send_error:
-                        logger.error(f"发送错误消息失败: {send_error}")
+    # 前端按页加载历史时只持有 history_start 之后的消息，补回更早的已保存消息
+    history_start = data.get("history_start") or 0
+    if chat_id and history_start > 0:
+        messages = chat_manager.get_history_prefix(chat_id, history_start) + messages
+
+    # 获取动态 system prompt
+    config_data = load_config()
+    agent_config = config_data.get("agent_config", {})
+    intent_enabled = agent_config.get("intent_recognition_enabled", False)
+
+    from intelligent_agent import get_sub_agent_system
+    system_prompt = get_sub_agent_system(
+        agent_config_path=AGENT_ROLE_FILE
+    )
+
+    # Add system prompt if not present or update existing one
+    if not messages or messages[0].get("role") != "system":
+         messages.insert(0, {"role": "system", "content": system_prompt})
+    else:
+         messages[0]["content"] = system_prompt
+
+    # Inject Resume if enabled
+    inject_resume_to_messages(messages)
+
+    # Check if job analysis exists locally
+    if not os.path.exists(job_manager.job_analysis_path):
+        error_msg = "请先设置目标岗位，完成岗位分析。助手对话框右上角→设置目标岗位"
+        await websocket.send_json({"type": "done", "full_text": error_msg})
+        if chat_id:
+            messages.append({"role": "assistant", "content": error_msg})
+            chat_manager.update_chat_messages(chat_id, messages)
+        return
+
+    # Inject Job Analysis Context (Always if available)
+    inject_job_analysis_to_messages(messages)
+
+    if is_multi_llm:
+        await handle_multi_llm_request(websocket, messages, chat_id, data.get("completion"))
+        return
+    else:
+        # --- Single LLM Mode (Original Logic) ---
+        try:
+            # Check if client is ready
+            if chat_client is None or not chat_client.client:
+                 await websocket.send_json({"type": "error", "content": "LLM 客户端未初始化。请检查设置。"})
+                 return
+
+            # 修复：处理当前配置的 System Prompt 和 身份标签
+            # 只有系统消息会被原地修改，其余消息直接共享
+            current_messages = [m.copy() if m.get("role") == "system" else m for m in messages]
+            config_prompt = (curr_conf.get("system_prompt", "") if curr_conf else "").strip()
+            tags = curr_conf.get("tags", []) if curr_conf else []
+            has_tags = bool(tags)
+
+            target_system_prompt = None
+
+            if tags:
+                # 1. 优先使用身份标签 (即使是无效标签，也优先于 config_prompt，回退到默认)
+                # 这里简单取第一个标签作为角色ID
+                first_tag = tags[0]
+                normalized_tag = normalize_identity_identifier(first_tag)
+                target_system_prompt = get_sub_agent_system(
+                     agent_config_path=AGENT_ROLE_FILE,
+                     role_id=normalized_tag
+                )
+                logger.info(f"[AgentAPI] 检测到身份标签: {tags} -> 使用角色: {normalized_tag}")
+            elif config_prompt:
+                 # 2. 其次使用配置定义的 system prompt
+                 target_system_prompt = config_prompt
+                 logger.info(f"[AgentAPI] 使用配置定义的 System Prompt")
+
+            # 应用目标 System Prompt (如果有)
+            # 如果 target_system_prompt 为 None，则保持 messages 中的默认 Prompt (已在 loop 开始时插入)
+            if target_system_prompt:
+                sys_idx = next((i for i, m in enumerate(current_messages) if m["role"] == "system"), -1)
+                if sys_idx != -1:
+                    current_messages[sys_idx]["content"] = target_system_prompt
+                else:
+                    current_messages.insert(0, {"role": "system", "content": target_system_prompt})
+
+            # Ensure Job Analysis and Resume Context is present (in case it was overwritten)
+            inject_job_analysis_to_messages(current_messages)
+            inject_resume_to_messages(current_messages)
+
+            # [调试] 显示实际发送给模型的完整 prompt
+            # [调试] 显示实际发送给模型的完整 prompt
+            logger.debug(f"\n{'='*80}")
+            logger.debug(f"[调试] 正在发送请求到模型: {curr_conf.get('model', 'Unknown')} (Stream=True)")
+            logger.debug(f"{'='*80}")
+            logger.debug(f"[调试] 当前配置: {curr_conf.get('name', 'Unknown')}")
+            logger.debug(f"[调试] 使用 System Prompt: {config_prompt if (config_prompt and not has_tags) else '否'}")
+            if has_tags:
+                logger.debug(f"[调试] 身份标签: {tags} (System Prompt 被禁用)")
+            logger.debug(f"[调试] 消息总数: {len(current_messages)}")
+            logger.debug(f"{'-'*80}")
+            logger.debug("[调试] 完整 Prompt 内容:")
+            logger.debug(f"{'-'*80}")
+            for i, msg in enumerate(current_messages):
+                role = msg.get('role', 'unknown')
+                content = msg.get('content', '')
+                logger.debug(f"\n[消息 {i+1}] 角色: {role}")
+                logger.debug(f"[消息 {i+1}] 内容: {content}")
+            logger.debug(f"\n{'='*80}\n")
+
+            await stream_single_llm_answer(websocket, chat_client, current_messages, messages, chat_id)
+
+        except Exception as e:
+            logger.exception(f"LLM 流式响应错误: {e}")
+            try:
+                await websocket.send_json({"type": "error", "content": f"流式响应错误: {str(e)}"})
+            except Exception as send_error:
+                logger.error(f"发送错误消息失败: {send_error}")
+
+# 增量请求可追加的消息角色（系统提示词由服务端生成）
+APPEND_ROLES = ("user", "assistant")
+
+
+async def process_llm_append(websocket: LLMSession, data: dict, curr_conf: dict | None, chat_client: LLMClient | None):
+    """
+    处理增量请求 { "chat_id": "...", "append": [{"role": "user", "content": "..."}], "is_multi_llm": bool }
+
+    历史消息取自服务端保存的聊天，新消息直接追加到聊天末尾；单模型的 prompt 由 prompt_cache 按聊天缓存，
+    随聊天追加原地扩展，每轮不再重新传输、复制与组装整段历史。
+    """
+    chat_id = data.get("chat_id")
+    if chat_id not in chat_manager.chats:
+        await websocket.send_json({"type": "error", "content": f"聊天不存在: {chat_id}"})
+        return
+    append = [m for m in data.get("append") or [] if isinstance(m, dict)]
+    invalid_roles = {str(m.get("role")) for m in append if (m.get("role") or "user") not in APPEND_ROLES}
+    if invalid_roles:
+        await websocket.send_json({"type": "error", "content": f"增量请求只能追加 user/assistant 消息: {', '.join(sorted(invalid_roles))}"})
+        return
+    new_messages = [{"role": m.get("role") or "user", "content": str(m.get("content", ""))} for m in append]
+    if not new_messages:
+        await websocket.send_json({"type": "error", "content": "增量请求缺少消息内容"})
+        return
+
+    # 保存的消息与完整消息请求的结构一致：默认系统提示词 + 历史 + 新消息
+    default_prompt = build_default_system_prompt()
+    chat_manager.ensure_system_prompt(chat_id, default_prompt)
+
+    # Check if job analysis exists locally
+    if not os.path.exists(job_manager.job_analysis_path):
+        error_msg = "请先设置目标岗位，完成岗位分析。助手对话框右上角→设置目标岗位"
+        await websocket.send_json({"type": "done", "full_text": error_msg})
+        chat_manager.append_messages(chat_id, new_messages + [{"role": "assistant", "content": error_msg}])
+        return
+
+    if data.get("is_multi_llm", False):
+        # 智囊团为每个模型组装各自的 prompt，需要完整的消息列表
+        total = chat_manager.chats[chat_id].get("message_count", 0)
+        messages = chat_manager.get_history_prefix(chat_id, total) + new_messages
+        await handle_multi_llm_request(websocket, messages, chat_id, data.get("completion"))
+        return
+
+    if chat_client is None or not chat_client.client:
+        await websocket.send_json({"type": "error", "content": "LLM 客户端未初始化。请检查设置。"})
+        return
+
+    # 先保存本轮消息：缓存中的 prompt 经变更回调原地追加，直接作为本次请求的 prompt
+    chat_manager.append_messages(chat_id, new_messages)
+    total = chat_manager.chats[chat_id].get("message_count", 0)
+    system_prompt = resolve_single_system_prompt(curr_conf, default_prompt)
+    prompt_messages = prompt_cache.get(chat_id, system_prompt, total, lambda: chat_manager.get_history_prefix(chat_id, total))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[调试] 增量请求: 聊天 %s，新增 %d 条，Prompt 共 %d 条", chat_id, len(new_messages), len(prompt_messages))
+
+    try:
+        await stream_single_llm_answer(websocket, chat_client, prompt_messages, None, chat_id)
+    except Exception as e:
+        logger.exception(f"LLM 流式响应错误: {e}")
+        await send_json_quietly(websocket, {"type": "error", "content": f"流式响应错误: {str(e)}"})
+
+@app.websocket("/ws/llm")
+async def llm_websocket(websocket: WebSocket):
+    codec, notice = negotiate_codec(websocket)
+    await llm_manager.connect(websocket, notice)
+    current_data = load_config()
+
+    # 携带 session 与 since（最后收到的序号）重连时接管宽限期内的旧会话并补发缺失消息
+    session = llm_manager.get(websocket.query_params.get("session"))
+    since = parse_since(websocket.query_params.get("since"))
+    if session is not None and since is not None:
+        try:
+            await session.attach(websocket, since, codec)
+        except Exception as e:
+            logger.info(f"[LLM会话] 续传失败: {e}")
+            await llm_manager.release(session, websocket, current_data.get("ws_resume_grace_seconds", DEFAULT_LLM_RESUME_GRACE))
+            return
+    else:
+        session = LLMSession(websocket, codec)
+        await websocket.send_json({"type": "session", "session_id": session.session_id, "resumed": False, "latest": 0})
+        llm_manager.register(session)
+
+    try:
+        while True:
+            data = await websocket.receive_json()
+            # 每个聊天的生成在会话任务中运行，接收循环保持畅通以便及时感知断开与新的触发
+            session.submit(
+                data.get("chat_id"),
+                lambda data=data: process_llm_message(session, data),
+                preempt=data.get("type") == "agent_triggered"
+            )
 
     except WebSocketDisconnect:
         logger.info("LLM WebSocket 连接已断开")
-        llm_manager.disconnect(websocket)
     except Exception as e:
         logger.exception(f"LLM WebSocket 严重错误: {e}")
-        try:
-            llm_manager.disconnect(websocket)
-        except Exception as disconnect_error:
-            logger.error(f"断开连接失败: {disconnect_error}")
+    finally:
+        # 连接断开：宽限期内保留会话等待重连，超时后中止该会话的所有上游请求
+        grace = load_config().get("ws_resume_grace_seconds", DEFAULT_LLM_RESUME_GRACE)
+        await llm_manager.release(session, websocket, grace)
 
 if __name__ == "__main__":
     import uvicorn
@@ -2102,7 +2687,13 @@ if __name__ == "__main__":
     logger.info("=" * 60)
     logger.info("")
 
-    uvicorn.run(app, host=args.host, port=args.port)
+    # 浏览器握手时请求 permessage-deflate，由 uvicorn 协商压缩（可在配置中关闭以节省 CPU）
+    uvicorn.run(
+        app,
+        host=args.host,
+        port=args.port,
+        ws_per_message_deflate=load_config().get("ws_per_message_deflate", True)
+    )
 
 def format_intent_analysis(intent_result: dict) -> str:
     """将意图识别结果格式化为系统消息"""
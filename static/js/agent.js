@@ -340,7 +340,16 @@ export class LLMManager {
         else if (data.type === 'done_one') {
             // One model finished - 可选：标记这个气泡为完成状态
             const model = data.model;
-            console.log(`模型 ${model} 完成响应`);
+            if (data.partial && data.marker && this.streamManager.activeResponseBuffers[model]) {
+                // 被完成模式提前结束的模型：追加部分回答标记，与服务端保存的内容保持一致
+                this.streamManager.activeResponseBuffers[model] += data.marker;
+                const div = this.streamManager.getOrCreateResponseDiv(model);
+                const contentDiv = div?.querySelector('.message-content, .content');
+                if (contentDiv) {
+                    renderMarkdown(contentDiv, this.streamManager.activeResponseBuffers[model]);
+                }
+            }
+            console.log(`模型 ${model} ${data.partial ? '已提前结束' : '完成响应'}`);
         }
         else if (data.type === 'done' || data.type === 'done_all') {
             // All finished
@@ -672,7 +681,7 @@ export class LLMManager {
                     );
                 }
 
-                const payload = this.buildLLMPayload(isMulti);
+                const payload = this.buildLLMPayload(isMulti, text);
                 console.log('[LLM] 发送载荷:', payload);
 
                 const success = wsManager.sendToLLM(payload);
@@ -696,9 +705,19 @@ export class LLMManager {
         }
     }
 
-    buildLLMPayload(isMulti) {
+    buildLLMPayload(isMulti, text) {
         const intentData = window.latestIntentAnalysis?.phase2 || window.latestIntentAnalysis || null;
         const intentMessages = this.composeIntentOnlyMessages(intentData);
+        if (!intentMessages && this.currentChatId && text) {
+            // 服务端持有聊天的完整历史，只发送本轮新增的用户消息
+            return {
+                append: [{ role: 'user', content: text }],
+                chat_id: this.currentChatId,
+                is_multi_llm: isMulti,
+                intent_data: intentData || null,
+                context_mode: 'full_chat'
+            };
+        }
         const payload = {
             messages: intentMessages || this.chatHistory,
             chat_id: this.currentChatId,
@@ -706,6 +725,10 @@ export class LLMManager {
             intent_data: intentData || null
         };
         payload.context_mode = intentMessages ? 'intent_only' : 'full_chat';
+        // 只加载了部分历史时，告知服务端已加载历史的起始位置以补全更早的消息
+        if (!intentMessages && this.chatManager && typeof this.chatManager.getHistoryStart === 'function') {
+            payload.history_start = this.chatManager.getHistoryStart();
+        }
         return payload;
     }
 
@@ -6,12 +6,50 @@ import { dom } from './dom.js';
 import { showToast } from './utils.js';
 import { renderMarkdown } from './markdown.js';
 
+// 聊天列表与消息的分页大小
+const CHAT_LIST_PAGE_SIZE = 50;
+const MESSAGE_PAGE_SIZE = 50;
+// 距离边缘多少像素时加载下一页
+const SCROLL_LOAD_THRESHOLD = 80;
+
 // ===== 聊天管理类 =====
 export class ChatManager {
     constructor() {
         this.currentChatId = null;
         this.llmHistory = [];
         this.llmManager = null;
+        // 已加载的第一条消息在完整历史中的位置（更早的消息按需向前翻页）
+        this.historyStart = 0;
+        this.hasMoreHistory = false;
+        this.loadingOlder = false;
+        this.chatListCursor = null;
+        this.loadingChatList = false;
+        this._scrollHandlersBound = false;
+    }
+
+    _bindScrollHandlers() {
+        if (this._scrollHandlersBound) return;
+        if (dom.llmWindow) {
+            dom.llmWindow.addEventListener('scroll', () => {
+                if (dom.llmWindow.scrollTop < SCROLL_LOAD_THRESHOLD) {
+                    this.loadOlderMessages();
+                }
+            });
+        }
+        if (dom.chatListDiv) {
+            dom.chatListDiv.addEventListener('scroll', () => {
+                const el = dom.chatListDiv;
+                if (el.scrollHeight - el.scrollTop - el.clientHeight < SCROLL_LOAD_THRESHOLD) {
+                    this.loadMoreChats();
+                }
+            });
+        }
+        this._scrollHandlersBound = true;
+    }
+
+    _resetHistoryPaging() {
+        this.historyStart = 0;
+        this.hasMoreHistory = false;
     }
 
     setLLMManager(llmManager) {
@@ -39,11 +77,13 @@ export class ChatManager {
         }
     }
 
-    // 加载聊天列表
+    // 加载聊天列表（只获取索引，首页之后滚动加载）
     async loadChatList() {
+        this._bindScrollHandlers();
         try {
-            const res = await fetch('/api/chats');
+            const res = await fetch(`/api/chats?limit=${CHAT_LIST_PAGE_SIZE}`);
             const data = await res.json();
+            this.chatListCursor = data.next_cursor || null;
 
             if (!this.currentChatId && data.current_chat_id) {
                 this._setActiveChat(data.current_chat_id);
@@ -62,16 +102,37 @@ export class ChatManager {
         }
     }
 
+    // 加载更多聊天（向下滚动时）
+    async loadMoreChats() {
+        if (!this.chatListCursor || this.loadingChatList) return;
+        this.loadingChatList = true;
+        try {
+            const res = await fetch(`/api/chats?limit=${CHAT_LIST_PAGE_SIZE}&cursor=${encodeURIComponent(this.chatListCursor)}`);
+            const data = await res.json();
+            this.chatListCursor = data.next_cursor || null;
+            this.renderChatList(data.chats, { append: true });
+        } catch (e) {
+            console.error('加载更多聊天失败:', e);
+        } finally {
+            this.loadingChatList = false;
+        }
+    }
+
     // 渲染聊天列表
-    renderChatList(chats) {
+    renderChatList(chats, { append = false } = {}) {
         if (!dom.chatListDiv) return;
 
-        dom.chatListDiv.innerHTML = '';
+        if (!append) {
+            dom.chatListDiv.innerHTML = '';
+        }
 
         chats.forEach(chat => {
             const item = document.createElement('div');
             item.className = `chat-item ${chat.id === this.currentChatId ? 'active' : ''}`;
             item.innerHTML = `<span class="chat-title">${chat.title}</span><button class="delete-chat-btn">&times;</button>`;
+            if (chat.preview) {
+                item.title = chat.preview;
+            }
 
             item.onclick = (e) => {
                 if (e.target.classList.contains('delete-chat-btn')) return;
@@ -112,6 +173,7 @@ export class ChatManager {
 
             this._setActiveChat(newChat.id);
             this.llmHistory = [];
+            this._resetHistoryPaging();
             this._syncLLMHistory([]);
 
             if (dom.llmWindow) {
@@ -132,6 +194,7 @@ export class ChatManager {
         if (this.currentChatId === chatId) {
             this._setActiveChat(null);
             this.llmHistory = [];
+            this._resetHistoryPaging();
             this._syncLLMHistory([]);
             if (dom.llmWindow) {
                 dom.llmWindow.innerHTML = '';
@@ -141,13 +204,16 @@ export class ChatManager {
         await this.loadChatList();
     }
 
-    // 加载聊天消息
+    // 加载聊天消息（只加载最近一页，更早的消息向上滚动时加载）
     async loadChatMessages(chatId) {
-        const res = await fetch(`/api/chats/${chatId}`);
+        this._bindScrollHandlers();
+        const res = await fetch(`/api/chats/${chatId}?limit=${MESSAGE_PAGE_SIZE}`);
         const chat = await res.json();
 
         this._setActiveChat(chatId);
         this.llmHistory = [];
+        this.historyStart = chat.start || 0;
+        this.hasMoreHistory = Boolean(chat.has_more);
         this._syncLLMHistory([]);
 
         if (dom.llmWindow) {
@@ -172,9 +238,45 @@ export class ChatManager {
         }
     }
 
+    // 向前加载更早的一页消息，插入到窗口顶部并保持当前阅读位置
+    async loadOlderMessages() {
+        if (!this.hasMoreHistory || this.loadingOlder || !this.currentChatId || !dom.llmWindow) return;
+        const chatId = this.currentChatId;
+        this.loadingOlder = true;
+        try {
+            const res = await fetch(`/api/chats/${chatId}?limit=${MESSAGE_PAGE_SIZE}&before=${this.historyStart}`);
+            if (!res.ok) return;
+            const page = await res.json();
+            // 加载期间已切换聊天
+            if (chatId !== this.currentChatId) return;
+
+            const olderMessages = (page.messages || []).filter(msg => msg.role !== 'system');
+            const fragment = document.createDocumentFragment();
+            olderMessages.forEach(msg => this.renderMessage(msg, fragment));
+
+            const previousHeight = dom.llmWindow.scrollHeight;
+            dom.llmWindow.insertBefore(fragment, dom.llmWindow.firstChild);
+            dom.llmWindow.scrollTop += dom.llmWindow.scrollHeight - previousHeight;
+
+            this.llmHistory = [...olderMessages, ...this.llmHistory];
+            this.historyStart = page.start || 0;
+            this.hasMoreHistory = Boolean(page.has_more);
+            this._syncLLMHistory(this.llmHistory);
+        } catch (e) {
+            console.error('加载更早的消息失败:', e);
+        } finally {
+            this.loadingOlder = false;
+        }
+    }
+
+    // 已加载历史在完整聊天记录中的起始位置（发送消息时由服务端补全更早的历史）
+    getHistoryStart() {
+        return this.historyStart;
+    }
+
     // 渲染单条消息
-    renderMessage(msg) {
-        if (!dom.llmWindow) return;
+    renderMessage(msg, container = dom.llmWindow) {
+        if (!container) return;
 
         const msgDiv = document.createElement('div');
         msgDiv.className = `message ${msg.role === 'assistant' ? 'ai' : 'user'}`;
@@ -219,7 +321,7 @@ export class ChatManager {
             msgDiv.innerHTML = `<div class="message-content">${msg.content}</div>`;
         }
 
-        dom.llmWindow.appendChild(msgDiv);
+        container.appendChild(msgDiv);
     }
 
     // 添加系统欢迎消息
@@ -276,6 +378,7 @@ export class ChatManager {
         try {
             await fetch(`/api/chats/${this.currentChatId}/clear`, { method: 'POST' });
             this.llmHistory = [];
+            this._resetHistoryPaging();
             this._syncLLMHistory([]);
 
             if (dom.llmWindow) {
@@ -355,6 +458,7 @@ export class ChatManager {
     // 清空聊天历史
     clearHistory() {
         this.llmHistory = [];
+        this._resetHistoryPaging();
         this._syncLLMHistory([]);
     }
 
@@ -85,6 +85,13 @@ async function initializeManagers() {
     managers.websocket.handleLLMMessage = (data) => {
         managers.llm.handleLLMMessage(data);
     };
+    // /ws/llm 续传失败时重新加载当前聊天
+    managers.websocket.onLLMSessionLost = () => {
+        const chatId = managers.chat.getCurrentChatId();
+        if (chatId) {
+            managers.chat.loadChatMessages(chatId);
+        }
+    };
 
     // 初始化UI管理器
     managers.ui = new UIManager(managers);
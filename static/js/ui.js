@@ -606,7 +606,7 @@ export class UIManager {
             // 延迟到聊天列表加载完成后恢复
             setTimeout(async () => {
                 try {
-                    const response = await fetch(`/api/chats/${savedState.currentChatId}`);
+                    const response = await fetch(`/api/chats/${savedState.currentChatId}?limit=0`);
                     if (response.ok) {
                         const chatData = await response.json();
                         this.managers.chat.currentChatId = savedState.currentChatId;
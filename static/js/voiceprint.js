@@ -20,6 +20,25 @@ export class VoiceprintManager {
         this.analyser = null;
         this.dataArray = null;
         this.visualizerTimer = null;
+
+        // 后台注册任务：job_id -> 说话人姓名
+        this.pendingJobs = new Map();
+        document.addEventListener('ast:voiceprint-job', (event) => this.handleEnrollmentProgress(event.detail));
+    }
+
+    // 声纹注册进度（经 /ws 推送）
+    handleEnrollmentProgress(job) {
+        if (!job || !job.id) return;
+        console.log(`[声纹] ${job.name}: ${job.message} (${Math.round((job.progress || 0) * 100)}%)`);
+        if (job.status !== 'done' && job.status !== 'failed') return;
+
+        const ownJob = this.pendingJobs.delete(job.id);
+        if (ownJob) {
+            showToast(job.status === 'done' ? job.message : `保存失败: ${job.message}`, job.status === 'done' ? 'success' : 'error');
+        }
+        if (job.status === 'done') {
+            this.loadVoiceprintList();
+        }
     }
 
     // 打开声纹管理模态框
@@ -293,9 +312,15 @@ export class VoiceprintManager {
                     const result = await response.json();
 
                     if (response.ok) {
-                        showToast(`声纹保存成功: ${speakerName}`, 'success');
-                        this.loadVoiceprintList();
+                        // 服务端在后台计算嵌入，完成后经 /ws 推送结果
+                        this.pendingJobs.set(result.job_id, speakerName);
+                        showToast(`声纹已提交，正在后台处理: ${speakerName}`, 'info');
                         this.resetRecordingState();
+                        // 推送可能先于响应到达：补查一次任务状态
+                        const jobResponse = await fetch(`/api/voiceprints/jobs/${result.job_id}`);
+                        if (jobResponse.ok) {
+                            this.handleEnrollmentProgress(await jobResponse.json());
+                        }
                     } else {
                         showToast(`保存失败: ${result.detail}`, 'error');
                     }
@@ -3,6 +3,7 @@
    ======================================== */
 
 import { dom, domUtils } from './dom.js';
+import { decodeFrame, preferredEncoding } from './wire.js';
 
 // ===== WebSocket: ASR 连接与处理 =====
 export class WebSocketManager {
@@ -19,6 +20,35 @@ export class WebSocketManager {
         this.analysisFlags = new Map();
         this.intentModel = null;
         this.intentModelFetchPromise = null;
+        this.intentStreamBuffers = new Map();
+        // 断线续传：最后收到的广播序号与 /ws/llm 会话
+        this.asrLastSeq = null;
+        this.llmSessionId = null;
+        this.llmLastSeq = null;
+        this.onLLMSessionLost = null;
+        // 线路编码：连接时请求的编码与服务端告知的短键表
+        this.encoding = preferredEncoding();
+        this.wireKeys = { asr: null, llm: null };
+    }
+
+    // 解码一帧；编码协商消息只更新短键表，返回 null
+    decodeMessage(kind, event) {
+        const data = decodeFrame(event.data, this.wireKeys[kind]);
+        if (data && data.codec) {
+            this.wireKeys[kind] = data.codec.keys || null;
+            console.log(`[${kind.toUpperCase()}] 线路编码: ${data.codec.encoding}`);
+            return null;
+        }
+        return data;
+    }
+
+    // 按序号去重：返回 false 表示该消息已处理过（重连补发的重复消息）
+    acceptSeq(kind, data) {
+        if (typeof data.seq !== 'number') return true;
+        const key = kind === 'asr' ? 'asrLastSeq' : 'llmLastSeq';
+        if (this[key] !== null && data.seq <= this[key]) return false;
+        this[key] = data.seq;
+        return true;
     }
 
     async fetchIntentModelName() {
@@ -43,8 +73,11 @@ export class WebSocketManager {
     // ASR WebSocket连接
     connectASR() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws`;
+        const since = this.asrLastSeq !== null ? `&since=${this.asrLastSeq}` : '';
+        const wsUrl = `${protocol}//${window.location.host}/ws?encoding=${this.encoding}${since}`;
         this.asrSocket = new WebSocket(wsUrl);
+        this.asrSocket.binaryType = 'arraybuffer';
+        this.wireKeys.asr = null;
 
         // 连接成功时显示"未连接"状态，等待后端确认
         this.asrSocket.onopen = () => {
@@ -56,7 +89,26 @@ export class WebSocketManager {
 
         this.asrSocket.onmessage = (event) => {
             try {
-                const data = JSON.parse(event.data);
+                const data = this.decodeMessage('asr', event);
+                if (!data) return;
+
+                // 续传说明：服务端已重启（序号回退）时从最新序号重新开始
+                if (data.replay) {
+                    if (data.replay.since > data.replay.latest) {
+                        this.asrLastSeq = data.replay.latest;
+                    }
+                    if (!data.replay.complete) {
+                        console.warn('[ASR] 断线期间的部分消息已无法补发');
+                    }
+                    return;
+                }
+                if (!this.acceptSeq('asr', data)) return;
+
+                // 声纹注册进度：交给声纹管理
+                if (data.voiceprint_job) {
+                    document.dispatchEvent(new CustomEvent('ast:voiceprint-job', { detail: data.voiceprint_job }));
+                    return;
+                }
 
                 // 如果是初始状态消息，更新UI
                 if (data.asr_status) {
@@ -99,6 +151,8 @@ export class WebSocketManager {
             this.asrSocket.close();
             this.asrSocket = null;
         }
+        // 手动关闭后重新连接不补发期间的消息
+        this.asrLastSeq = null;
         this.isConnected.asr = false;
         this.asrListening = false;
         this.updateASRStatus(false);
@@ -108,8 +162,13 @@ export class WebSocketManager {
     // LLM WebSocket连接
     connectLLM() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws/llm`;
+        const resume = this.llmSessionId && this.llmLastSeq !== null
+            ? `&session=${encodeURIComponent(this.llmSessionId)}&since=${this.llmLastSeq}`
+            : '';
+        const wsUrl = `${protocol}//${window.location.host}/ws/llm?encoding=${this.encoding}${resume}`;
         this.llmSocket = new WebSocket(wsUrl);
+        this.llmSocket.binaryType = 'arraybuffer';
+        this.wireKeys.llm = null;
 
         this.llmSocket.onopen = () => {
             console.log('[LLM] WebSocket 连接已建立');
@@ -118,7 +177,13 @@ export class WebSocketManager {
 
         this.llmSocket.onmessage = (event) => {
             try {
-                const data = JSON.parse(event.data);
+                const data = this.decodeMessage('llm', event);
+                if (!data) return;
+                if (data.type === 'session') {
+                    this.handleLLMSession(data);
+                    return;
+                }
+                if (!this.acceptSeq('llm', data)) return;
                 this.handleLLMMessage(data);
             } catch (e) {
                 console.error('LLM消息解析错误:', e);
@@ -138,6 +203,24 @@ export class WebSocketManager {
         };
     }
 
+    // 会话建立或续传结果
+    handleLLMSession(data) {
+        const hadSession = this.llmSessionId !== null;
+        if (data.resumed) {
+            console.log(`[LLM] 会话已续传，补发至序号 ${data.latest}`);
+            if (!data.complete && typeof this.onLLMSessionLost === 'function') {
+                this.onLLMSessionLost();
+            }
+            return;
+        }
+        this.llmSessionId = data.session_id;
+        this.llmLastSeq = data.latest || 0;
+        // 旧会话已过期：断线期间的流式输出无法补发，由上层重新加载聊天
+        if (hadSession && typeof this.onLLMSessionLost === 'function') {
+            this.onLLMSessionLost();
+        }
+    }
+
     // 更新ASR状态
     updateASRStatus(asrInitialized) {
         if (!dom.asrStatusDiv) return;
@@ -227,7 +310,14 @@ export class WebSocketManager {
             return;
         }
 
+        // 意图识别流式增量：只更新对应分析标记中的意图总结
+        if (data.analysis_status === 'intent_streaming') {
+            this.appendIntentStreamDelta(data.analysis_id, data.intent_delta || '');
+            return;
+        }
+
         if (data.analysis_status) {
+            this.intentStreamBuffers.delete(data.analysis_id);
             if (this.agentStatusHandler) {
                 this.agentStatusHandler({
                     status: data.analysis_status,
@@ -310,6 +400,37 @@ export class WebSocketManager {
         this.agentStatusHandler = handler;
     }
 
+    appendIntentStreamDelta(analysisId, delta) {
+        if (!delta) return;
+        const flag = this.getOrCreateAnalysisFlag(analysisId);
+        const noteEl = flag.querySelector('.analysis-flag-note');
+        if (!noteEl) return;
+
+        const buffer = (this.intentStreamBuffers.get(analysisId) || '') + delta;
+        this.intentStreamBuffers.set(analysisId, buffer);
+
+        // 仅展示 <summary> 中已生成的部分，推理与 XML 标签不直接显示
+        const visible = buffer.replace(/<think>[\s\S]*?(<\/think>|$)/g, '');
+        const summaryMatch = visible.match(/<summary>([\s\S]*?)(<\/summary>|$)/i);
+        if (!summaryMatch) return;
+
+        let textEl = noteEl.querySelector('.intent-summary-text');
+        if (!textEl) {
+            const summaryRow = document.createElement('div');
+            summaryRow.className = 'intent-summary-compact';
+            const labelEl = document.createElement('span');
+            labelEl.className = 'intent-summary-label';
+            labelEl.textContent = '意图总结';
+            textEl = document.createElement('span');
+            textEl.className = 'intent-summary-text';
+            summaryRow.appendChild(labelEl);
+            summaryRow.appendChild(textEl);
+            noteEl.appendChild(summaryRow);
+            noteEl.style.display = 'block';
+        }
+        textEl.textContent = summaryMatch[1].trim();
+    }
+
     getOrCreateAnalysisFlag(analysisId) {
         const key = analysisId || `analysis-${Date.now()}`;
         if (this.analysisFlags.has(key)) {
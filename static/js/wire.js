@@ -0,0 +1,104 @@
+/* ========================================
+   WebSocket 线路编码（JSON / MessagePack）
+   ======================================== */
+
+const textDecoder = new TextDecoder();
+
+// 连接时请求的编码：localStorage.wsEncoding 可指定 json 或 msgpack，
+// 未指定时远程访问使用 msgpack（节省带宽），本机访问使用 JSON（便于调试）
+export function preferredEncoding() {
+    const stored = window.localStorage?.getItem('wsEncoding');
+    if (stored === 'json' || stored === 'msgpack') return stored;
+    const host = window.location.hostname;
+    return host === 'localhost' || host === '127.0.0.1' || host === '[::1]' ? 'json' : 'msgpack';
+}
+
+// 最小 MessagePack 解码器（服务端只发送 nil/bool/数字/字符串/二进制/数组/映射）
+export function decodeMsgpack(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    let offset = 0;
+
+    const str = (length) => {
+        const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+        offset += length;
+        return value;
+    };
+    const bin = (length) => {
+        const value = bytes.slice(offset, offset + length);
+        offset += length;
+        return value;
+    };
+    const array = (length) => {
+        const value = new Array(length);
+        for (let i = 0; i < length; i++) value[i] = read();
+        return value;
+    };
+    const map = (length) => {
+        const value = {};
+        for (let i = 0; i < length; i++) {
+            const key = read();
+            value[key] = read();
+        }
+        return value;
+    };
+    const next = (size, getter) => {
+        const value = getter.call(view, offset);
+        offset += size;
+        return value;
+    };
+
+    function read() {
+        const byte = bytes[offset++];
+        if (byte <= 0x7f) return byte;
+        if (byte <= 0x8f) return map(byte & 0x0f);
+        if (byte <= 0x9f) return array(byte & 0x0f);
+        if (byte <= 0xbf) return str(byte & 0x1f);
+        if (byte >= 0xe0) return byte - 0x100;
+        switch (byte) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return bin(next(1, view.getUint8));
+            case 0xc5: return bin(next(2, view.getUint16));
+            case 0xc6: return bin(next(4, view.getUint32));
+            case 0xca: return next(4, view.getFloat32);
+            case 0xcb: return next(8, view.getFloat64);
+            case 0xcc: return next(1, view.getUint8);
+            case 0xcd: return next(2, view.getUint16);
+            case 0xce: return next(4, view.getUint32);
+            case 0xcf: return Number(next(8, view.getBigUint64));
+            case 0xd0: return next(1, view.getInt8);
+            case 0xd1: return next(2, view.getInt16);
+            case 0xd2: return next(4, view.getInt32);
+            case 0xd3: return Number(next(8, view.getBigInt64));
+            case 0xd9: return str(next(1, view.getUint8));
+            case 0xda: return str(next(2, view.getUint16));
+            case 0xdb: return str(next(4, view.getUint32));
+            case 0xdc: return array(next(2, view.getUint16));
+            case 0xdd: return array(next(4, view.getUint32));
+            case 0xde: return map(next(2, view.getUint16));
+            case 0xdf: return map(next(4, view.getUint32));
+            default:
+                throw new Error(`不支持的 MessagePack 类型: 0x${byte.toString(16)}`);
+        }
+    }
+
+    return read();
+}
+
+// 解码一帧：文本帧为 JSON，二进制帧为短键 MessagePack（keys 为服务端告知的短键表）
+export function decodeFrame(data, keys) {
+    if (typeof data === 'string') {
+        return JSON.parse(data);
+    }
+    const message = decodeMsgpack(data);
+    if (!keys || !message || typeof message !== 'object' || Array.isArray(message)) {
+        return message;
+    }
+    const expanded = {};
+    for (const [key, value] of Object.entries(message)) {
+        expanded[keys[key] || key] = value;
+    }
+    return expanded;
+}
@@ -0,0 +1,175 @@
+"""
+静态资源的内存缓存与预压缩
+
+启动时读取 static 目录下的全部文件，计算内容指纹，并为文本类资源预先生成 gzip（安装 brotli 时另生成 br）
+压缩版本，之后的请求全部从内存返回，按 Accept-Encoding 选择编码。
+资源以 /assets/<指纹>/<路径> 提供并标记为 immutable 长期缓存；指纹取自全部静态文件的内容，
+因此 ES 模块之间的相对 import 与 CSS 的 @import 无需改写即指向同一版本。
+index.html 中指向 /static/ 的引用在启动时改写为带指纹的地址，index.html 本身每次请求重新验证（ETag）。
+
+版本指纹有意只取一个全局值：任一文件变化都会使全部资源的 URL 失效并重新下载。静态资源总量很小，
+换来的是无需构建工具改写模块间的相对引用，且同一页面加载的资源版本始终一致。
+ETag 按内容编码区分（原文 "<hash>"，压缩版本 "<hash>-gzip" / "<hash>-br"），
+不同编码的响应体不同，共享缓存与条件请求不会把一种编码的内容当作另一种编码复用。
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+from logger_config import setup_logger
+from voiceprint_catalog import etag_matches
+
+logger = setup_logger(__name__)
+
+ASSET_PREFIX = "/assets"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+# 小于该大小的文件不压缩
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("application/javascript", ".mjs")
+mimetypes.add_type("text/css", ".css")
+
+
+class _Asset:
+    __slots__ = ("body", "content_type", "digest", "encoded")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self.digest = hashlib.sha1(body).hexdigest()[:20]
+        # 编码 -> 压缩后的内容（只保留比原文件小的版本）
+        self.encoded: Dict[str, bytes] = {}
+        if len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            if BROTLI_AVAILABLE:
+                self._keep("br", brotli.compress(body, quality=11))
+            self._keep("gzip", gzip.compress(body, compresslevel=9, mtime=0))
+
+    def _keep(self, encoding: str, data: bytes):
+        if len(data) < len(self.body):
+            self.encoded[encoding] = data
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        """各内容编码的强 ETag（encoding 为 None 表示原文）"""
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+class StaticAssets:
+    """
+    静态资源缓存
+
+    Args:
+        root: 静态文件目录
+        url_prefix: 原有的静态资源 URL 前缀（index.html 中改写的对象）
+    """
+
+    def __init__(self, root: str = "static", url_prefix: str = "/static"):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.version = ""
+        self._assets: Dict[str, _Asset] = {}
+        self._index: Optional[_Asset] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._index is not None
+
+    def load(self):
+        """读取、计算指纹并预压缩全部静态文件"""
+        files = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, self.root).replace(os.sep, "/")] = f.read()
+
+        digest = hashlib.sha256()
+        for rel_path in sorted(files):
+            digest.update(rel_path.encode("utf-8"))
+            digest.update(hashlib.sha256(files[rel_path]).digest())
+        self.version = digest.hexdigest()[:12]
+
+        assets = {}
+        for rel_path, body in files.items():
+            content_type = mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type == "application/javascript":
+                content_type += "; charset=utf-8"
+            assets[rel_path] = _Asset(body, content_type)
+        self._assets = assets
+
+        index = files.get("index.html")
+        if index is not None:
+            static_ref = re.compile(r'((?:src|href)=["\'])' + re.escape(self.url_prefix.rstrip("/") + "/"))
+            html = static_ref.sub(rf"\g<1>{ASSET_PREFIX}/{self.version}/", index.decode("utf-8"))
+            self._index = _Asset(html.encode("utf-8"), "text/html; charset=utf-8")
+
+        raw = sum(len(asset.body) for asset in assets.values())
+        compressed = sum(min([len(asset.body), *map(len, asset.encoded.values())]) for asset in assets.values())
+        logger.info(
+            f"[静态资源] 已缓存 {len(assets)} 个文件，版本 {self.version}，"
+            f"{raw / 1024:.0f}KB → {compressed / 1024:.0f}KB（{'br+gzip' if BROTLI_AVAILABLE else 'gzip'}）"
+        )
+
+    # ---- 响应 ----
+
+    def _respond(self, asset: _Asset, request: Request, cache_control: str) -> Response:
+        # 先确定要返回的编码，条件请求与该编码的 ETag 比较
+        encoding = None
+        if asset.encoded:
+            accepted = _accepted_encodings(request)
+            encoding = next((e for e in ("br", "gzip") if e in asset.encoded and e in accepted), None)
+        etag = asset.etag(encoding)
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(content=asset.encoded[encoding], media_type=asset.content_type, headers=headers)
+        return Response(content=asset.body, media_type=asset.content_type, headers=headers)
+
+    def index_response(self, request: Request) -> Response:
+        return self._respond(self._index, request, REVALIDATE_CACHE)
+
+    def asset_response(self, version: str, path: str, request: Request) -> Optional[Response]:
+        """返回带指纹的资源；指纹与当前版本不符（旧页面）时返回当前内容但不长期缓存"""
+        asset = self._assets.get(path)
+        if asset is None:
+            return None
+        return self._respond(asset, request, IMMUTABLE_CACHE if version == self.version else REVALIDATE_CACHE)
+
+    def stats(self) -> Dict:
+        return {
+            "version": self.version,
+            "files": len(self._assets),
+            "bytes": sum(len(asset.body) for asset in self._assets.values()),
+            "encodings": ["br", "gzip"] if BROTLI_AVAILABLE else ["gzip"]
+        }
+
+
+# 全局静态资源缓存
+static_assets = StaticAssets()
@@ -0,0 +1,147 @@
+"""
+流式输出合并器
+
+模型的每个增量 (delta) 都单独发送一帧 JSON 时，快速模型每秒会产生数百个小帧，
+服务端为每个 token 序列化一次，前端也为每一帧重新渲染整条 Markdown。
+StreamCoalescer 在一个时间窗口（默认 40ms）或字节上限内缓冲增量，合并为一帧发送；
+结束 (done) 前强制刷新。全局统计 coalesce_stats 记录增量数、帧数与序列化耗时，
+将间隔设为 0 即可得到逐 token 发送时的对照数据。
+"""
+
+import asyncio
+import contextlib
+import json
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_FLUSH_INTERVAL_MS = 40
+DEFAULT_FLUSH_BYTES = 2048
+
+
+class CoalesceStats:
+    """流式帧统计：增量数、帧数、字节数与序列化 CPU 时间"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.deltas = 0
+        self.frames = 0
+        self.bytes = 0
+        self.serialize_cpu = 0.0
+        self.send_time = 0.0
+
+    def record_delta(self):
+        with self._lock:
+            self.deltas += 1
+
+    def record_frame(self, size: int, serialize_cpu: float, send_time: float):
+        with self._lock:
+            self.frames += 1
+            self.bytes += size
+            self.serialize_cpu += serialize_cpu
+            self.send_time += send_time
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "deltas": self.deltas,
+                "frames": self.frames,
+                "bytes": self.bytes,
+                "deltas_per_frame": round(self.deltas / self.frames, 2) if self.frames else None,
+                "serialize_cpu_ms": round(self.serialize_cpu * 1000, 1),
+                "send_ms": round(self.send_time * 1000, 1)
+            }
+
+
+# 全局流式帧统计
+coalesce_stats = CoalesceStats()
+
+
+class StreamCoalescer:
+    """
+    按时间窗口/字节上限合并流式增量
+
+    Args:
+        send_text: 发送已序列化文本的协程函数（如 websocket.send_text）；serialize=False 时传入帧字典
+        frame_fields: 每帧附带的固定字段，如 {"type": "chunk", "model": "xxx"}
+        interval_ms: 合并窗口（毫秒），0 表示逐个增量发送
+        max_bytes: 缓冲达到该字节数时立即发送
+        content_key: 合并后文本所在的字段名
+        serialize: 是否在此处序列化为 JSON（广播通道自行序列化时设为 False）
+    """
+
+    def __init__(
+        self,
+        send_text: Callable[[str], Awaitable[None]],
+        frame_fields: Dict,
+        interval_ms: float = DEFAULT_FLUSH_INTERVAL_MS,
+        max_bytes: int = DEFAULT_FLUSH_BYTES,
+        content_key: str = "content",
+        serialize: bool = True
+    ):
+        self._send_text = send_text
+        self._frame_fields = frame_fields
+        self._content_key = content_key
+        self._serialize = serialize
+        self.interval = max(0.0, interval_ms) / 1000.0
+        self.max_bytes = max(1, max_bytes)
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def push(self, delta: str):
+        """追加一个增量；超过字节上限时立即发送，否则在窗口结束时发送"""
+        if not delta:
+            return
+        coalesce_stats.record_delta()
+        self._buffer.append(delta)
+        self._buffered_bytes += len(delta.encode("utf-8"))
+        if self.interval <= 0 or self._buffered_bytes >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.debug(f"[流式合并] 定时发送失败: {e}")
+
+    async def flush(self):
+        """立即发送缓冲中的内容（done 之前必须调用）"""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            if not self._buffer:
+                return
+            content = "".join(self._buffer)
+            self._buffer.clear()
+            self._buffered_bytes = 0
+            frame = {**self._frame_fields, self._content_key: content}
+            if not self._serialize:
+                send_start = time.perf_counter()
+                await self._send_text(frame)
+                coalesce_stats.record_frame(len(content), 0.0, time.perf_counter() - send_start)
+                return
+            cpu_start = time.process_time()
+            text = json.dumps(frame, ensure_ascii=False, separators=(",", ":"))
+            serialize_cpu = time.process_time() - cpu_start
+            send_start = time.perf_counter()
+            await self._send_text(text)
+            coalesce_stats.record_frame(len(text), serialize_cpu, time.perf_counter() - send_start)
+
+    async def aclose(self):
+        """结束时发送剩余内容；连接已断开时静默忽略"""
+        with contextlib.suppress(Exception):
+            await self.flush()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
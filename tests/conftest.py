@@ -0,0 +1,16 @@
+import pytest
+
+from persistence import persistence
+
+
+@pytest.fixture
+def chat_manager(tmp_path, monkeypatch):
+    """在临时目录中创建 ChatManager（旧版 JSON 路径为相对路径，随工作目录切换）"""
+    from chat_manager import ChatManager
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(persistence, "coalesce_window", 0.0)
+    manager = ChatManager(db_path=str(tmp_path / "chat_history.db"))
+    yield manager
+    persistence.flush()
+    manager.close()
@@ -0,0 +1,35 @@
+"""本地模型推理精度变化时的重新加载"""
+
+from intelligent_agent import AgentManager, IntentRecognitionAgent, SmartAnalysisAgent
+
+
+def local_config(precision="auto"):
+    return {"model_type": "local", "model_name": "Qwen3-0.6B", "precision": precision}
+
+
+def test_reload_only_local_agents_with_changed_precision():
+    manager = AgentManager()
+    local = manager.agents["local"] = SmartAnalysisAgent(local_config())
+    api = manager.agents["api"] = SmartAnalysisAgent({"model_type": "api", "model_name": "api", "precision": "auto"})
+
+    assert manager.reload_local_precision("int8") == 1
+    assert manager.agents["local"] is not local
+    assert manager.agents["local"].config["precision"] == "int8"
+    assert manager.agents["api"] is api
+
+    # 精度未变化时不重新加载
+    reloaded = manager.agents["local"]
+    assert manager.reload_local_precision("int8") == 0
+    assert manager.agents["local"] is reloaded
+
+
+def test_reload_intent_agent():
+    manager = AgentManager()
+    assert manager.reload_local_precision("fp32", intent=True) == 0
+
+    intent = manager.intent_agent = IntentRecognitionAgent(local_config())
+    assert manager.reload_local_precision("fp32", intent=True) == 1
+    assert isinstance(manager.intent_agent, IntentRecognitionAgent)
+    assert manager.intent_agent is not intent
+    assert manager.intent_agent.config["precision"] == "fp32"
+    assert manager.agents == {}
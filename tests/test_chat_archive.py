@@ -0,0 +1,81 @@
+"""冷聊天归档：压缩、透明读取、修改后恢复，以及归档期间的全文检索"""
+
+from chat_manager import ChatManager
+from persistence import persistence
+from search_index import SearchIndex
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+def assistant(text):
+    return {"role": "assistant", "content": text}
+
+
+class EmptyTranscriptLog:
+    def iter_all(self):
+        return iter(())
+
+
+def attach_index(chat_manager):
+    index = SearchIndex()
+    events = []
+
+    def on_chat_changed(chat_id, start, messages):
+        events.append((chat_id, start, None if messages is None else len(messages)))
+        if messages is None:
+            index.remove_chat(chat_id)
+        else:
+            index.update_chat(chat_id, start, messages)
+
+    chat_manager.add_listener(on_chat_changed)
+    return index, events
+
+
+def archive(chat_manager, chat_id):
+    # cutoff 取未来时间：刚更新的聊天也满足“超过天数未更新”
+    chat_manager._archive_chats([chat_id], "9999-12-31T00:00:00")
+    persistence.flush()
+
+
+def test_archive_round_trip(chat_manager, tmp_path):
+    index, events = attach_index(chat_manager)
+    chat_id = chat_manager.create_chat("旧聊天")["id"]
+    history = [{"role": "system", "content": "sys"}, user("介绍 redis"), assistant("redis 是内存数据库")]
+    chat_manager.update_chat_messages(chat_id, history)
+    chat_manager.create_chat("当前聊天")  # 当前聊天不会被归档
+    persistence.flush()
+
+    archive(chat_manager, chat_id)
+    store = chat_manager.store
+    assert chat_manager.chats[chat_id]["archived"]
+    assert store.load_messages(chat_id) == []
+    assert store.load_archive(chat_id) == history
+    # 归档不发出变更通知，检索结果保留
+    assert all(messages is not None for _, _, messages in events)
+    assert sorted((r["key"], r["position"]) for r in index.search("redis")) == [(chat_id, 1), (chat_id, 2)]
+
+    # 重新打开：列表保留索引条目，读取时透明解压
+    reopened = ChatManager(db_path=str(tmp_path / "chat_history.db"))
+    items, _ = reopened.list_chat_index()
+    meta = {chat["id"]: chat for chat in items}[chat_id]
+    assert meta["archived"] and meta["message_count"] == 3
+    page = reopened.get_messages_page(chat_id, 1, before=2)
+    assert page["messages"] == [user("介绍 redis")]
+
+    # 启动时的索引构建同样包含归档聊天
+    bootstrapped = SearchIndex()
+    bootstrapped.bootstrap(reopened, EmptyTranscriptLog())
+    assert {r["key"] for r in bootstrapped.search("redis")} == {chat_id}
+
+    # 修改后恢复为普通聊天，只通知变化的尾部
+    reopened_index, reopened_events = attach_index(reopened)
+    reopened.update_chat_messages(chat_id, history + [user("kafka 呢")])
+    assert reopened_events == [(chat_id, 3, 1)]
+    persistence.flush()
+    assert not reopened.chats[chat_id]["archived"]
+    assert reopened.store.load_archive(chat_id) == []
+    assert [m["content"] for m in reopened.store.load_messages(chat_id)] == ["sys", "介绍 redis", "redis 是内存数据库", "kafka 呢"]
+    assert reopened.store.list_chats()[0]["archived"] is False
+    reopened.store.close()
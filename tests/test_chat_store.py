@@ -0,0 +1,155 @@
+"""SQLite 聊天存储：旧版 JSON 迁移、尾部替换与 ChatManager 的前缀差异写入"""
+
+import json
+import os
+
+from chat_store import ChatStore
+from persistence import persistence
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+def assistant(text):
+    return {"role": "assistant", "content": text}
+
+
+def test_migrates_legacy_json(tmp_path):
+    legacy_path = tmp_path / "chat_history.json"
+    legacy_path.write_text(json.dumps({
+        "current_chat_id": "b",
+        "chats": {
+            "a": {"title": "第一个", "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-02T00:00:00",
+                  "messages": [{"role": "system", "content": "sys"}, user("你好"), assistant("你好！")]},
+            "b": {"title": "第二个", "created_at": "2024-02-01T00:00:00", "updated_at": "2024-02-02T00:00:00",
+                  "messages": []}
+        }
+    }, ensure_ascii=False), encoding="utf-8")
+
+    store = ChatStore(str(tmp_path / "chat.db"), legacy_path=str(legacy_path))
+    chats = {chat["id"]: chat for chat in store.list_chats()}
+    assert [chat["id"] for chat in store.list_chats()] == ["b", "a"]
+    assert chats["a"]["message_count"] == 3
+    assert chats["a"]["preview"] == "你好！"
+    assert store.load_messages("a")[1] == user("你好")
+    assert store.get_meta("current_chat_id") == "b"
+    # 旧文件改名备份，不会再次导入
+    assert not legacy_path.exists()
+    assert os.path.exists(str(legacy_path) + ".migrated")
+    store.close()
+
+    legacy_path.write_text(json.dumps({"chats": {"c": {"title": "x", "messages": []}}}), encoding="utf-8")
+    store = ChatStore(str(tmp_path / "chat.db"), legacy_path=str(legacy_path))
+    assert {chat["id"] for chat in store.list_chats()} == {"a", "b"}
+    store.close()
+
+
+def test_replace_tail_appends_and_truncates(tmp_path):
+    store = ChatStore(str(tmp_path / "chat.db"), legacy_path=None)
+    store.create_chat({"id": "c", "title": "t", "created_at": "t0", "updated_at": "t0"})
+
+    store.replace_tail("c", 0, [user("1"), assistant("2")], "t1", "2")
+    store.replace_tail("c", 2, [user("3")], "t2", "3")
+    assert [m["content"] for m in store.load_messages("c")] == ["1", "2", "3"]
+    assert store.load_messages("c", 1, 2) == [assistant("2")]
+
+    # 从中间替换：删除 start 之后的旧消息
+    store.replace_tail("c", 1, [assistant("2'")], "t3", "2'")
+    assert [m["content"] for m in store.load_messages("c")] == ["1", "2'"]
+    meta = store.list_chats()[0]
+    assert (meta["message_count"], meta["preview"], meta["updated_at"]) == (2, "2'", "t3")
+    store.close()
+
+
+def test_chat_manager_writes_only_changed_tail(chat_manager, monkeypatch):
+    calls = []
+    original = chat_manager.store.replace_tail
+
+    def record(chat_id, start, messages, *args, **kwargs):
+        calls.append((start, len(messages)))
+        return original(chat_id, start, messages, *args, **kwargs)
+
+    monkeypatch.setattr(chat_manager.store, "replace_tail", record)
+    chat_id = chat_manager.create_chat("t")["id"]
+
+    history = [user("1"), assistant("2")]
+    chat_manager.update_chat_messages(chat_id, history)
+    persistence.flush()
+    # 传回同样内容的新对象（前端发送的完整历史）再追加一条：只写入新增的一条
+    chat_manager.update_chat_messages(chat_id, [dict(m) for m in history] + [user("3")])
+    persistence.flush()
+    # 修改中间一条：从该位置起写入
+    chat_manager.update_chat_messages(chat_id, [user("1"), assistant("2*"), user("3")])
+    persistence.flush()
+    assert calls == [(0, 2), (2, 1), (1, 2)]
+
+    # 未变化时不写入
+    chat_manager.update_chat_messages(chat_id, [user("1"), assistant("2*"), user("3")])
+    persistence.flush()
+    assert len(calls) == 3
+    assert [m["content"] for m in chat_manager.store.load_messages(chat_id)] == ["1", "2*", "3"]
+
+
+def test_upgrade_backfills_preview(tmp_path):
+    import sqlite3
+
+    db_path = str(tmp_path / "chat.db")
+    # 升级前的表结构：没有 preview / archived 列
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE chats (id TEXT PRIMARY KEY, title TEXT NOT NULL, created_at TEXT NOT NULL,
+                            updated_at TEXT NOT NULL, message_count INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE messages (chat_id TEXT NOT NULL, seq INTEGER NOT NULL, data TEXT NOT NULL,
+                               PRIMARY KEY (chat_id, seq));
+    """)
+    conn.execute("INSERT INTO chats VALUES ('a', 't', 't0', 't1', 3)")
+    conn.execute("INSERT INTO chats VALUES ('b', 't', 't0', 't1', 1)")
+    for seq, message in enumerate([{"role": "system", "content": "sys"}, user("问题"), assistant("回答\n第二行")]):
+        conn.execute("INSERT INTO messages VALUES ('a', ?, ?)", (seq, json.dumps(message, ensure_ascii=False)))
+    conn.execute("INSERT INTO messages VALUES ('b', 0, ?)", (json.dumps({"role": "system", "content": "sys"}),))
+    conn.commit()
+    conn.close()
+
+    store = ChatStore(db_path, legacy_path=None)
+    chats = {chat["id"]: chat for chat in store.list_chats()}
+    assert chats["a"]["preview"] == "回答 第二行"
+    assert chats["b"]["preview"] == ""
+    assert chats["a"]["archived"] is False
+    store.close()
+
+
+def test_append_messages_extends_in_place(chat_manager, monkeypatch):
+    calls = []
+    original = chat_manager.store.replace_tail
+
+    def record(chat_id, start, messages, *args, **kwargs):
+        calls.append((start, len(messages)))
+        return original(chat_id, start, messages, *args, **kwargs)
+
+    monkeypatch.setattr(chat_manager.store, "replace_tail", record)
+    events = []
+    chat_manager.add_listener(lambda chat_id, start, messages: events.append((start, len(messages))))
+    chat_id = chat_manager.create_chat("t")["id"]
+
+    assert chat_manager.ensure_system_prompt(chat_id, "sys")
+    assert chat_manager.ensure_system_prompt(chat_id, "sys")
+    persistence.flush()
+    stored = chat_manager._load_messages(chat_id)
+    assert chat_manager.append_messages(chat_id, [user("1")])
+    persistence.flush()
+    # 追加不替换已缓存的列表，只写入新增的消息
+    assert chat_manager.append_messages(chat_id, [assistant("2"), user("3")])
+    assert chat_manager._load_messages(chat_id) is stored
+    persistence.flush()
+    assert calls == [(0, 1), (1, 1), (2, 2)]
+    assert events == [(0, 1), (1, 1), (2, 2)]
+    meta = chat_manager.chats[chat_id]
+    assert (meta["message_count"], meta["preview"]) == (4, "3")
+    assert [m["content"] for m in chat_manager.store.load_messages(chat_id)] == ["sys", "1", "2", "3"]
+
+    # 系统提示词变化时从头替换
+    chat_manager.ensure_system_prompt(chat_id, "sys2")
+    persistence.flush()
+    assert calls[-1] == (0, 4)
+    assert chat_manager.append_messages("missing", [user("x")]) is False
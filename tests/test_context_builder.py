@@ -0,0 +1,151 @@
+"""分析窗口上下文：按预算从新到旧打包、超出预算的增量折叠进摘要、摘要跨触发复用"""
+
+import asyncio
+
+from context_builder import (MESSAGE_OVERHEAD_TOKENS, ContextBuilder, RollingSummary, TokenCounter,
+                             build_summary_message, pack_recent)
+
+
+class CharTokenizer:
+    """每个字符计 1 个 token，便于精确计算预算"""
+
+    def encode(self, text, add_special_tokens=False):
+        return list(text)
+
+
+COUNTER = TokenCounter(CharTokenizer())
+# 每条消息 10 个字符 + 格式开销
+COST = 10 + MESSAGE_OVERHEAD_TOKENS
+
+
+def conversation(n):
+    return [{"role": "user", "speaker": f"说话人{i % 2}", "content": f"第{i:02d}条消息内容啊啊"} for i in range(n)]
+
+
+def test_packs_newest_first_within_budget():
+    history = conversation(14)
+    builder = ContextBuilder(token_budget=200, summary_token_budget=50)
+    window = builder.build(history, counter=COUNTER)
+
+    # 放不下全部消息：为摘要预留 50 + 6 后打包最新的连续 9 条，更早的 5 条折叠进摘要
+    assert window.messages == history[5:]
+    assert window.end_index == 14
+    assert window.skipped == window.meta["folded"] == 5
+    # 摘要预算内只保留最近的 3 行
+    assert [line[-10:] for line in window.summary.splitlines()] == ["第02条消息内容啊啊", "第03条消息内容啊啊", "第04条消息内容啊啊"]
+    assert window.tokens == 200
+
+    # 预算足够时不折叠
+    roomy = builder.build(history, counter=COUNTER, token_budget=14 * COST)
+    assert roomy.messages == history
+    assert roomy.summary == ""
+    assert roomy.tokens == 14 * COST
+
+
+def test_keeps_latest_message_even_if_over_budget():
+    history = [{"role": "user", "content": "长" * 500}]
+    window = ContextBuilder(token_budget=64).build(history, counter=COUNTER)
+    assert window.messages == history
+    assert window.skipped == 0
+
+
+def test_max_messages_limits_window():
+    history = conversation(10)
+    window = ContextBuilder(token_budget=10_000).build(history, max_messages=4, counter=COUNTER)
+    assert window.messages == history[6:]
+    # 超出条数上限的消息同样折叠进摘要
+    assert window.meta["folded"] == 6
+    assert "第05条" in window.summary
+
+
+def test_overflow_is_folded_into_summary_without_mutating_it():
+    history = conversation(30)
+    summary_budget = 200
+    builder = ContextBuilder(token_budget=summary_budget + 3 * COST + MESSAGE_OVERHEAD_TOKENS, summary_token_budget=summary_budget)
+    window = builder.build(history, counter=COUNTER)
+
+    # 为摘要预留预算后打包 3 条，其余全部折叠进本次摘要（超出摘要预算的最早几行被丢弃）
+    assert window.messages == history[27:]
+    assert window.meta["folded"] == 27
+    assert window.summary.splitlines()[-1] == "说话人0: 第26条消息内容啊啊"
+    assert "第00条" not in window.summary
+    assert COUNTER.count(window.summary) <= summary_budget
+    assert window.tokens <= builder.token_budget
+    assert window.with_summary()[0] == build_summary_message(window.summary)
+    # 折叠只影响本次分析，滚动摘要的状态不变
+    assert builder.summary.text == ""
+    assert builder.summary.covered_until == 0
+
+
+def test_folded_summary_drops_oldest_lines_over_summary_budget():
+    history = conversation(12)
+    builder = ContextBuilder(token_budget=40 + 2 * COST + MESSAGE_OVERHEAD_TOKENS, summary_token_budget=40)
+    window = builder.build(history, counter=COUNTER)
+    assert window.messages == history[10:]
+    lines = window.summary.splitlines()
+    assert lines and lines[-1].endswith("第09条消息内容啊啊")
+    assert "第00条" not in window.summary
+    assert COUNTER.count(window.summary) <= 40
+
+
+def test_summary_is_reused_across_triggers():
+    history = conversation(10)
+    builder = ContextBuilder(token_budget=1000, summary_token_budget=1000)
+    asyncio.run(builder.summary.extend(history, 6, COUNTER))
+    assert builder.summary.covered_until == 6
+    assert len(builder.summary.text.splitlines()) == 6
+
+    # 增量分析从上次位置开始：已有摘要直接复用，不再重复折叠
+    window = builder.build(history, start_index=6, counter=COUNTER)
+    assert window.messages == history[6:]
+    assert window.summary == builder.summary.text
+    assert window.meta["folded"] == 0
+    assert window.tokens == 4 * COST + COUNTER.count(builder.summary.text) + MESSAGE_OVERHEAD_TOKENS
+
+    # 本次增量超出预算：在已有摘要之后接上折叠的消息
+    tight = builder.build(history, start_index=6, counter=COUNTER, token_budget=COUNTER.count(builder.summary.text) + MESSAGE_OVERHEAD_TOKENS + 2 * COST)
+    assert tight.summary.startswith(builder.summary.text)
+    assert tight.meta["folded"] == tight.start_index - 6 > 0
+    assert tight.summary.splitlines()[-1].endswith(f"第{tight.start_index - 1:02d}条消息内容啊啊")
+    assert builder.summary.covered_until == 6
+
+    # 分析位置被重置到摘要覆盖范围之内：不使用已有摘要，避免重复
+    reset = builder.build(history, start_index=2, counter=COUNTER)
+    assert reset.messages == history[2:]
+    assert reset.summary == ""
+
+
+def test_schedule_summary_update_runs_in_background():
+    history = conversation(8)
+    builder = ContextBuilder(summary_token_budget=1000)
+
+    async def run():
+        builder.schedule_summary_update(history, 5, COUNTER)
+        history.append({"role": "user", "content": "之后追加的消息"})  # 快照不受影响
+        await builder._pending_update
+        builder.schedule_summary_update(history, 3, COUNTER)  # 已覆盖，不再更新
+
+    asyncio.run(run())
+    assert builder.summary.covered_until == 5
+    assert builder.summary.text.splitlines()[-1] == "说话人0: 第04条消息内容啊啊"
+
+
+def test_rolling_summary_with_summarizer_fallback():
+    async def failing(previous, new_messages):
+        raise RuntimeError("down")
+
+    summary = RollingSummary(token_budget=1000, summarizer=failing)
+    asyncio.run(summary.extend(conversation(3), 3, COUNTER))
+    # 摘要模型失败时改用抽取式摘要
+    assert summary.covered_until == 3
+    assert len(summary.text.splitlines()) == 3
+
+
+def test_pack_recent_keeps_summary_and_newest():
+    history = conversation(6)
+    summary = build_summary_message("早期摘要")
+    kept = pack_recent([summary, *history], 2 * COST + COUNTER.count_message(summary), COUNTER)
+    assert kept == [summary, *history[4:]]
+
+    # 预算不足时至少保留最新一条
+    assert pack_recent(history, 1, COUNTER) == history[5:]
@@ -0,0 +1,19 @@
+"""LLM 客户端：流式输出的失败判定"""
+
+from llm_client import is_error_response
+
+
+def test_error_and_empty_responses_are_failures():
+    assert is_error_response("")
+    assert is_error_response(None)
+    assert is_error_response("  \n")
+    assert is_error_response("请求错误: timeout")
+    assert is_error_response("错误: LLM 客户端未初始化，请检查配置。")
+    assert is_error_response("\n[警告] 连接建立成功，但流是空的 (Stream Empty)。")
+    assert is_error_response("\n[警告] 未收到有效响应内容。")
+
+
+def test_normal_answer_is_success():
+    assert not is_error_response("Redis 是内存数据库")
+    # 只检查开头：回答正文中提到“请求错误”不算失败
+    assert not is_error_response("常见的请求错误: 超时与限流")
@@ -0,0 +1,78 @@
+"""后台持久化队列：读己之写、同键合并与 flush"""
+
+import json
+import threading
+
+from persistence import PersistenceWorker
+
+
+def test_load_json_reads_pending_write(tmp_path):
+    worker = PersistenceWorker(coalesce_window=0.2)
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"version": 1}), encoding="utf-8")
+
+    data = {"version": 2}
+    worker.write_json(str(path), data)
+    data["version"] = 3  # 提交后修改调用方的数据不影响快照
+    assert worker.load_json(str(path)) == {"version": 2}
+    assert worker.flush()
+    assert json.loads(path.read_text(encoding="utf-8")) == {"version": 2}
+    assert worker.load_json(str(path)) == {"version": 2}
+
+
+def test_load_json_default_for_missing_file(tmp_path):
+    worker = PersistenceWorker()
+    assert worker.load_json(str(tmp_path / "missing.json"), default={}) == {}
+
+
+def test_writes_to_same_key_are_coalesced(tmp_path):
+    worker = PersistenceWorker(coalesce_window=0.2)
+    path = str(tmp_path / "ui_state.json")
+    for i in range(5):
+        worker.write_json(path, {"i": i})
+    assert worker.flush()
+
+    assert worker.load_json(path) == {"i": 4}
+    stats = worker.stats()
+    assert stats["submitted"] == 5
+    assert stats["coalesced"] == 4
+    assert stats["written"] == 1
+    assert stats["pending"] == 0
+    assert not (tmp_path / "ui_state.json.tmp").exists()
+
+
+def test_submit_runs_last_operation_once(tmp_path):
+    worker = PersistenceWorker(coalesce_window=0.1)
+    ran = []
+    for i in range(3):
+        worker.submit("chat:a", lambda i=i: ran.append(i))
+    worker.submit("chat:b", lambda: ran.append("b"))
+    assert worker.flush()
+    assert ran == [2, "b"]
+
+
+def test_flush_waits_for_batch_in_progress(tmp_path):
+    worker = PersistenceWorker(coalesce_window=0.0)
+    started = threading.Event()
+    release = threading.Event()
+    done = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        done.append(True)
+
+    worker.submit("slow", slow)
+    assert started.wait(5)
+    threading.Timer(0.1, release.set).start()
+    assert worker.flush(timeout=5)
+    assert done == [True]
+
+
+def test_flush_times_out(tmp_path):
+    worker = PersistenceWorker(coalesce_window=0.0)
+    release = threading.Event()
+    worker.submit("stuck", lambda: release.wait(5))
+    assert not worker.flush(timeout=0.1)
+    release.set()
+    assert worker.flush(timeout=5)
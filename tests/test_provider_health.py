@@ -0,0 +1,120 @@
+"""端点断路器：open → half_open → closed/open，以及只读的 allow()"""
+
+import pytest
+
+import provider_health as ph
+from provider_health import ProviderHealthRegistry
+
+URL = "https://api.example.com/v1"
+MODEL = "model-a"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ph.time, "time", lambda: now[0])
+    return now
+
+
+def trip(registry: ProviderHealthRegistry):
+    for _ in range(ph.FAILURE_THRESHOLD):
+        registry.record_failure(URL, MODEL, "boom")
+
+
+def state(registry: ProviderHealthRegistry) -> str:
+    return registry.snapshot()[0]["state"]
+
+
+def test_open_endpoint_is_rejected_until_cooldown(clock):
+    registry = ProviderHealthRegistry()
+    trip(registry)
+    assert state(registry) == "open"
+    assert not registry.allow(URL, MODEL)
+    assert not registry.try_acquire_probe(URL, MODEL)
+
+    clock[0] += ph.OPEN_COOLDOWN
+    assert registry.allow(URL, MODEL)
+
+
+def test_allow_does_not_change_state(clock):
+    registry = ProviderHealthRegistry()
+    trip(registry)
+    clock[0] += ph.OPEN_COOLDOWN
+    for _ in range(5):
+        assert registry.allow(URL, MODEL)
+    assert state(registry) == "open"
+
+
+def test_single_probe_then_close_on_success(clock):
+    registry = ProviderHealthRegistry()
+    trip(registry)
+    clock[0] += ph.OPEN_COOLDOWN
+
+    assert registry.try_acquire_probe(URL, MODEL)
+    assert state(registry) == "half_open"
+    # 探测进行中：不再作为候选，也不会发出第二个探测
+    assert not registry.allow(URL, MODEL)
+    assert not registry.try_acquire_probe(URL, MODEL)
+
+    registry.record_success(URL, MODEL, ttft=0.4, duration=1.0, chars=100)
+    assert state(registry) == "closed"
+    assert registry.allow(URL, MODEL)
+    assert not registry.try_acquire_probe(URL, MODEL)
+
+
+def test_failed_probe_reopens(clock):
+    registry = ProviderHealthRegistry()
+    trip(registry)
+    clock[0] += ph.OPEN_COOLDOWN
+
+    assert registry.try_acquire_probe(URL, MODEL)
+    registry.record_failure(URL, MODEL, "still down")
+    assert state(registry) == "open"
+    assert not registry.allow(URL, MODEL)
+
+    clock[0] += ph.OPEN_COOLDOWN
+    assert registry.allow(URL, MODEL)
+
+
+def test_released_probe_can_be_acquired_again(clock):
+    registry = ProviderHealthRegistry()
+    trip(registry)
+    clock[0] += ph.OPEN_COOLDOWN
+
+    assert registry.try_acquire_probe(URL, MODEL)
+    registry.release_probe(URL, MODEL)
+    assert state(registry) == "open"
+    assert registry.allow(URL, MODEL)
+    assert registry.try_acquire_probe(URL, MODEL)
+
+
+def test_lost_probe_expires(clock):
+    registry = ProviderHealthRegistry()
+    trip(registry)
+    clock[0] += ph.OPEN_COOLDOWN
+    assert registry.try_acquire_probe(URL, MODEL)
+
+    clock[0] += ph.PROBE_TIMEOUT
+    assert registry.allow(URL, MODEL)
+    assert registry.try_acquire_probe(URL, MODEL)
+
+
+def test_select_config_keeps_cooled_endpoint_routable(clock):
+    registry = ProviderHealthRegistry()
+    config_data = {
+        "configs": [
+            {"name": "a", "api_key": "k", "base_url": URL, "model": MODEL},
+            {"name": "b", "api_key": "k", "base_url": "https://other.example.com/v1", "model": MODEL},
+        ],
+        "current_config": "a",
+    }
+    trip(registry)
+    registry.record_success("https://other.example.com/v1", MODEL, ttft=0.2, duration=1.0, chars=50)
+    assert registry.select_config(config_data, "a")["name"] == "b"
+
+    clock[0] += ph.OPEN_COOLDOWN
+    # 多次路由（未选中 a）后 a 仍可被选中探测，不会永久停留在 half_open
+    for _ in range(3):
+        registry.select_config(config_data, "a")
+    assert state(registry) == "open"
+    assert registry.allow(URL, MODEL)
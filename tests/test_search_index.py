@@ -0,0 +1,109 @@
+"""全文检索：增量更新、删除与墓碑压缩"""
+
+import search_index as si
+from search_index import SOURCE_ASR, SOURCE_CHAT, SearchIndex, build_snippet, tokenize
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+def keys(results):
+    return [(r["key"], r["position"]) for r in results]
+
+
+def test_tokenize_mixes_bigrams_and_words():
+    assert tokenize("Python 面试题") == ["python", "面试", "试题"]
+    assert tokenize("好") == ["好"]
+
+
+def test_snippet_highlights_and_escapes():
+    assert build_snippet("介绍 <b>Redis</b> 缓存", ["redis"]) == "介绍 &lt;b&gt;<mark>Redis</mark>&lt;/b&gt; 缓存"
+
+
+def test_snippet_marks_only_token_hits():
+    # "red" 作为子串出现在 redis 中，但分词后不是命中词
+    assert build_snippet("redis and red", ["red"]) == "redis and <mark>red</mark>"
+    assert build_snippet("面试官问了面试题", ["面试"]) == "<mark>面试</mark>官问了<mark>面试</mark>题"
+    # 长度会随大小写转换改变的字符不影响位置
+    assert build_snippet("İstanbul redis", ["redis"]) == "İstanbul <mark>redis</mark>"
+
+
+def test_update_chat_replaces_tail():
+    index = SearchIndex()
+    index.update_chat("a", 0, [{"role": "system", "content": "redis"}, user("介绍一下 redis"), user("kafka 分区")])
+    # 系统提示词不参与检索
+    assert keys(index.search("redis")) == [("a", 1)]
+
+    # 从位置 2 起替换：旧的 kafka 消息被删除
+    index.update_chat("a", 2, [user("rabbitmq 队列")])
+    assert index.search("kafka") == []
+    assert keys(index.search("rabbitmq")) == [("a", 2)]
+    assert index.stats()["documents"] == 2
+    assert index.stats()["tombstones"] == 1
+
+    # 追加
+    index.update_chat("a", 3, [user("kafka 消费者")])
+    assert keys(index.search("kafka")) == [("a", 3)]
+
+
+def test_update_chat_pads_unindexed_prefix():
+    index = SearchIndex()
+    index.update_chat("a", 5, [user("redis")])
+    assert keys(index.search("redis")) == [("a", 5)]
+    index.update_chat("a", 0, [])
+    assert index.search("redis") == []
+
+
+def test_remove_chat_and_source_filter():
+    index = SearchIndex()
+    index.update_chat("a", 0, [user("redis 集群")])
+    index.update_chat("b", 0, [user("redis 持久化")])
+    index.add_transcript("2024-01-01", 0, {"text": "面试官问了 redis", "ts": 1.0})
+
+    assert {r["key"] for r in index.search("redis")} == {"a", "b", "2024-01-01"}
+    assert [r["source"] for r in index.search("redis", source=SOURCE_ASR)] == [SOURCE_ASR]
+
+    index.remove_chat("a")
+    assert {r["key"] for r in index.search("redis", source=SOURCE_CHAT)} == {"b"}
+    assert index.stats()["documents"] == 2
+
+
+def test_compaction_drops_tombstoned_postings(monkeypatch):
+    monkeypatch.setattr(si, "COMPACT_MIN", 3)
+    index = SearchIndex()
+    index.update_chat("a", 0, [user(f"redis {i}") for i in range(4)])
+    index.update_chat("b", 0, [user("redis kafka")])
+
+    # 2 个墓碑：未达到最小数量，倒排表保留已删除的文档
+    index.update_chat("a", 2, [])
+    assert index.stats()["tombstones"] == 2
+    assert len(index._postings["redis"]) // 2 == 5
+
+    # 第 3 个墓碑：3 >= 3 且 3 >= 0.25 * 5，触发压缩
+    index.remove_chat("b")
+    assert index.stats()["tombstones"] == 0
+    assert len(index._postings["redis"]) // 2 == 2
+    assert "kafka" not in index._postings
+    assert sorted(keys(index.search("redis"))) == [("a", 0), ("a", 1)]
+
+    # 已删除的文档被回收并重新编号，后续更新仍然正确
+    assert len(index._docs) == index.stats()["documents"] == 2
+    index.update_chat("a", 1, [user("kafka")])
+    assert keys(index.search("kafka")) == [("a", 1)]
+    assert keys(index.search("redis")) == [("a", 0)]
+
+
+def test_search_uses_text_loader_for_snippet():
+    loaded = []
+
+    def loader(source, key, position):
+        loaded.append((source, key, position))
+        return {"text": "完整的 redis 原文", "title": "标题"}
+
+    index = SearchIndex(text_loader=loader)
+    index.update_chat("a", 0, [user("redis")])
+    [result] = index.search("redis")
+    assert loaded == [(SOURCE_CHAT, "a", 0)]
+    assert result["snippet"] == "完整的 <mark>redis</mark> 原文"
+    assert result["title"] == "标题"
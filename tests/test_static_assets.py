@@ -0,0 +1,30 @@
+"""静态资源：按编码区分的 ETag 与条件请求"""
+
+from starlette.requests import Request
+
+from static_assets import StaticAssets
+
+
+def request(accept_encoding="", if_none_match=None):
+    headers = [(b"accept-encoding", accept_encoding.encode())]
+    if if_none_match:
+        headers.append((b"if-none-match", if_none_match.encode()))
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_etag_differs_per_encoding(tmp_path):
+    (tmp_path / "index.html").write_text("<html>" + "x" * 2000 + "</html>", encoding="utf-8")
+    assets = StaticAssets(root=str(tmp_path))
+    assets.load()
+
+    identity = assets.index_response(request())
+    gzipped = assets.index_response(request("gzip"))
+    assert "content-encoding" not in identity.headers
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.headers["etag"] == identity.headers["etag"][:-1] + '-gzip"'
+
+    # 条件请求只匹配本次将返回的编码
+    assert assets.index_response(request("gzip", gzipped.headers["etag"])).status_code == 304
+    assert assets.index_response(request("", gzipped.headers["etag"])).status_code == 200
+    assert assets.index_response(request("gzip", identity.headers["etag"])).status_code == 200
+    assert assets.index_response(request("", "W/" + identity.headers["etag"])).status_code == 304
@@ -0,0 +1,101 @@
+"""
+ASR 转写记录
+
+把实时语音转写结果按天追加到 data/transcripts/YYYY-MM-DD.jsonl，
+每行一条 {time, speaker, text, ts}。追加只写入该行，可按字节偏移回读单条记录。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+TRANSCRIPT_DIR = "data/transcripts"
+
+
+class TranscriptLog:
+    """
+    按天分文件的转写记录（线程安全，通常由 ASR 线程写入）
+
+    Args:
+        directory: 记录目录
+    """
+
+    def __init__(self, directory: str = TRANSCRIPT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str, int, Dict], None]] = []
+
+    def add_listener(self, listener: Callable[[str, int, Dict], None]):
+        """注册追加回调 listener(文件名, 字节偏移, 记录)"""
+        self._listeners.append(listener)
+
+    def append(self, message: Dict) -> Optional[Tuple[str, int]]:
+        """
+        追加一条转写消息；系统状态消息与空文本会被忽略
+
+        Returns:
+            (文件名, 字节偏移)；未写入时返回 None
+        """
+        text = (message.get("text") or "").strip()
+        if not text or "asr_status" in message:
+            return None
+        record = {
+            "time": message.get("time", ""),
+            "speaker": message.get("speaker", ""),
+            "text": text,
+            "ts": time.time()
+        }
+        name = time.strftime("%Y-%m-%d") + ".jsonl"
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            with self._lock:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(os.path.join(self.directory, name), "ab") as f:
+                    offset = f.tell()
+                    f.write(line)
+        except Exception as e:
+            logger.error(f"[转写记录] 写入失败: {e}")
+            return None
+
+        for listener in self._listeners:
+            try:
+                listener(name, offset, record)
+            except Exception as e:
+                logger.error(f"[转写记录] 回调失败: {e}")
+        return name, offset
+
+    def read(self, name: str, offset: int) -> Optional[Dict]:
+        """按文件名与字节偏移读取单条记录"""
+        path = os.path.join(self.directory, os.path.basename(name))
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                return json.loads(f.readline().decode("utf-8"))
+        except Exception:
+            return None
+
+    def iter_all(self) -> Iterator[Tuple[str, int, Dict]]:
+        """按时间顺序遍历全部记录 (文件名, 字节偏移, 记录)"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".jsonl"):
+                continue
+            with open(os.path.join(self.directory, name), "rb") as f:
+                offset = 0
+                for raw in f:
+                    try:
+                        yield name, offset, json.loads(raw.decode("utf-8"))
+                    except ValueError:
+                        pass
+                    offset += len(raw)
+
+
+# 全局转写记录
+transcript_log = TranscriptLog()
@@ -5,15 +5,18 @@
 """
 
 import asyncio
-import json
-import os
 import time
 import uuid
 from dataclasses import dataclass
 from typing import Callable, Dict, List, Optional
 
+from context_builder import ContextBuilder, TokenCounter
 from intelligent_agent import agent_manager
+from llm_scheduler import PRIORITY_REALTIME, llm_priority
 from logger_config import setup_logger
+from persistence import persistence
+from stream_coalescer import (DEFAULT_FLUSH_BYTES, DEFAULT_FLUSH_INTERVAL_MS,
+                              StreamCoalescer)
 
 logger = setup_logger(__name__)
 
@@ -23,10 +26,7 @@ CONFIG_FILE = "api_config.json"
 
 def load_config():
     """加载配置文件"""
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"configs": [], "current_config": ""}
+    return persistence.load_json(CONFIG_FILE, default={"configs": [], "current_config": ""})
 
 
 @dataclass
@@ -59,6 +59,8 @@ class TriggerManager:
         # --- 分析窗口设置 (可调优) ---
         self.max_increment_messages = 15 # 增量分析窗口大小：每次分析最多包含多少条最新消息
                                          # 此参数决定了意图识别能看到多长的最近对话
+        # 按 token 预算打包最新消息，更早的对话折叠进滚动摘要（跨触发复用）
+        self.context_builder = ContextBuilder()
                                          
         self.event_loop = None           # 保存主event loop引用
         self.protagonist = None          # 主人公姓名
@@ -84,32 +86,45 @@ class TriggerManager:
                 try:
                     if not agent_manager.enabled:
                         continue
-                        
-                    current_time = time.time()
-                    
-                    # 检查是否静音超时
-                    if self.state.silence_start_time and not self.state.pending_analysis:
-                        silence_duration = current_time - self.state.silence_start_time
-                        if silence_duration >= self.silence_threshold:
-                            logger.debug(f"[触发机制(后台)] 静音超时 {silence_duration:.1f}秒，自动触发分析")
-
-                            # 需要在event loop中执行触发逻辑，确保线程安全（虽然这里主要是状态更新）
-                            # 但最好保持一致性。如果直接调用 _trigger_analysis，它会通过 run_coroutine_threadsafe 提交任务，是安全的。
-                            self._trigger_analysis(trigger_type="background_monitor")
-                            
+                    # 触发状态只在 event loop 线程中修改（ASR 消息也经 asr_bridge 在该线程处理）
+                    if self.event_loop and self.event_loop.is_running():
+                        self.event_loop.call_soon_threadsafe(self._monitor_tick)
+                    else:
+                        self._monitor_tick()
                 except Exception as e:
                     logger.error(f"[触发机制] 后台监控出错: {e}")
-                    
+
         # 使用守护线程运行监控
         self.monitor_thread = threading.Thread(target=_monitor_loop, daemon=True)
         self.monitor_thread.start()
 
+    def _monitor_tick(self):
+        """检查是否静音超时"""
+        try:
+            if not agent_manager.enabled:
+                return
+            if self.state.silence_start_time and not self.state.pending_analysis:
+                silence_duration = time.time() - self.state.silence_start_time
+                if silence_duration >= self.silence_threshold:
+                    logger.debug(f"[触发机制(后台)] 静音超时 {silence_duration:.1f}秒，自动触发分析")
+                    self._trigger_analysis(trigger_type="background_monitor")
+        except Exception as e:
+            logger.error(f"[触发机制] 后台监控出错: {e}")
+
     def set_thresholds(self, min_chars: int, silence_secs: float):
         """设置触发阈值"""
         self.min_characters = min_chars
         self.silence_threshold = silence_secs
         logger.info(f"[触发机制] 阈值已更新: {min_chars}字, {silence_secs}秒静音")
 
+    def set_context_budgets(self, token_budget: Optional[int] = None, summary_token_budget: Optional[int] = None):
+        """设置分析窗口与滚动摘要的 token 预算"""
+        self.context_builder.set_budgets(token_budget, summary_token_budget)
+        logger.info(
+            f"[触发机制] 上下文预算已更新: 窗口={self.context_builder.token_budget} tokens, "
+            f"摘要={self.context_builder.summary.token_budget} tokens"
+        )
+
     def set_event_loop(self, loop):
         """设置主event loop引用"""
         self.event_loop = loop
@@ -330,9 +345,18 @@ class TriggerManager:
         if start_index < 0:
             start_index = 0
 
-        # 取增量消息，但限制最大条数（避免一次分析太多）
-        end_index = min(start_index + self.max_increment_messages, len(self.conversation_history))
-        messages = self.conversation_history[start_index:end_index]
+        # 从最新消息向前按 token 预算打包（同时受最大条数限制），更早的增量折叠进摘要
+        window = self.context_builder.build(
+            self.conversation_history,
+            start_index=start_index,
+            max_messages=self.max_increment_messages,
+            counter=TokenCounter(agent_manager.get_context_tokenizer())
+        )
+        messages = window.messages
+        start_index = window.start_index
+        end_index = window.end_index
+        if window.skipped:
+            logger.debug(f"[触发机制] 📦 超出预算的 {window.skipped} 条较早消息已折叠进本次摘要")
 
         if messages:
             analysis_meta = self._build_analysis_metadata(messages)
@@ -367,7 +391,7 @@ class TriggerManager:
             # 异步执行分析 - 使用保存的event loop
             if self.event_loop and self.event_loop.is_running():
                 asyncio.run_coroutine_threadsafe(
-                    self._run_analysis(messages, speaker_name, start_index, analysis_id, analysis_meta),
+                    self._run_analysis(window.with_summary(), speaker_name, start_index, analysis_id, analysis_meta, end_index),
                     self.event_loop
                 )
                 logger.debug("[触发机制] ✅ 分析任务已提交到主event loop")
@@ -382,9 +406,17 @@ class TriggerManager:
         speaker_name: str,
         start_index: int,
         analysis_id: Optional[str] = None,
-        analysis_meta: Optional[Dict] = None
+        analysis_meta: Optional[Dict] = None,
+        end_index: Optional[int] = None
     ):
-        """运行智能分析"""
+        """运行智能分析
+
+        Args:
+            messages: 分析窗口消息（开头可能带滚动摘要伪消息）
+            end_index: 窗口在对话历史中的结束位置（不含），用于更新分析位置与摘要
+        """
+        # 分析任务在独立任务中运行，优先级只影响本次分析的 LLM 调用
+        llm_priority.set(PRIORITY_REALTIME)
         try:
             config_data = load_config()
             agent_config = config_data.get("agent_config", {})
@@ -406,8 +438,12 @@ class TriggerManager:
             intent_recognition_enabled = agent_config.get("intent_recognition_enabled", False)
             think_tank_enabled = agent_config.get("think_tank_enabled", False)
 
+            # 意图识别增量按 stream_flush_interval_ms 合并后广播，避免逐 token 发送
+            intent_coalescer: Optional[StreamCoalescer] = None
+
             # 定义进度回调
             async def progress_callback(stage: str, data: Dict):
+                nonlocal intent_coalescer
                 if self.broadcast_callback:
                     cur_analysis_id = analysis_id or self.state.current_analysis_id
                     
@@ -426,15 +462,39 @@ class TriggerManager:
                             })
                         except Exception as e:
                             logger.error(f"[触发机制] ❌ 广播失败: {e}")
+                    elif stage == "intent_delta":
+                        if intent_coalescer is None:
+                            intent_coalescer = StreamCoalescer(
+                                self.broadcast_callback,
+                                {
+                                    "time": time.strftime("%H:%M:%S"),
+                                    "speaker": "智能分析",
+                                    "analysis_id": cur_analysis_id,
+                                    "analysis_status": "intent_streaming"
+                                },
+                                interval_ms=config_data.get("stream_flush_interval_ms", DEFAULT_FLUSH_INTERVAL_MS),
+                                max_bytes=config_data.get("stream_flush_bytes", DEFAULT_FLUSH_BYTES),
+                                content_key="intent_delta",
+                                serialize=False
+                            )
+                        try:
+                            await intent_coalescer.push(data.get("delta", ""))
+                        except Exception as e:
+                            logger.error(f"[触发机制] ❌ 意图识别流式广播失败: {e}")
 
             # 运行完整的三阶段智能分析
-            result = await agent_manager.run_intelligent_analysis(
-                messages,
-                speaker_name,
-                intent_recognition=intent_recognition_enabled,
-                use_think_tank=think_tank_enabled,
-                status_callback=progress_callback
-            )
+            try:
+                result = await agent_manager.run_intelligent_analysis(
+                    messages,
+                    speaker_name,
+                    intent_recognition=intent_recognition_enabled,
+                    use_think_tank=think_tank_enabled,
+                    status_callback=progress_callback
+                )
+            finally:
+                # 结果广播之前发出剩余的意图识别增量
+                if intent_coalescer is not None:
+                    await intent_coalescer.aclose()
             result['analysis_id'] = analysis_id or self.state.current_analysis_id
             if analysis_meta:
                 result.update(analysis_meta)
@@ -484,9 +544,20 @@ class TriggerManager:
             logger.exception("分析异常详情:")
         finally:
             # 更新分析位置：指向这次分析的最后一条消息
-            if messages:
-                self.state.last_analysis_index = start_index + len(messages) - 1
+            if end_index is None:
+                end_index = start_index + len([m for m in messages if not m.get('is_summary')])
+            if end_index > start_index:
+                self.state.last_analysis_index = end_index - 1
                 logger.debug(f"[触发机制] 📍 更新分析位置: {self.state.last_analysis_index} (下次从 {self.state.last_analysis_index + 1} 开始)")
+                # 已分析的对话在后台折叠进滚动摘要，供下次触发复用
+                try:
+                    self.context_builder.schedule_summary_update(
+                        self.conversation_history,
+                        end_index,
+                        TokenCounter(agent_manager.get_context_tokenizer())
+                    )
+                except Exception as e:
+                    logger.error(f"[触发机制] 滚动摘要更新调度失败: {e}")
 
             self.state.accumulated_text = ""
             self.state.pending_analysis = False
@@ -501,6 +572,7 @@ class TriggerManager:
     def clear_history(self):
         """清空对话历史"""
         self.conversation_history = []
+        self.context_builder.reset()
         # 保留配置参数，只重置状态
         old_min_chars = self.min_characters
         old_silence_threshold = self.silence_threshold
@@ -518,6 +590,7 @@ class TriggerManager:
     def reset_analysis_position(self):
         """重置分析位置，下次分析从头开始"""
         self.state.last_analysis_index = -1
+        self.context_builder.reset()
         print("[触发机制] 🔄 已重置分析位置，下次将从头分析")
 
     def get_status(self) -> dict:
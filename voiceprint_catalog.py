@@ -0,0 +1,151 @@
+"""
+声纹库列表的元数据缓存
+
+GET /api/voiceprints 从内存返回已序列化的列表，并附带内容哈希 ETag，列表未变化时客户端以
+If-None-Match 重新验证只得到 304。目录的修改时间变化（注册、删除、重建生成嵌入文件）时重新扫描目录，
+只对大小或修改时间变化的 WAV 重新读取时长；注册与删除完成时直接更新对应条目。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def _audio_duration(wav_path: str) -> Optional[float]:
+    try:
+        import soundfile as sf
+        return round(sf.info(wav_path).duration, 2)
+    except Exception:
+        return None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中（支持多个值、弱校验与 *）"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class VoiceprintCatalog:
+    """声纹目录的元数据缓存（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dir: Optional[str] = None
+        self._dir_mtime: Optional[int] = None
+        # name -> 列表条目；name -> (WAV 修改时间, 大小)，用于判断时长是否需要重新读取
+        self._entries: Dict[str, Dict] = {}
+        self._signatures: Dict[str, Tuple[int, int]] = {}
+        self._body = '{"voiceprints":[]}'
+        self._etag = ""
+        self._stats = {"scans": 0, "duration_reads": 0}
+
+    @staticmethod
+    def _dir_mtime_ns(voiceprint_dir: str) -> Optional[int]:
+        try:
+            return os.stat(voiceprint_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def is_stale(self, voiceprint_dir: str) -> bool:
+        """目录或其修改时间与缓存不一致（一次 stat）"""
+        return voiceprint_dir != self._dir or self._dir_mtime_ns(voiceprint_dir) != self._dir_mtime
+
+    def snapshot(self) -> Tuple[str, str]:
+        """(ETag, 已序列化的列表)"""
+        with self._lock:
+            return self._etag, self._body
+
+    # ---- 更新 ----
+
+    def refresh(self, voiceprint_dir: str):
+        """重新扫描目录；大小与修改时间未变的 WAV 沿用缓存的时长"""
+        with self._lock:
+            if voiceprint_dir != self._dir:
+                self._entries, self._signatures = {}, {}
+            mtime = self._dir_mtime_ns(voiceprint_dir)
+            entries: Dict[str, Dict] = {}
+            signatures: Dict[str, Tuple[int, int]] = {}
+            if mtime is not None:
+                files = {entry.name: entry for entry in os.scandir(voiceprint_dir) if entry.is_file()}
+                for filename, entry in files.items():
+                    if not filename.lower().endswith(".wav"):
+                        continue
+                    name = os.path.splitext(filename)[0]
+                    stat = entry.stat()
+                    signature = (stat.st_mtime_ns, stat.st_size)
+                    npy = files.get(f"{name}.npy")
+                    cached = self._entries.get(name)
+                    if cached is not None and self._signatures.get(name) == signature:
+                        duration = cached["duration"]
+                    else:
+                        duration = _audio_duration(entry.path)
+                        self._stats["duration_reads"] += 1
+                    entries[name] = {
+                        "name": name,
+                        "wav_file": filename,
+                        "wav_size": stat.st_size,
+                        "has_embedding": npy is not None,
+                        "embedding_size": npy.stat().st_size if npy is not None else 0,
+                        "duration": duration,
+                        "created_time": stat.st_ctime
+                    }
+                    signatures[name] = signature
+            self._dir, self._dir_mtime = voiceprint_dir, mtime
+            self._entries, self._signatures = entries, signatures
+            self._stats["scans"] += 1
+            self._encode()
+
+    def refresh_entry(self, voiceprint_dir: str, name: str):
+        """注册或删除完成后更新单个条目（目录的下次扫描可沿用此处读取的时长）"""
+        with self._lock:
+            if voiceprint_dir != self._dir:
+                return
+            wav_path = os.path.join(voiceprint_dir, f"{name}.wav")
+            npy_path = os.path.join(voiceprint_dir, f"{name}.npy")
+            try:
+                stat = os.stat(wav_path)
+            except FileNotFoundError:
+                self._entries.pop(name, None)
+                self._signatures.pop(name, None)
+                self._encode()
+                return
+            try:
+                embedding_size = os.path.getsize(npy_path)
+            except OSError:
+                embedding_size = None
+            self._entries[name] = {
+                "name": name,
+                "wav_file": f"{name}.wav",
+                "wav_size": stat.st_size,
+                "has_embedding": embedding_size is not None,
+                "embedding_size": embedding_size or 0,
+                "duration": _audio_duration(wav_path),
+                "created_time": stat.st_ctime
+            }
+            self._signatures[name] = (stat.st_mtime_ns, stat.st_size)
+            self._stats["duration_reads"] += 1
+            self._encode()
+
+    def _encode(self):
+        """序列化列表并计算 ETag（调用方持有锁）"""
+        self._body = json.dumps({"voiceprints": list(self._entries.values())}, ensure_ascii=False, separators=(",", ":"))
+        self._etag = '"' + hashlib.sha1(self._body.encode("utf-8")).hexdigest()[:20] + '"'
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, "speakers": len(self._entries)}
+
+
+# 全局声纹目录缓存
+voiceprint_catalog = VoiceprintCatalog()
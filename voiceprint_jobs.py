@@ -0,0 +1,201 @@
+"""
+声纹注册后台任务
+
+POST /api/voiceprints 只做参数检查并登记任务，base64 解码、时长校验、重采样与 CAM++ 嵌入计算
+在独立的工作线程中进行，不阻塞事件循环；每个阶段的进度通过监听回调推送（服务端经 /ws 广播）。
+完成后把新嵌入直接插入运行中的声纹库，不再重新扫描整个声纹目录。
+"""
+
+import base64
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from logger_config import setup_logger
+from voiceprint_catalog import voiceprint_catalog
+
+logger = setup_logger(__name__)
+
+MIN_DURATION = 10
+MAX_DURATION = 40
+# 保留的已结束任务数（供查询）
+FINISHED_JOB_HISTORY = 32
+
+# 阶段 -> 进度
+STAGE_PROGRESS = {
+    "queued": 0.0,
+    "decoding": 0.1,
+    "validating": 0.2,
+    "converting": 0.35,
+    "embedding": 0.5,
+    "done": 1.0,
+    "failed": 1.0,
+}
+FINISHED_STAGES = ("done", "failed")
+
+
+class EnrollmentError(Exception):
+    """注册失败（消息直接展示给用户）"""
+
+
+class VoiceprintEnrollment:
+    """
+    声纹注册任务队列
+
+    Args:
+        max_workers: 工作线程数（嵌入计算与实时声纹识别共用模型，默认串行执行）
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="voiceprint")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        # listener(任务快照)，在工作线程中调用
+        self._listeners: List[Callable[[Dict], None]] = []
+
+    def add_listener(self, listener: Callable[[Dict], None]):
+        self._listeners.append(listener)
+
+    # ---- 任务 ----
+
+    def submit(self, name: str, audio_data: str, voiceprint_dir: str, asr_system=None) -> Dict:
+        """
+        登记注册任务并立即返回
+
+        Args:
+            audio_data: base64 编码的 WAV（可带 data URL 头）
+            asr_system: 运行中的 ASR 系统；为 None 时只保存音频，嵌入在下次正常启动时计算
+
+        Raises:
+            EnrollmentError: 同名说话人已存在或正在注册
+        """
+        wav_path = os.path.join(voiceprint_dir, f"{name}.wav")
+        with self._lock:
+            if os.path.exists(wav_path):
+                raise EnrollmentError(f"说话人 '{name}' 已存在")
+            if any(job["name"] == name and job["status"] not in FINISHED_STAGES for job in self._jobs.values()):
+                raise EnrollmentError(f"说话人 '{name}' 正在注册")
+            job = {
+                "id": uuid.uuid4().hex,
+                "name": name,
+                "status": "queued",
+                "progress": 0.0,
+                "message": "等待处理",
+                "duration": None,
+                "embedding_saved": False,
+                "created_at": time.time(),
+                "finished_at": None
+            }
+            self._jobs[job["id"]] = job
+            snapshot = dict(job)
+        self._executor.submit(self._run, job["id"], name, audio_data, voiceprint_dir, asr_system)
+        logger.info(f"[声纹注册] 已登记任务 {job['id'][:8]}: {name}")
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self) -> List[Dict]:
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def _update(self, job_id: str, status: str, message: str, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields, status=status, message=message, progress=STAGE_PROGRESS[status])
+            if status in FINISHED_STAGES:
+                job["finished_at"] = time.time()
+                self._trim_finished()
+            snapshot = dict(job)
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"[声纹注册] 进度回调失败: {e}")
+
+    def _trim_finished(self):
+        """只保留最近的已结束任务（调用方持有锁）"""
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in FINISHED_STAGES]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    def _run(self, job_id: str, name: str, audio_data: str, voiceprint_dir: str, asr_system):
+        wav_path = os.path.join(voiceprint_dir, f"{name}.wav")
+        npy_path = os.path.join(voiceprint_dir, f"{name}.npy")
+        temp_path = os.path.join(voiceprint_dir, f"temp_{name}.wav")
+        start = time.perf_counter()
+        try:
+            # 前端发送的格式: "data:audio/wav;base64,<base64_data>"
+            self._update(job_id, "decoding", "正在解码音频")
+            audio_base64 = audio_data.split(",", 1)[1] if "," in audio_data else audio_data
+            try:
+                audio_bytes = base64.b64decode(audio_base64)
+            except ValueError as e:
+                raise EnrollmentError(f"音频数据无效: {e}")
+            os.makedirs(voiceprint_dir, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(audio_bytes)
+
+            self._update(job_id, "validating", "正在检查录音时长")
+            try:
+                import soundfile as sf
+                duration = sf.info(temp_path).duration
+            except Exception as e:
+                raise EnrollmentError(f"音频验证失败: {e}")
+            if duration < MIN_DURATION:
+                raise EnrollmentError(f"录制时长太短 ({duration:.1f}秒)，至少需要 {MIN_DURATION} 秒")
+            if duration > MAX_DURATION:
+                raise EnrollmentError(f"录制时长太长 ({duration:.1f}秒)，最多 {MAX_DURATION} 秒")
+            if os.path.exists(wav_path):
+                raise EnrollmentError(f"说话人 '{name}' 已存在")
+
+            if asr_system is None:
+                # ASR 系统未初始化，只保存 WAV 文件，下次正常启动时计算嵌入
+                os.replace(temp_path, wav_path)
+                voiceprint_catalog.refresh_entry(voiceprint_dir, name)
+                self._update(
+                    job_id, "done", f"声纹已保存: {name}（仅音频文件，嵌入将在下次正常启动时计算）",
+                    duration=round(duration, 2)
+                )
+                return
+
+            self._update(job_id, "converting", "正在转换音频格式", duration=round(duration, 2))
+            asr_system.check_and_convert_audio(temp_path)
+            os.replace(temp_path, wav_path)
+
+            self._update(job_id, "embedding", "正在计算声纹嵌入")
+            embedding = asr_system.extract_embedding(wav_path)
+            if embedding is None:
+                os.remove(wav_path)
+                raise EnrollmentError("声纹嵌入计算失败")
+            import numpy as np
+            np.save(npy_path, embedding)
+            # 直接插入运行中的声纹库，实时识别立即生效
+            asr_system.add_speaker(name, embedding, wav_path)
+            # 在工作线程中预先读取新声纹的元数据，列表请求无需解析音频头
+            voiceprint_catalog.refresh_entry(voiceprint_dir, name)
+            self._update(job_id, "done", f"声纹已保存: {name}", embedding_saved=True)
+            logger.info(f"[声纹注册] {name} 注册完成，耗时 {time.perf_counter() - start:.1f}s")
+        except EnrollmentError as e:
+            self._update(job_id, "failed", str(e))
+            logger.info(f"[声纹注册] {name} 注册失败: {e}")
+        except Exception as e:
+            self._update(job_id, "failed", f"保存失败: {e}")
+            logger.error(f"[声纹注册] {name} 处理出错: {e}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def shutdown(self):
+        """停止接收新任务（已开始的任务在后台线程中完成）"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局声纹注册任务队列
+voiceprint_enrollment = VoiceprintEnrollment()
@@ -0,0 +1,163 @@
+"""
+WebSocket 消息的线路编码
+
+服务端内部统一使用 JSON 文本（广播只序列化一次，重放环保存 JSON），发送到连接时按客户端协商的编码转换：
+- json: 原样发送文本帧（默认）
+- msgpack: 高频字段换用短键后以 MessagePack 二进制帧发送（需安装 msgpack）
+客户端以连接参数 ?encoding=msgpack 请求二进制编码，服务端在首条消息中以 JSON 文本告知实际使用的编码与短键表。
+文本帧始终是未缩短键的 JSON：顶层字段与短键重名的消息仍以文本帧发送，避免客户端误展开。
+同一条广播发往多个二进制客户端时只转换一次。
+permessage-deflate 压缩与编码无关，由 uvicorn 在握手时协商（配置项 ws_per_message_deflate）。
+"""
+
+import json
+from collections import OrderedDict
+from typing import Dict
+
+from fastapi import WebSocket
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# 高频消息（转写、流式输出、完成通知）顶层字段的短键
+SHORT_KEYS = {
+    "type": "t",
+    "content": "c",
+    "seq": "s",
+    "model": "m",
+    "text": "x",
+    "speaker": "sp",
+    "time": "tm",
+    "full_text": "f",
+    "chat_id": "ci",
+    "messages": "ms",
+}
+_SHORT_NAMES = frozenset(SHORT_KEYS.values())
+# 最近转换结果的缓存条数（广播文本在各客户端的发送队列中共享）
+PACK_CACHE_SIZE = 64
+
+
+def encode_json(message) -> str:
+    """序列化为紧凑 JSON 文本（与 send_json 的输出格式一致）"""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(message).decode("utf-8")
+        except TypeError:
+            # orjson 不支持的类型（如非字符串键）回退到标准库
+            pass
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def _decode_json(text: str):
+    return orjson.loads(text) if ORJSON_AVAILABLE else json.loads(text)
+
+
+class JsonCodec:
+    """文本帧（默认编码）"""
+
+    name = "json"
+    binary = False
+
+    async def send(self, websocket: WebSocket, text: str):
+        await websocket.send_text(text)
+
+
+class MsgpackCodec:
+    """
+    短键 MessagePack 二进制帧
+
+    Args:
+        cache_size: 缓存最近转换结果的条数
+    """
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self, cache_size: int = PACK_CACHE_SIZE):
+        self.cache_size = cache_size
+        # id(文本) -> (文本, 二进制)；保留文本引用以保证 id 不被复用
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self._stats = {"frames": 0, "packed": 0, "text_fallbacks": 0, "json_bytes": 0, "packed_bytes": 0}
+
+    def encode(self, text: str):
+        """转换为二进制帧；不宜缩短键的消息原样返回文本"""
+        self._stats["frames"] += 1
+        cached = self._cache.get(id(text))
+        if cached is not None and cached[0] is text:
+            self._cache.move_to_end(id(text))
+            return cached[1]
+        message = _decode_json(text)
+        if isinstance(message, dict) and not _SHORT_NAMES.isdisjoint(message):
+            frame = text
+            self._stats["text_fallbacks"] += 1
+        else:
+            if isinstance(message, dict):
+                message = {SHORT_KEYS.get(key, key): value for key, value in message.items()}
+            frame = msgpack.packb(message, use_bin_type=True)
+            self._stats["packed"] += 1
+            self._stats["json_bytes"] += len(text.encode("utf-8"))
+            self._stats["packed_bytes"] += len(frame)
+        self._cache[id(text)] = (text, frame)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return frame
+
+    async def send(self, websocket: WebSocket, text: str):
+        frame = self.encode(text)
+        if frame is text:
+            await websocket.send_text(text)
+        else:
+            await websocket.send_bytes(frame)
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats["ratio"] = round(stats["packed_bytes"] / stats["json_bytes"], 3) if stats["json_bytes"] else 0.0
+        return stats
+
+
+JSON_CODEC = JsonCodec()
+MSGPACK_CODEC = MsgpackCodec() if MSGPACK_AVAILABLE else None
+
+
+def negotiate_codec(websocket: WebSocket):
+    """
+    按连接参数 encoding 选择编码
+
+    Returns:
+        (编码, 告知客户端的首条消息文本；客户端未指定编码时为 None)
+    """
+    requested = websocket.query_params.get("encoding")
+    if not requested:
+        return JSON_CODEC, None
+    codec = JSON_CODEC
+    if requested == "msgpack":
+        if MSGPACK_CODEC is not None:
+            codec = MSGPACK_CODEC
+        else:
+            logger.info("[WS编码] 客户端请求 msgpack，但未安装 msgpack，使用 JSON")
+    elif requested != "json":
+        logger.info(f"[WS编码] 未知的编码 {requested}，使用 JSON")
+    notice = {"codec": {"encoding": codec.name}}
+    if codec.binary:
+        notice["codec"]["keys"] = {short: key for key, short in SHORT_KEYS.items()}
+    return codec, encode_json(notice)
+
+
+def codec_stats() -> Dict:
+    return {
+        "msgpack_available": MSGPACK_AVAILABLE,
+        "msgpack": MSGPACK_CODEC.stats() if MSGPACK_CODEC is not None else None
+    }
@@ -0,0 +1,300 @@
+"""
+WebSocket 广播扇出
+
+每个客户端拥有一个有界发送队列，由独立的写协程逐条发送，广播只把消息放入各队列而不等待发送，
+一个卡住的浏览器标签页不会拖慢其他客户端。队列满时按慢消费者策略处理：
+- drop_oldest: 丢弃最旧的消息
+- coalesce: 带合并键的消息（如 ASR 状态）替换队列中同键的旧消息，其余消息同 drop_oldest
+连续丢弃达到一整个队列仍无进展、或单次发送超时的客户端会被断开。
+广播消息只序列化一次（安装 orjson 时使用 orjson），所有客户端共享同一份文本，
+发送时按各客户端协商的线路编码（JSON 文本或 MessagePack，见 ws_codec）转换。
+
+广播消息带有递增序号 seq 并保存在有界重放环中，客户端重连时可从最后收到的序号续传，
+只补发缺失的部分。
+"""
+
+import asyncio
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from fastapi import WebSocket
+
+from logger_config import setup_logger
+from ws_codec import JSON_CODEC, encode_json
+
+logger = setup_logger(__name__)
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_SEND_TIMEOUT = 10.0
+SLOW_POLICIES = ("drop_oldest", "coalesce")
+# 断开慢消费者使用的关闭码（Try Again Later）
+SLOW_CONSUMER_CLOSE_CODE = 1013
+DEFAULT_REPLAY_SIZE = 1024
+DEFAULT_REPLAY_BYTES = 4 * 1024 * 1024
+
+
+def inject_seq(text: str, seq: int) -> str:
+    """在已序列化的 JSON 对象文本开头插入 seq 字段，无需重新序列化"""
+    if text == "{}":
+        return f'{{"seq":{seq}}}'
+    return f'{{"seq":{seq},' + text[1:]
+
+
+class ReplayRing:
+    """
+    带序号的发送记录环（按条数与字节数限制）
+
+    Args:
+        capacity: 最多保留的条数
+        max_bytes: 最多保留的总字节数（按字符数估算）
+    """
+
+    def __init__(self, capacity: int = DEFAULT_REPLAY_SIZE, max_bytes: int = DEFAULT_REPLAY_BYTES):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._entries: Deque[Tuple[int, str]] = deque()
+        self._bytes = 0
+        self.last_seq = 0
+
+    def append(self, text: str) -> Tuple[int, str]:
+        """分配下一个序号并记录；返回 (序号, 带序号的文本)"""
+        self.last_seq += 1
+        text = inject_seq(text, self.last_seq)
+        self._entries.append((self.last_seq, text))
+        self._bytes += len(text)
+        while self._entries and (len(self._entries) > self.capacity or self._bytes > self.max_bytes):
+            self._bytes -= len(self._entries.popleft()[1])
+        return self.last_seq, text
+
+    def since(self, seq: int) -> Tuple[bool, List[str]]:
+        """
+        取出序号大于 seq 的记录
+
+        Returns:
+            (是否完整, 记录文本列表)；seq 之后的部分记录已被淘汰时不完整
+        """
+        oldest = self._entries[0][0] if self._entries else self.last_seq + 1
+        complete = seq + 1 >= oldest or seq >= self.last_seq
+        return complete, [text for entry_seq, text in self._entries if entry_seq > seq]
+
+    def stats(self) -> Dict:
+        return {"last_seq": self.last_seq, "entries": len(self._entries), "bytes": self._bytes}
+
+
+class _ClientChannel:
+    """单个客户端的发送队列与写协程"""
+
+    def __init__(self, websocket: WebSocket, client_id: int, codec=JSON_CODEC):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.codec = codec
+        # 队列元素为 [合并键, 已序列化的消息]；合并时直接替换消息，保持原位置
+        self.queue: Deque[list] = deque()
+        self.keyed: Dict[str, list] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # 上次成功发送后连续丢弃的消息数
+        self.drops_since_send = 0
+        self.connected_at = time.time()
+
+
+class FanoutManager:
+    """
+    按客户端排队的 WebSocket 广播管理器
+
+    Args:
+        name: 日志标签
+        queue_size: 每个客户端的队列上限
+        policy: 慢消费者策略，drop_oldest 或 coalesce
+        send_timeout: 单条消息发送超时（秒），超时即断开该客户端
+        replay_size: 重放环保留的广播条数
+    """
+
+    def __init__(
+        self,
+        name: str = "WS广播",
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        policy: str = "coalesce",
+        send_timeout: float = DEFAULT_SEND_TIMEOUT,
+        replay_size: int = DEFAULT_REPLAY_SIZE
+    ):
+        if policy not in SLOW_POLICIES:
+            raise ValueError(f"未知的慢消费者策略: {policy}")
+        self.name = name
+        self.queue_size = max(1, queue_size)
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self._channels: Dict[WebSocket, _ClientChannel] = {}
+        self._next_id = 0
+        self._ring = ReplayRing(replay_size)
+        self._stats = {"broadcasts": 0, "sent": 0, "dropped": 0, "coalesced": 0, "send_errors": 0, "slow_disconnects": 0,
+                       "replayed": 0}
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self._channels)
+
+    # ---- 连接 ----
+
+    async def connect(self, websocket: WebSocket, codec=JSON_CODEC, notice: Optional[str] = None):
+        """
+        接受连接并启动写协程
+
+        Args:
+            codec: 线路编码（ws_codec.negotiate_codec 的结果）
+            notice: 编码协商结果，作为首条文本消息发送
+        """
+        await websocket.accept()
+        if notice is not None:
+            await websocket.send_text(notice)
+        self._next_id += 1
+        channel = _ClientChannel(websocket, self._next_id, codec)
+        channel.task = asyncio.create_task(self._writer(channel))
+        self._channels[websocket] = channel
+        logger.info(f"[{self.name}] 客户端 #{channel.client_id} 已连接（{codec.name}），当前 {len(self._channels)} 个")
+
+    def disconnect(self, websocket: WebSocket):
+        """移除客户端（可重复调用）"""
+        channel = self._channels.pop(websocket, None)
+        if channel is None:
+            return
+        if channel.task and channel.task is not asyncio.current_task():
+            channel.task.cancel()
+        logger.info(
+            f"[{self.name}] 客户端 #{channel.client_id} 已断开（发送 {channel.sent}，丢弃 {channel.dropped}），"
+            f"当前 {len(self._channels)} 个"
+        )
+
+    # ---- 发送 ----
+
+    def send(self, websocket: WebSocket, message: dict, coalesce_key: Optional[str] = None) -> bool:
+        """
+        向单个客户端排队发送消息（与广播共用队列，保持顺序）
+
+        Returns:
+            是否已入队（客户端不存在时为 False）
+        """
+        channel = self._channels.get(websocket)
+        if channel is None:
+            return False
+        self._offer(channel, encode_json(message), coalesce_key)
+        return True
+
+    def resume(self, websocket: WebSocket, since: int) -> bool:
+        """
+        客户端重连后补发序号大于 since 的广播（先发送一条 replay 说明）
+
+        Returns:
+            补发是否完整
+        """
+        channel = self._channels.get(websocket)
+        if channel is None:
+            return False
+        complete, texts = self._ring.since(since)
+        notice = {"replay": {"since": since, "latest": self._ring.last_seq, "count": len(texts), "complete": complete}}
+        # 补发内容直接入队，不受队列上限限制（总量受重放环限制）
+        channel.queue.append([None, encode_json(notice)])
+        channel.queue.extend([None, text] for text in texts)
+        channel.wakeup.set()
+        self._stats["replayed"] += len(texts)
+        logger.info(
+            f"[{self.name}] 客户端 #{channel.client_id} 从序号 {since} 续传，补发 {len(texts)} 条"
+            f"{'' if complete else '（部分消息已淘汰）'}"
+        )
+        return complete
+
+    def publish(self, message: dict, coalesce_key: Optional[str] = None):
+        """把消息序列化一次、分配序号后放入所有客户端的队列，立即返回"""
+        self._stats["broadcasts"] += 1
+        _, text = self._ring.append(encode_json(message))
+        for channel in list(self._channels.values()):
+            self._offer(channel, text, coalesce_key)
+
+    async def broadcast(self, message: dict, coalesce_key: Optional[str] = None):
+        """兼容原有的 await broadcast(...) 调用，不等待实际发送"""
+        self.publish(message, coalesce_key)
+
+    def _offer(self, channel: _ClientChannel, message: str, coalesce_key: Optional[str]):
+        if self.policy == "coalesce" and coalesce_key is not None:
+            entry = channel.keyed.get(coalesce_key)
+            if entry is not None:
+                entry[1] = message
+                channel.coalesced += 1
+                self._stats["coalesced"] += 1
+                return
+
+        if len(channel.queue) >= self.queue_size:
+            dropped = channel.queue.popleft()
+            if dropped[0] is not None and channel.keyed.get(dropped[0]) is dropped:
+                del channel.keyed[dropped[0]]
+            channel.dropped += 1
+            channel.drops_since_send += 1
+            self._stats["dropped"] += 1
+            if channel.drops_since_send >= self.queue_size:
+                self._drop_slow_client(channel, f"连续丢弃 {channel.drops_since_send} 条消息")
+                return
+
+        entry = [coalesce_key, message]
+        channel.queue.append(entry)
+        if coalesce_key is not None:
+            channel.keyed[coalesce_key] = entry
+        channel.wakeup.set()
+
+    async def _writer(self, channel: _ClientChannel):
+        websocket = channel.websocket
+        try:
+            while True:
+                if not channel.queue:
+                    channel.wakeup.clear()
+                    await channel.wakeup.wait()
+                    continue
+                entry = channel.queue.popleft()
+                if entry[0] is not None and channel.keyed.get(entry[0]) is entry:
+                    del channel.keyed[entry[0]]
+                try:
+                    await asyncio.wait_for(channel.codec.send(websocket, entry[1]), self.send_timeout)
+                except asyncio.TimeoutError:
+                    self._drop_slow_client(channel, f"发送超过 {self.send_timeout:g}s 未完成")
+                    return
+                except Exception as e:
+                    self._stats["send_errors"] += 1
+                    logger.warning(f"[{self.name}] 客户端 #{channel.client_id} 发送失败，移除连接: {e}")
+                    self.disconnect(websocket)
+                    return
+                channel.sent += 1
+                channel.drops_since_send = 0
+                self._stats["sent"] += 1
+        except asyncio.CancelledError:
+            pass
+
+    def _drop_slow_client(self, channel: _ClientChannel, reason: str):
+        self._stats["slow_disconnects"] += 1
+        logger.warning(f"[{self.name}] 客户端 #{channel.client_id} 消费过慢（{reason}），断开连接")
+        self.disconnect(channel.websocket)
+        asyncio.create_task(self._close_quietly(channel.websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    # ---- 统计 ----
+
+    def stats(self) -> Dict:
+        depths = [len(channel.queue) for channel in self._channels.values()]
+        return {
+            **self._stats,
+            "clients": len(depths),
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "encodings": dict(Counter(channel.codec.name for channel in self._channels.values())),
+            "replay": self._ring.stats()
+        }